@@ -0,0 +1,120 @@
+"""
+Raw Graph API ad records → row tuples for db.postgres_client.upsert_ad_rows.
+
+An AdNormalizer handles the ads of one page and can be fed in chunks: one Graph API
+result page at a time while streaming, a whole fetch at once, or records replayed from
+a cassette. It keeps the page's reach totals over everything it was fed. Rows come out
+in AD_ROW_COLUMNS order, the column order of UPSERT_AD_SQL, so nothing is converted
+again on the way to the database.
+
+Ad bodies are encoded with orjson when it is installed (pip install orjson), json otherwise.
+"""
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+if orjson is not None:
+    JSON_CODEC = "orjson"
+
+    def dumps(value):
+        return orjson.dumps(value).decode()
+else:
+    JSON_CODEC = "json"
+    dumps = json.dumps
+
+AD_ROW_COLUMNS = (
+    "ad_id", "page_id", "ad_creation_time", "ad_delivery_start_time",
+    "ad_delivery_stop_time", "ad_snapshot_url", "eu_total_reach",
+    "is_active", "beneficiary", "search_term_id", "description",
+)
+ROW_AD_ID = 0
+ROW_REACH = 6
+
+
+def reach_value(reach):
+    """eu_total_reach as an int: a number, or the upper bound of a {'lb', 'ub'} range."""
+    if isinstance(reach, (int, float)):
+        return int(reach)
+    if isinstance(reach, dict) and 'ub' in reach:
+        return int(reach['ub'])
+    return 0
+
+
+class AdNormalizer:
+    """
+    Collects the rows of one page's ads. Only active ads become rows; ads created
+    before min_date are dropped. total_reach / active_reach cover all ads fed that
+    passed the date filter, stopped ones included in total_reach.
+    """
+    __slots__ = ("page_id", "min_date", "search_term_id", "rows", "total_reach", "active_reach")
+
+    def __init__(self, page_id, min_date=None, search_term_id=None):
+        self.page_id = page_id
+        # ISO dates order like strings: compare 'YYYY-MM-DD' prefixes instead of parsing
+        self.min_date = min_date.isoformat() if hasattr(min_date, "isoformat") else min_date
+        self.search_term_id = search_term_id
+        self.rows = []
+        self.total_reach = 0
+        self.active_reach = 0
+
+    def feed(self, records):
+        """Normalize a chunk of raw ads. Returns the rows it added."""
+        page_id = self.page_id
+        min_date = self.min_date
+        search_term_id = self.search_term_id
+        encode = dumps
+        rows = []
+        append = rows.append
+        total = active = 0
+
+        for ad in records:
+            get = ad.get
+            created = get("ad_creation_time")
+            if min_date and created and created[:10] < min_date:
+                continue
+
+            reach = get("eu_total_reach", 0)
+            if type(reach) is not int:
+                reach = reach_value(reach)
+            total += reach
+
+            # Stopped ads count towards total reach but aren't stored
+            if "ad_delivery_stop_time" in ad:
+                continue
+            active += reach
+
+            beneficiary = None
+            payers = get("beneficiary_payers")
+            if type(payers) is list:
+                for payer in payers:
+                    if "beneficiary" in payer:
+                        beneficiary = payer["beneficiary"]
+                        break
+
+            description = None
+            bodies = get("ad_creative_bodies")
+            if bodies:
+                try:
+                    description = encode(bodies)
+                except (TypeError, ValueError):
+                    pass
+
+            append((
+                get("id"), page_id, created, get("ad_delivery_start_time"), None,
+                get("ad_snapshot_url"), reach, True, beneficiary, search_term_id, description,
+            ))
+
+        self.rows.extend(rows)
+        self.total_reach += total
+        self.active_reach += active
+        return rows
+
+
+def normalize_ads(page_id, records, min_date=None, search_term_id=None):
+    """One-shot AdNormalizer: (rows, total_eu_reach_sum, active_total_eu_reach_sum)."""
+    normalizer = AdNormalizer(page_id, min_date, search_term_id)
+    normalizer.feed(records)
+    return normalizer.rows, normalizer.total_reach, normalizer.active_reach
@@ -0,0 +1,156 @@
+"""
+Record/replay cassettes for Meta Graph API traffic.
+
+record: every request made by MetaClient goes to Meta as usual and the
+        request/response pair (status, headers incl. x-business-use-case-usage,
+        body, latency) is appended to a gzip'd JSON-lines file.
+replay: requests are served from that file instead, in recorded order per
+        request, sleeping for the original latency times a scale factor
+        (0 = as fast as possible). Nothing leaves the machine.
+
+Requests are matched on path + query with `access_token` stripped, so a replay
+is independent of which tokens the pool hands out. Recorded bodies and headers
+have their access_token= values redacted (paging.next links, ad_snapshot_url),
+so cassettes can be shared.
+"""
+import atexit
+import gzip
+import json
+import logging
+import os
+import threading
+import time
+from collections import defaultdict
+from datetime import timedelta
+from urllib.parse import urlsplit, parse_qsl, urlencode
+
+import requests
+from requests.structures import CaseInsensitiveDict
+
+from utils.tracing import redact_tokens
+
+logger = logging.getLogger(__name__)
+
+RECORD = "record"
+REPLAY = "replay"
+
+
+class CassetteMiss(requests.exceptions.RequestException):
+    """Replay found no recorded response for a request."""
+
+
+def request_key(url, params=None):
+    """Canonical form of a request: path + sorted query, without the access token."""
+    parts = urlsplit(url)
+    query = parse_qsl(parts.query, keep_blank_values=True)
+    if params:
+        query += [(k, v if isinstance(v, str) else json.dumps(v)) for k, v in params.items()]
+    query = sorted((k, v) for k, v in query if k != "access_token")
+    return f"{parts.path}?{urlencode(query)}"
+
+
+class CassetteResponse:
+    """The subset of requests.Response that MetaClient uses."""
+
+    def __init__(self, entry, url):
+        self.status_code = entry["status"]
+        self.headers = CaseInsensitiveDict(entry.get("headers") or {})
+        self.text = entry.get("body", "")
+        self.elapsed = timedelta(seconds=entry.get("elapsed", 0))
+        self.url = url
+
+    @property
+    def ok(self):
+        return self.status_code < 400
+
+    def json(self):
+        return json.loads(self.text)
+
+    def raise_for_status(self):
+        if not self.ok:
+            raise requests.exceptions.HTTPError(f"{self.status_code} Error for url: {self.url}", response=self)
+
+
+class Cassette:
+    def __init__(self, path, mode, latency_scale=1.0):
+        if mode not in (RECORD, REPLAY):
+            raise ValueError(f"Invalid cassette mode: {mode}")
+        self.path = path
+        self.mode = mode
+        self.latency_scale = latency_scale
+        self._lock = threading.Lock()
+        self._entries = defaultdict(list)
+        self._served = defaultdict(int)
+        self._file = None
+
+        if mode == REPLAY:
+            self._load()
+        else:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            # Appending adds a new gzip member; gzip readers handle concatenated members
+            self._file = gzip.open(path, "at", encoding="utf-8")
+
+    def _load(self):
+        count = 0
+        with gzip.open(self.path, "rt", encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    entry = json.loads(line)
+                    self._entries[entry["key"]].append(entry)
+                    count += 1
+        logger.info(f"Cassette: loaded {count} recorded responses from {self.path}")
+
+    def get(self, url, params=None, http_get=requests.get, **kwargs):
+        key = request_key(url, params)
+        if self.mode == REPLAY:
+            return self._replay(key, url)
+
+        start = time.monotonic()
+        response = http_get(url, params=params, **kwargs)
+        entry = {
+            "key": key,
+            "status": response.status_code,
+            "headers": {k: redact_tokens(v) for k, v in response.headers.items()},
+            "body": redact_tokens(response.text),
+            "elapsed": round(time.monotonic() - start, 4),
+        }
+        with self._lock:
+            if self._file:
+                self._file.write(json.dumps(entry) + "\n")
+        return response
+
+    def _replay(self, key, url):
+        with self._lock:
+            entries = self._entries.get(key)
+            if not entries:
+                raise CassetteMiss(f"No recorded response for {key}")
+            # Serve recorded responses in order; once exhausted keep serving the last one
+            i = self._served[key]
+            self._served[key] = i + 1
+            entry = entries[min(i, len(entries) - 1)]
+
+        if self.latency_scale > 0:
+            time.sleep(entry.get("elapsed", 0) * self.latency_scale)
+        return CassetteResponse(entry, url)
+
+    def close(self):
+        with self._lock:
+            if self._file:
+                self._file.close()
+                self._file = None
+
+
+_cassettes = {}
+_cassettes_lock = threading.Lock()
+
+
+def get_cassette(path, mode, latency_scale=1.0):
+    """One Cassette per path for the whole process, shared by every MetaClient."""
+    with _cassettes_lock:
+        if path not in _cassettes:
+            cassette = Cassette(path, mode, latency_scale)
+            if mode == RECORD:
+                # The gzip trailer is only written on close
+                atexit.register(cassette.close)
+            _cassettes[path] = cassette
+        return _cassettes[path]
@@ -3,6 +3,15 @@ import time
 import logging
 from db.postgres_client import get_conn, get_active_token, mark_token_cooldown, mark_token_invalid, update_token_heartbeat
 import json
+from config.settings import (
+    META_GRAPH_URL, META_API_VERSION, META_PAGE_DELAY,
+    META_CASSETTE_MODE, META_CASSETTE_PATH, META_CASSETTE_LATENCY_SCALE,
+)
+from api.cassette import get_cassette
+from utils.tracing import start_span
+from utils.metrics import META_REQUESTS, META_REQUEST_SECONDS
+from api.usage_telemetry import usage_recorder
+from api.token_budget import token_budget
 # from config.settings import META_ACCESS_TOKEN # Removed
 
 # Configure logging
@@ -13,6 +22,19 @@ INVALID_CODES = {190, 100, 102}
 RATE_LIMIT_CODES = {17, 4, 32, 613}
 LIMIT_STEPS = [500, 200, 100, 50]
 
+# Step 3 field tiers: the light set is enough to refresh reach / delivery of stored ads,
+# the full set (creatives, payers, snapshot) is only requested for ads we don't have yet
+LIGHT_AD_FIELDS = "id,ad_creation_time,ad_delivery_start_time,ad_delivery_stop_time,eu_total_reach"
+FULL_AD_FIELDS = "id,page_id,page_name,ad_creation_time,ad_delivery_start_time,ad_delivery_stop_time,ad_snapshot_url,eu_total_reach,is_active_status,beneficiary_payers,ad_creative_bodies"
+IDS_PER_REQUEST = 50  # Graph API ?ids= lookups accept at most 50 ids
+# On ?ids= lookups code 803 ("Some of the aliases you requested do not exist") means an id
+# doesn't resolve (ad removed since it was listed), not a bad token
+LOOKUP_NOT_FOUND_CODES = {803}
+
+
+class AdsLookupError(Exception):
+    """An ?ids= lookup was refused because some of the ids no longer exist."""
+
 def reduce_limit(current: int) -> int:
     if current not in LIMIT_STEPS:
         return 100
@@ -30,19 +52,30 @@ def extract_meta_error(response):
     except Exception:
         return None, None
 
-def calculate_cooldown_from_headers(response):
+def parse_usage_header(response):
     """
-    Reads x-business-use-case-usage and returns cooldown minutes or None.
+    Returns the first usage entry of x-business-use-case-usage
+    (call_count, total_cputime, total_time, estimated_time_to_regain_access, ...) or None.
     """
     header_value = response.headers.get("x-business-use-case-usage")
     if not header_value:
         return None
-
     try:
         header_json = json.loads(header_value)
         first_key = next(iter(header_json))
-        usage = header_json[first_key][0]
+        return header_json[first_key][0]
+    except Exception:
+        return None
+
+def cooldown_minutes_from_usage(usage):
+    """
+    Cooldown minutes after a rate limit, from a parsed usage entry, or None.
+    Pure function so tools/capacity_simulator.py models exactly the same policy.
+    """
+    if not usage:
+        return None
 
+    try:
         estimated = usage.get("estimated_time_to_regain_access")
         if estimated is None:
             return None
@@ -63,23 +96,22 @@ def calculate_cooldown_from_headers(response):
     except Exception:
         return None
 
+def calculate_cooldown_from_headers(response):
+    """
+    Reads x-business-use-case-usage and returns cooldown minutes or None.
+    """
+    return cooldown_minutes_from_usage(parse_usage_header(response))
 
-def check_if_token_exhausted(response, token):
+
+def proactive_rotation_from_usage(usage):
     """
-    Proactive check after a SUCCESSFUL response.
-    If usage >= 90%, rotate token BEFORE hitting a hard rate limit.
-    Mirrors C# CheckIfAccessTokenExhausted.
-    Returns (should_rotate: bool, cooldown_minutes: int)
+    (should_rotate, cooldown_minutes) for a parsed usage entry after a successful call.
+    Pure function shared with tools/capacity_simulator.py.
     """
-    header_value = response.headers.get("x-business-use-case-usage")
-    if not header_value:
+    if not usage:
         return False, 0
 
     try:
-        header_json = json.loads(header_value)
-        first_key = next(iter(header_json))
-        usage = header_json[first_key][0]
-
         total_time = usage.get("total_time", 0) or 0
         total_cputime = usage.get("total_cputime", 0) or 0
         max_time = max(total_time, total_cputime)
@@ -87,9 +119,6 @@ def check_if_token_exhausted(response, token):
         if max_time >= 90:
             # (maxTime - 88) * 30 — same formula as C#
             delay = max(1, int((max_time - 88) * 30))
-            logger.warning(
-                f"Proactive token rotation: usage {max_time}% >= 90%% → cooldown {delay} min"
-            )
             return True, delay
     except Exception:
         pass
@@ -97,13 +126,54 @@ def check_if_token_exhausted(response, token):
     return False, 0
 
 
+def check_if_token_exhausted(response, token):
+    """
+    Proactive check after a SUCCESSFUL response.
+    If usage >= 90%, rotate token BEFORE hitting a hard rate limit.
+    Mirrors C# CheckIfAccessTokenExhausted.
+    Returns (should_rotate: bool, cooldown_minutes: int)
+    """
+    usage = parse_usage_header(response)
+    should_rotate, delay = proactive_rotation_from_usage(usage)
+    if should_rotate:
+        max_time = max(usage.get("total_time", 0) or 0, usage.get("total_cputime", 0) or 0)
+        logger.warning(
+            f"Proactive token rotation: usage {max_time}% >= 90%% → cooldown {delay} min"
+        )
+    return should_rotate, delay
+
+
 
 class MetaClient:
-    BASE_URL = "https://graph.facebook.com/v24.0"
+    BASE_URL = f"{META_GRAPH_URL}/{META_API_VERSION}"
     
-    def __init__(self):
+    def __init__(self, cassette=None, base_url=None, stage=None):
         # We no longer hold a static token. We fetch one per request (or session of requests)
-        pass
+        if base_url:
+            self.BASE_URL = base_url.rstrip("/")
+        # Keep-alive connections shared by all worker threads using this client
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=64)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        # Optional record/replay of all HTTP traffic (META_CASSETTE_MODE)
+        if cassette is None and META_CASSETTE_MODE:
+            cassette = get_cassette(META_CASSETTE_PATH, META_CASSETTE_MODE, META_CASSETTE_LATENCY_SCALE)
+        self.cassette = cassette
+        # "terms" / "pages": which token_budget share this client's requests come from
+        self.stage = stage
+
+    def _http_get(self, url, **kwargs):
+        if self.cassette:
+            return self.cassette.get(url, http_get=self.session.get, **kwargs)
+        return self.session.get(url, **kwargs)
+
+    @staticmethod
+    def _record_metrics(response, token, seconds):
+        code = "none" if response.ok else (extract_meta_error(response)[0] or "unknown")
+        suffix = token[-5:]
+        META_REQUESTS.inc(status=response.status_code, code=code, token=suffix)
+        META_REQUEST_SECONDS.observe(seconds, code=code, token=suffix)
 
     def _get_token(self):
         """Fetch a valid token from DB. Retries if none available?"""
@@ -117,9 +187,19 @@ class MetaClient:
         finally:
             conn.close()
 
-    def _make_request(self, params, url_override=None, max_pages=5):
-        """Helper to make requests with basic pagination and error handling."""
+    def _make_request(self, params, url_override=None, max_pages=5, should_continue=None, keyed=False,
+                      report_complete=False):
+        """
+        Helper to make requests with basic pagination and error handling.
+        should_continue(rows) is called with each result page's rows; returning False stops paging.
+        keyed: the response is {id: object} (?ids= lookups) rather than {"data": [...]};
+        LOOKUP_NOT_FOUND_CODES then raise AdsLookupError, and any other error ends the
+        lookup without cooling down or invalidating the token.
+        Errors end paging with what was fetched so far; report_complete=True returns
+        (rows, complete) so callers can tell such a truncated result from the full one.
+        """
         all_data = []
+        failed = False
         url = url_override or f"{self.BASE_URL}/ads_archive"
         page_count = 0
         limit = params.get("limit", 500) if params else 500
@@ -127,6 +207,8 @@ class MetaClient:
         token = self._get_token()
         
         while url and (max_pages is None or page_count < max_pages):
+            response = None
+            req_span = None
             try:
                 # Inject token into params
                 if params:
@@ -140,15 +222,40 @@ class MetaClient:
                 if params and "access_token" in params and "?" not in url:
                      kwargs["params"] = params
                 
-                if params:
+                if params and not keyed:
                     params["limit"] = limit
 
-                response = requests.get(url, **kwargs)
+                req_span = start_span("meta.ads_archive", **{
+                    "meta.token_suffix": token[-5:],
+                    "meta.limit": limit,
+                    "meta.page": page_count,
+                })
+                # Stage clients share the pool through the token budget (no-op unless TOKEN_BUDGET)
+                if self.stage:
+                    token_budget.acquire(self.stage)
+                try:
+                    started = time.monotonic()
+                    response = self._http_get(url, **kwargs)
+                finally:
+                    if self.stage:
+                        token_budget.release(self.stage)
+                req_span.set("http.status_code", response.status_code)
+                self._record_metrics(response, token, time.monotonic() - started)
+                usage_recorder.record(token, parse_usage_header(response))
                 
                 # Check for Rate Limit (Status 400 with specific code or 429) OR Invalid Token (190)
                 if not response.ok:
 
                     code, subcode = extract_meta_error(response)
+                    req_span.error(f"Meta error code={code} subcode={subcode}")
+
+                    # 🔹 LOOKUPS: a refused ?ids= request says nothing reliable about the token
+                    if keyed:
+                        if code in LOOKUP_NOT_FOUND_CODES:
+                            raise AdsLookupError(response.json().get("error", {}).get("message", f"code {code}"))
+                        logger.warning(f"Ads lookup failed (code={code} subcode={subcode}), token left as is")
+                        failed = True
+                        break
 
                     # 🔹 INVALID TOKEN
                     if code in INVALID_CODES or response.status_code in (401, 403):
@@ -237,8 +344,12 @@ class MetaClient:
                 data = response.json()
                 
                 # Append results
+                if keyed:
+                    data = {"data": [obj for obj in data.values() if isinstance(obj, dict)]}
                 if "data" in data:
                     all_data.extend(data["data"])
+                    req_span.set("meta.rows", len(data["data"]))
+                req_span.end()
                 
                 page_count += 1
 
@@ -263,7 +374,10 @@ class MetaClient:
                     pass
                 
                 # Handle pagination
-                if "paging" in data and "next" in data["paging"]:
+                more = "paging" in data and "next" in data["paging"]
+                if should_continue is not None and not should_continue(data.get("data", [])):
+                    more = False
+                if more:
                     url = data["paging"]["next"]
                     # Important: The 'next' URL from Meta ALREADY includes the access_token of the previous request.
                     # We must strip it if we want to use a rotated token, or just rely on 'params=None' logic.
@@ -278,25 +392,40 @@ class MetaClient:
                         url = re.sub(r'access_token=[^&]+', f'access_token={token}', url)
                     
                     params = None 
-                    time.sleep(0.5) 
+                    time.sleep(META_PAGE_DELAY) 
                 else:
                     url = None
                     
             except requests.exceptions.RequestException as e:
                 logger.error(f"API Request failed: {e}")
+                if req_span is not None:
+                    req_span.error(e)
                 if response is not None:
                      logger.error(f"Response content: {response.text}")
+                failed = True
                 break
+            except AdsLookupError:
+                raise
             except Exception as e:
                 logger.error(f"Unexpected error in request: {e}")
+                failed = True
                 break
+            finally:
+                if req_span is not None:
+                    req_span.end()
                 
+        if report_complete:
+            # url is still set when max_pages stopped paging early
+            return all_data, not failed and not url
         return all_data
 
-    def search_ads(self, search_terms, countries, limit=500):
+    def search_ads(self, search_terms, countries, limit=500, delivery_date_min=None,
+                   max_pages=1, should_continue=None):
         """
         Search for ads to identify pages.
-        Fetches up to 500 ads in a single request (no pagination).
+        Fetches up to 500 ads per request; by default a single request (no pagination).
+        delivery_date_min (date): only ads delivered since then (incremental refresh).
+        max_pages / should_continue: deeper paging, see _make_request.
         """
         params = {
             "search_terms": search_terms,
@@ -306,19 +435,43 @@ class MetaClient:
             "fields": "id,page_id,page_name",
             "limit": limit
         }
-        return self._make_request(params, max_pages=1)
+        if delivery_date_min:
+            params["ad_delivery_date_min"] = delivery_date_min.isoformat()
+        return self._make_request(params, max_pages=max_pages, should_continue=should_continue)
 
-    def get_ads_by_page(self, page_id, countries, limit=100):
+    def get_ads_by_page(self, page_id, countries, limit=100, fields=FULL_AD_FIELDS, report_complete=False):
         """
-        Get all ads for a specific page.
+        Get all ads for a specific page (LIGHT_AD_FIELDS for a cheap delivery-only pass).
+        report_complete=True returns (ads, complete), complete False if an error cut the fetch short.
         """
         params = {
             "search_page_ids": page_id,
             "ad_reached_countries": countries,
             "ad_active_status": "ACTIVE", # FORCE ACTIVE ONLY
             "ad_type": "ALL", 
-            "fields": "id,page_id,page_name,ad_creation_time,ad_delivery_start_time,ad_delivery_stop_time,ad_snapshot_url,eu_total_reach,is_active_status,beneficiary_payers,ad_creative_bodies",
+            "fields": fields,
             "limit": limit
         }
-        return self._make_request(params, max_pages=None) # Fetch ALL ads
+        return self._make_request(params, max_pages=None, report_complete=report_complete) # Fetch ALL ads
+
+    def get_ads_by_ids(self, ad_ids, fields=FULL_AD_FIELDS, report_complete=False):
+        """
+        Look up ads by id, IDS_PER_REQUEST per request. Raises AdsLookupError when Graph
+        refuses a batch because one of its ids no longer exists; the caller falls back to
+        get_ads_by_page. Any other error stops the lookup; report_complete=True returns
+        (ads, complete) so the caller can tell.
+        """
+        ads = []
+        complete = True
+        ad_ids = list(ad_ids)
+        for i in range(0, len(ad_ids), IDS_PER_REQUEST):
+            params = {"ids": ",".join(ad_ids[i:i + IDS_PER_REQUEST]), "fields": fields}
+            batch, complete = self._make_request(params, url_override=f"{self.BASE_URL}/", max_pages=1,
+                                                 keyed=True, report_complete=True)
+            ads.extend(batch)
+            if not complete:
+                break
+        if report_complete:
+            return ads, complete
+        return ads
 
@@ -0,0 +1,155 @@
+"""
+Shares Graph API capacity between the stages that use the token pool.
+
+Step 2 (term search) and Step 3 (ad fetch) run at the same time against the same
+meta_tokens pool. With TOKEN_BUDGET enabled every Graph request MetaClient makes for
+a stage holds one of a fixed number of slots while it is in flight; the number of
+slots is the count of usable tokens times TOKEN_BUDGET_SLOTS_PER_TOKEN (re-read every
+TOKEN_BUDGET_REFRESH seconds). Since each request spends roughly the same share of a
+token's hourly budget, slots are capacity.
+
+When stages compete, the next free slot goes to the stage that would be furthest
+below its share after taking it: (in_flight + 1) / effective weight. A stage's effective weight is its configured
+TOKEN_BUDGET_WEIGHTS weight boosted by its share of the total backlog, so whichever
+stage has the pile of pending work gets more of the pool. The budget is work-conserving:
+a stage with nothing waiting leaves its share to the others, and a stage with
+nothing in flight is always served next, so neither can be starved.
+
+With TOKEN_BUDGET disabled acquire() returns immediately and MetaClient behaves as before.
+"""
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+from config.settings import (
+    TOKEN_BUDGET, TOKEN_BUDGET_WEIGHTS, TOKEN_BUDGET_SLOTS_PER_TOKEN,
+    TOKEN_BUDGET_BACKLOG_BOOST, TOKEN_BUDGET_REFRESH,
+)
+from utils.metrics import TOKEN_BUDGET_IN_FLIGHT, TOKEN_BUDGET_WAIT_SECONDS
+
+logger = logging.getLogger(__name__)
+
+
+def parse_weights(spec):
+    """'terms:1,pages:3' → {'terms': 1.0, 'pages': 3.0}"""
+    weights = {}
+    for part in spec.split(","):
+        if not part.strip():
+            continue
+        stage, _, weight = part.partition(":")
+        weights[stage.strip()] = float(weight or 1)
+    return weights
+
+
+class TokenBudget:
+    def __init__(self, weights, slots_per_token=TOKEN_BUDGET_SLOTS_PER_TOKEN,
+                 backlog_boost=TOKEN_BUDGET_BACKLOG_BOOST, refresh=TOKEN_BUDGET_REFRESH,
+                 enabled=TOKEN_BUDGET):
+        self.weights = weights
+        self.slots_per_token = slots_per_token
+        self.backlog_boost = backlog_boost
+        self.refresh = refresh
+        self.enabled = enabled
+        self.capacity = 1
+
+        self._cond = threading.Condition()
+        self._in_flight = {}
+        self._waiting = {}
+        self._backlog = {}
+        self._refreshed_at = 0.0
+
+    # --- Backlog ---
+
+    def add_backlog(self, stage, n):
+        with self._cond:
+            self._backlog[stage] = max(0, self._backlog.get(stage, 0) + n)
+
+    def set_backlog(self, stage, n):
+        with self._cond:
+            self._backlog[stage] = max(0, n)
+
+    def effective_weight(self, stage):
+        weight = self.weights.get(stage, 1.0)
+        total = sum(self._backlog.values())
+        if total:
+            weight *= 1 + self.backlog_boost * self._backlog.get(stage, 0) / total
+        return weight
+
+    # --- Slots ---
+
+    def _next_stage(self):
+        """Waiting stage that gets the next slot: idle stages first, then by share."""
+        waiting = [s for s, n in self._waiting.items() if n]
+        if not waiting:
+            return None
+        return min(waiting, key=lambda s: (
+            self._in_flight.get(s, 0) > 0, (self._in_flight.get(s, 0) + 1) / self.effective_weight(s)
+        ))
+
+    def acquire(self, stage):
+        if not self.enabled:
+            return
+        self._maybe_refresh()
+        start = time.monotonic()
+        with self._cond:
+            self._waiting[stage] = self._waiting.get(stage, 0) + 1
+            try:
+                while sum(self._in_flight.values()) >= self.capacity or self._next_stage() != stage:
+                    self._cond.wait(self.refresh)
+            finally:
+                self._waiting[stage] -= 1
+            self._in_flight[stage] = self._in_flight.get(stage, 0) + 1
+            # Another stage may be next in line for remaining free slots
+            self._cond.notify_all()
+        TOKEN_BUDGET_IN_FLIGHT.inc(stage=stage)
+        TOKEN_BUDGET_WAIT_SECONDS.observe(time.monotonic() - start, stage=stage)
+
+    def release(self, stage):
+        if not self.enabled:
+            return
+        with self._cond:
+            self._in_flight[stage] -= 1
+            self._cond.notify_all()
+        TOKEN_BUDGET_IN_FLIGHT.dec(stage=stage)
+
+    @contextmanager
+    def slot(self, stage):
+        self.acquire(stage)
+        try:
+            yield
+        finally:
+            self.release(stage)
+
+    def _maybe_refresh(self):
+        now = time.monotonic()
+        with self._cond:
+            if now - self._refreshed_at < self.refresh:
+                return
+            self._refreshed_at = now
+
+        from db.postgres_client import get_conn, count_available_tokens
+        try:
+            conn = get_conn()
+            try:
+                tokens = count_available_tokens(conn)
+            finally:
+                conn.close()
+        except Exception as e:
+            logger.warning(f"[Token budget] Could not count tokens: {e}")
+            return
+
+        # At least one slot: with no token left, requests fail fast in MetaClient as before
+        capacity = max(1, tokens * self.slots_per_token)
+        with self._cond:
+            if capacity != self.capacity:
+                logger.info(
+                    f"[Token budget] {self.capacity} → {capacity} slots ({tokens} usable token(s)); "
+                    f"backlog {self._backlog}, weights "
+                    f"{ {s: round(self.effective_weight(s), 2) for s in self.weights} }"
+                )
+                self.capacity = capacity
+                self._cond.notify_all()
+
+
+token_budget = TokenBudget(parse_weights(TOKEN_BUDGET_WEIGHTS))
@@ -0,0 +1,153 @@
+"""
+Token pool health checks through Meta's /debug_token endpoint.
+
+All due tokens are checked concurrently (httpx, TOKEN_HEALTH_CONCURRENCY at a time)
+and the results are written back in one statement: dead or expired tokens become
+INVALID, and every checked token gets `expires_at` and `health_checked_at`, so
+get_active_token can skip tokens about to expire and a token is re-checked only
+once its result is older than TOKEN_HEALTH_TTL. Timeouts and unexpected errors
+leave the token untouched so it is retried on the next run.
+"""
+import asyncio
+import logging
+import threading
+from datetime import datetime, timezone
+
+import httpx
+
+from config.settings import (
+    META_GRAPH_URL, TOKEN_HEALTH_CONCURRENCY, TOKEN_HEALTH_INTERVAL, TOKEN_HEALTH_TTL,
+)
+from db.postgres_client import get_conn, fetch_tokens_for_health_check, apply_token_health
+
+logger = logging.getLogger(__name__)
+
+DEBUG_URL = f"{META_GRAPH_URL}/debug_token"
+
+# OAuth error meaning the token itself is dead (revoked, expired, password changed, ...)
+DEAD_TOKEN_CODE = 190
+
+
+async def check_token(client, token):
+    """
+    Calls /debug_token with the token as its own access_token.
+    Returns a dict: ok (got an answer), is_valid, expires_at (datetime or None = never),
+    app_id, type, scopes, error_code, error_message.
+    """
+    params = {"input_token": token, "access_token": token}
+    try:
+        resp = await client.get(DEBUG_URL, params=params)
+        data = resp.json()
+    except httpx.TimeoutException:
+        return {"ok": False, "is_valid": False, "error_code": "TIMEOUT", "error_message": "Request timed out"}
+    except Exception as e:
+        return {"ok": False, "is_valid": False, "error_code": "EXCEPTION", "error_message": str(e)[:100]}
+
+    if "error" in data:
+        err = data["error"]
+        code = err.get("code")
+        # A dead token can't authenticate its own debug call: that is a definitive answer
+        return {
+            "ok": code == DEAD_TOKEN_CODE,
+            "is_valid": False,
+            "expires_at": None,
+            "error_code": code,
+            "error_message": err.get("message", "")[:100],
+        }
+
+    d = data.get("data", {})
+    expires_ts = d.get("expires_at") or 0  # 0 = never expires
+    expires_at = datetime.fromtimestamp(expires_ts, tz=timezone.utc) if expires_ts else None
+    is_valid = bool(d.get("is_valid", False))
+    if expires_at and expires_at <= datetime.now(timezone.utc):
+        is_valid = False
+    error = d.get("error") if isinstance(d.get("error"), dict) else {}
+    return {
+        "ok": True,
+        "is_valid": is_valid,
+        "expires_at": expires_at,
+        "app_id": d.get("app_id"),
+        "type": d.get("type"),
+        "scopes": d.get("scopes", []),
+        "error_code": error.get("code"),
+        "error_message": error.get("message"),
+    }
+
+
+async def check_tokens(tokens, concurrency=TOKEN_HEALTH_CONCURRENCY, timeout=15):
+    """Check many tokens concurrently. Returns {token: result} in input order."""
+    semaphore = asyncio.Semaphore(concurrency)
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+
+    async with httpx.AsyncClient(timeout=timeout, limits=limits) as client:
+        async def one(token):
+            async with semaphore:
+                return token, await check_token(client, token)
+
+        results = await asyncio.gather(*(one(t) for t in tokens))
+    return dict(results)
+
+
+def reconcile(conn, results):
+    """
+    Write definitive results to meta_tokens in bulk. Returns a summary dict:
+    checked, valid, invalidated, skipped (no definitive answer, retried next run).
+    """
+    rows = [
+        (token, r["is_valid"], r.get("expires_at"), None if r["is_valid"] else r.get("error_message"))
+        for token, r in results.items()
+        if r["ok"]
+    ]
+    apply_token_health(conn, rows)
+    valid = sum(1 for r in rows if r[1])
+    return {
+        "checked": len(results),
+        "valid": valid,
+        "invalidated": len(rows) - valid,
+        "skipped": len(results) - len(rows),
+    }
+
+
+def run_health_check(force=False):
+    """Check every token whose last result is older than TOKEN_HEALTH_TTL (all if `force`)."""
+    conn = get_conn()
+    try:
+        tokens = [row[1] for row in fetch_tokens_for_health_check(conn, None if force else TOKEN_HEALTH_TTL)]
+    finally:
+        conn.close()
+    if not tokens:
+        return {"checked": 0, "valid": 0, "invalidated": 0, "skipped": 0}
+
+    results = asyncio.run(check_tokens(tokens))
+
+    conn = get_conn()
+    try:
+        summary = reconcile(conn, results)
+    finally:
+        conn.close()
+    logger.info(
+        f"[Token health] Checked {summary['checked']}: {summary['valid']} valid, "
+        f"{summary['invalidated']} marked INVALID, {summary['skipped']} without answer."
+    )
+    return summary
+
+
+def start_health_checker(interval=TOKEN_HEALTH_INTERVAL, stop=None):
+    """
+    Run run_health_check() now and every `interval` seconds from a daemon thread.
+    Returns the Event that stops it. interval <= 0 disables the checker.
+    """
+    stop = stop or threading.Event()
+    if interval <= 0:
+        return stop
+
+    def loop():
+        while not stop.is_set():
+            try:
+                run_health_check()
+            except Exception as e:
+                logger.error(f"[Token health] Check failed: {e}")
+            stop.wait(interval)
+
+    threading.Thread(target=loop, daemon=True, name="Token-Health").start()
+    return stop
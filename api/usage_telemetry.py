@@ -0,0 +1,105 @@
+"""
+Per-token usage time series from the x-business-use-case-usage header.
+
+Every Graph API response reports how much of the token's rolling one-hour budget
+is used (call_count / total_cputime / total_time, in %). The recorder keeps those
+in memory and writes them in batches to token_usage_samples (and the latest value
+to meta_tokens.last_usage_pct / last_usage_at, which the default headroom token rotation uses).
+
+Samples are compact: consecutive responses for a token with unchanged usage are
+folded into one row whose `calls` counts them, so a row is written only when the
+usage moves or USAGE_SAMPLE_SECONDS have passed.
+"""
+import logging
+import threading
+import time
+from datetime import datetime, timezone
+
+from config.settings import (
+    USAGE_FLUSH_INTERVAL, USAGE_BATCH_SIZE, USAGE_SAMPLE_SECONDS, USAGE_RETENTION_DAYS,
+)
+
+logger = logging.getLogger(__name__)
+
+
+class UsageRecorder:
+    def __init__(self):
+        self._open = {}        # token → sample being folded: [sampled_at, call_count, cputime, time, regain, calls]
+        self._opened_at = {}   # token → monotonic time the open sample started
+        self._ready = []       # closed samples waiting for the next flush
+        self._lock = threading.Lock()
+        self._thread = None
+        self._wake = threading.Event()
+        self._last_prune = 0.0
+
+    def record(self, token, usage):
+        if not usage or not isinstance(usage, dict):
+            return
+        values = (
+            int(usage.get("call_count", 0) or 0),
+            int(usage.get("total_cputime", 0) or 0),
+            int(usage.get("total_time", 0) or 0),
+            int(usage.get("estimated_time_to_regain_access", 0) or 0),
+        )
+        now = time.monotonic()
+        with self._lock:
+            current = self._open.get(token)
+            if current and tuple(current[1:5]) == values and now - self._opened_at[token] < USAGE_SAMPLE_SECONDS:
+                current[5] += 1
+                return
+            if current:
+                self._ready.append((token, *current))
+            self._open[token] = [datetime.now(timezone.utc), *values, 1]
+            self._opened_at[token] = now
+            if self._thread is None:
+                self._start()
+            if len(self._ready) >= USAGE_BATCH_SIZE:
+                self._wake.set()
+
+    def _start(self):
+        from utils.lifecycle import register_flush_hook
+        register_flush_hook(self.flush)
+        self._thread = threading.Thread(target=self._run, daemon=True, name="Usage-Telemetry")
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            self._wake.wait(USAGE_FLUSH_INTERVAL)
+            self._wake.clear()
+            try:
+                self.flush(close_open=False)
+            except Exception as e:
+                logger.error(f"[Usage] Flush failed: {e}")
+
+    def flush(self, close_open=True):
+        """
+        Write buffered samples. Samples still being folded go too once they are
+        USAGE_SAMPLE_SECONDS old, or all of them on drain (close_open).
+        """
+        from db.postgres_client import get_conn, insert_token_usage_samples, prune_token_usage_samples
+
+        now = time.monotonic()
+        with self._lock:
+            batch, self._ready = self._ready, []
+            for token in list(self._open):
+                if close_open or now - self._opened_at[token] >= USAGE_SAMPLE_SECONDS:
+                    batch.append((token, *self._open.pop(token)))
+                    del self._opened_at[token]
+        if not batch:
+            return 0
+
+        conn = get_conn()
+        try:
+            written = insert_token_usage_samples(conn, batch)
+            if time.monotonic() - self._last_prune > 3600:
+                self._last_prune = time.monotonic()
+                prune_token_usage_samples(conn, USAGE_RETENTION_DAYS)
+        except Exception as e:
+            logger.error(f"[Usage] Dropped {len(batch)} usage samples: {e}")
+            return 0
+        finally:
+            conn.close()
+        return written
+
+
+usage_recorder = UsageRecorder()
@@ -0,0 +1,70 @@
+"""
+Compare two benchmark result files and flag regressions.
+
+    python -m benchmarks.compare baseline.json benchmarks/results/latest.json --threshold 0.10
+
+Compares mean wall time per benchmark. Exits with status 1 if any benchmark got
+slower than the baseline by more than the threshold (0.10 = 10%).
+"""
+import argparse
+import json
+import sys
+
+
+def load(path):
+    with open(path) as f:
+        return json.load(f)["benchmarks"]
+
+
+def compare(baseline, current, threshold, metric="mean_s"):
+    """Returns (rows, regressions). Each row: (name, old, new, change or None, verdict)."""
+    rows, regressions = [], []
+    for name in sorted(set(baseline) | set(current)):
+        if name not in current:
+            rows.append((name, baseline[name][metric], None, None, "missing"))
+            continue
+        if name not in baseline:
+            rows.append((name, None, current[name][metric], None, "new"))
+            continue
+        old, new = baseline[name][metric], current[name][metric]
+        change = new / old - 1 if old else 0.0
+        if change > threshold:
+            verdict = "REGRESSION"
+            regressions.append(name)
+        elif change < -threshold:
+            verdict = "faster"
+        else:
+            verdict = "ok"
+        rows.append((name, old, new, change, verdict))
+    return rows, regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Flag benchmark regressions against a baseline")
+    parser.add_argument("baseline")
+    parser.add_argument("current")
+    parser.add_argument("--threshold", type=float, default=0.10, help="allowed slowdown (0.10 = 10%%)")
+    parser.add_argument("--metric", default="mean_s", choices=["mean_s", "p50_s", "p95_s", "min_s"])
+    args = parser.parse_args(argv)
+
+    rows, regressions = compare(load(args.baseline), load(args.current), args.threshold, args.metric)
+
+    def ms(v):
+        return f"{v * 1000:10.2f}" if v is not None else f"{'-':>10}"
+
+    print(f"{'BENCHMARK':<45} {'BASE ms':>10} {'NEW ms':>10} {'CHANGE':>8}  VERDICT")
+    print("-" * 90)
+    for name, old, new, change, verdict in rows:
+        pct = f"{change:+.1%}" if change is not None else "-"
+        print(f"{name:<45} {ms(old)} {ms(new)} {pct:>8}  {verdict}")
+    print("-" * 90)
+
+    if regressions:
+        print(f"{len(regressions)} regression(s) beyond {args.threshold:.0%}: {', '.join(regressions)}")
+        return 1
+    print(f"No regressions beyond {args.threshold:.0%}.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,328 @@
+"""
+Benchmarks for the pipeline hot paths.
+
+    BENCH_DB_URL=postgresql://postgres@localhost/postgres python -m benchmarks.run
+    python -m benchmarks.run --only normalize_ads,validate_category --out baseline.json
+    python -m benchmarks.compare baseline.json benchmarks/results/latest.json --threshold 0.10
+
+Database benchmarks run in a throwaway schema of BENCH_DB_URL (created and
+dropped by the run) and are skipped when it is unset. The step 4 benchmark
+needs Playwright with Chromium installed. Results are written as JSON.
+"""
+import argparse
+import asyncio
+import importlib.util
+import json
+import logging
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks import synthetic
+
+logger = logging.getLogger(__name__)
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+RESULTS_DIR = os.path.join(HERE, "results")
+
+BENCHMARKS = []
+
+
+def benchmark(name, needs=()):
+    """Register a benchmark. It is a generator yielding (result_name, stats) pairs."""
+    def wrap(fn):
+        BENCHMARKS.append((name, needs, fn))
+        return fn
+    return wrap
+
+
+def stats(samples, items=1):
+    """Summary of per-run wall times; `items` is the work done by one run."""
+    samples = sorted(samples)
+    mean = statistics.fmean(samples)
+    return {
+        "runs": len(samples),
+        "items": items,
+        "mean_s": mean,
+        "min_s": samples[0],
+        "p50_s": statistics.median(samples),
+        "p95_s": samples[min(len(samples) - 1, int(len(samples) * 0.95))],
+        "stdev_s": statistics.stdev(samples) if len(samples) > 1 else 0.0,
+        "items_per_s": items / mean if mean else None,
+    }
+
+
+def timed(fn, repeat, setup=None):
+    samples = []
+    for _ in range(repeat):
+        if setup:
+            setup()
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+class Context:
+    def __init__(self, args):
+        self.repeat = args.repeat
+        self.quick = args.quick
+        self.db_url = os.getenv("BENCH_DB_URL")
+        self.schema = f"bench_{os.getpid()}"
+
+    def connect(self):
+        import psycopg2
+        conn = psycopg2.connect(self.db_url, options=f"-c search_path={self.schema}")
+        conn.autocommit = False
+        return conn
+
+    def setup_db(self):
+        import psycopg2
+        conn = psycopg2.connect(self.db_url)
+        conn.autocommit = True
+        with conn.cursor() as cur:
+            cur.execute(f"CREATE SCHEMA {self.schema}")
+            cur.execute(f"SET search_path TO {self.schema}")
+            with open(os.path.join(HERE, "schema.sql")) as f:
+                cur.execute(f.read())
+        conn.close()
+
+    def teardown_db(self):
+        import psycopg2
+        conn = psycopg2.connect(self.db_url)
+        conn.autocommit = True
+        with conn.cursor() as cur:
+            cur.execute(f"DROP SCHEMA IF EXISTS {self.schema} CASCADE")
+        conn.close()
+
+    def truncate(self, *tables):
+        conn = self.connect()
+        with conn.cursor() as cur:
+            cur.execute(f"TRUNCATE {', '.join(tables)} RESTART IDENTITY")
+        conn.commit()
+        conn.close()
+
+
+# ─── Benchmarks ────────────────────────────────────────────────────────────
+
+@benchmark("normalize_ads")
+def bench_normalize(ctx):
+    from api.ad_normalizer import AdNormalizer, normalize_ads, JSON_CODEC
+    for n in (1000, 10000):
+        records = synthetic.raw_ads(n)
+        samples = timed(lambda: normalize_ads("100000000001", records, None), ctx.repeat)
+        yield f"normalize_ads[{n},{JSON_CODEC}]", stats(samples, n)
+
+    # Streaming: fed one Graph API result page (100 ads) at a time
+    records = synthetic.raw_ads(10000)
+    chunks = [records[i:i + 100] for i in range(0, len(records), 100)]
+
+    def stream():
+        normalizer = AdNormalizer("100000000001")
+        for chunk in chunks:
+            normalizer.feed(chunk)
+
+    yield f"normalize_ads_stream[10000x100,{JSON_CODEC}]", stats(timed(stream, ctx.repeat), len(records))
+
+
+@benchmark("validate_category")
+def bench_validate_category(ctx):
+    from steps.step_5_openai_classification import validate_category, logger as step5_logger
+    outputs = synthetic.classifier_outputs(2000)
+    step5_logger.disabled = True  # partial/invalid matches log on every call
+    try:
+        samples = timed(lambda: [validate_category(o) for o in outputs], ctx.repeat)
+    finally:
+        step5_logger.disabled = False
+    yield "validate_category[2000]", stats(samples, len(outputs))
+
+
+@benchmark("upsert", needs=("db",))
+def bench_upserts(ctx):
+    from db.postgres_client import upsert_pages, upsert_ads
+    sizes = (1000, 10000) if ctx.quick else (1000, 10000, 100000)
+    for n in sizes:
+        rows = synthetic.page_dicts(n)
+        conn = ctx.connect()
+        try:
+            samples = timed(lambda: upsert_pages(conn, rows), ctx.repeat, setup=lambda: ctx.truncate("pages"))
+        finally:
+            conn.close()
+        yield f"upsert_pages[{n}]", stats(samples, n)
+
+    ctx.truncate("pages")
+    conn = ctx.connect()
+    upsert_pages(conn, synthetic.page_dicts(100))
+    conn.close()
+    for n in sizes:
+        rows = synthetic.ad_dicts(n)
+        conn = ctx.connect()
+        try:
+            samples = timed(lambda: upsert_ads(conn, rows), ctx.repeat, setup=lambda: ctx.truncate("ads"))
+        finally:
+            conn.close()
+        yield f"upsert_ads[{n}]", stats(samples, n)
+
+
+@benchmark("get_active_token", needs=("db",))
+def bench_get_active_token(ctx):
+    from db.postgres_client import get_active_token
+    threads, calls_per_thread, tokens = 50, 20, 100
+
+    ctx.truncate("meta_tokens")
+    conn = ctx.connect()
+    with conn.cursor() as cur:
+        cur.executemany("INSERT INTO meta_tokens (token) VALUES (%s)", [(f"bench_token_{i}",) for i in range(tokens)])
+    conn.commit()
+    conn.close()
+
+    latencies = []
+    lock = threading.Lock()
+
+    def worker(barrier):
+        c = ctx.connect()
+        local = []
+        try:
+            barrier.wait()
+            for _ in range(calls_per_thread):
+                start = time.perf_counter()
+                get_active_token(c)
+                local.append(time.perf_counter() - start)
+        finally:
+            c.close()
+        with lock:
+            latencies.extend(local)
+
+    def run():
+        barrier = threading.Barrier(threads)
+        ts = [threading.Thread(target=worker, args=(barrier,)) for _ in range(threads)]
+        for t in ts:
+            t.start()
+        for t in ts:
+            t.join()
+
+    samples = timed(run, ctx.repeat)
+    yield f"get_active_token[{threads}x{calls_per_thread}]", stats(samples, threads * calls_per_thread)
+    yield f"get_active_token_call[{threads} threads]", stats(latencies)
+
+
+@benchmark("fetch_page_ads_bodies", needs=("db",))
+def bench_fetch_page_ads_bodies(ctx):
+    from db.postgres_client import upsert_pages, upsert_ads, fetch_page_ads_bodies
+    ctx.truncate("pages", "ads")
+    conn = ctx.connect()
+    try:
+        upsert_pages(conn, synthetic.page_dicts(100))
+        upsert_ads(conn, synthetic.ad_dicts(50000))  # 500 ads per page
+        samples = timed(lambda: fetch_page_ads_bodies(conn, "100000000007"), ctx.repeat * 10)
+    finally:
+        conn.close()
+    yield "fetch_page_ads_bodies[500 ads]", stats(samples)
+
+
+@benchmark("step4_dom_extraction", needs=("playwright",))
+def bench_dom_extraction(ctx):
+    from playwright.async_api import async_playwright
+    from steps.step_4_media import scrape_media_from_url
+
+    fixtures = sorted(f for f in os.listdir(os.path.join(HERE, "fixtures")) if f.endswith(".html"))
+
+    async def run_all():
+        results = []
+        async with async_playwright() as p:
+            browser = await p.chromium.launch(headless=True)
+            page = await browser.new_page()
+            try:
+                for name in fixtures:
+                    url = "file://" + os.path.join(HERE, "fixtures", name)
+                    await scrape_media_from_url(page, url)  # warm-up
+                    samples = []
+                    for _ in range(ctx.repeat * 2):
+                        start = time.perf_counter()
+                        await scrape_media_from_url(page, url)
+                        samples.append(time.perf_counter() - start)
+                    results.append((f"scrape_media_from_url[{name[:-5]}]", stats(samples)))
+            finally:
+                await browser.close()
+        return results
+
+    yield from asyncio.run(run_all())
+
+
+# ─── Runner ────────────────────────────────────────────────────────────────
+
+def _metadata():
+    try:
+        sha = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                             cwd=HERE).stdout.strip() or None
+    except OSError:
+        sha = None
+    return {
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "git_sha": sha,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run pipeline benchmarks and save a JSON baseline")
+    parser.add_argument("--only", help="comma-separated benchmark names")
+    parser.add_argument("--repeat", type=int, default=5, help="timed runs per benchmark")
+    parser.add_argument("--quick", action="store_true", help="skip the largest sizes")
+    parser.add_argument("--out", help="output file (default: benchmarks/results/<timestamp>.json + latest.json)")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    ctx = Context(args)
+    only = set(args.only.split(",")) if args.only else None
+    available = {
+        "db": bool(ctx.db_url),
+        "playwright": importlib.util.find_spec("playwright") is not None,
+    }
+
+    selected = [(n, needs, fn) for n, needs, fn in BENCHMARKS if not only or n in only]
+    if any("db" in needs and available["db"] for _, needs, _ in selected):
+        ctx.setup_db()
+
+    results = {}
+    try:
+        for name, needs, fn in selected:
+            missing = [n for n in needs if not available[n]]
+            if missing:
+                logger.warning(f"Skipping {name}: needs {', '.join(missing)}"
+                               + (" (set BENCH_DB_URL)" if "db" in missing else ""))
+                continue
+            logger.info(f"Running {name}...")
+            for result_name, result in fn(ctx):
+                results[result_name] = result
+                rate = f"{result['items_per_s']:,.0f}/s" if result["items_per_s"] else "-"
+                logger.info(f"  {result_name:<45} mean {result['mean_s'] * 1000:9.2f} ms  "
+                            f"p95 {result['p95_s'] * 1000:9.2f} ms  {rate}")
+    finally:
+        if available["db"] and any("db" in needs for _, needs, _ in selected):
+            ctx.teardown_db()
+
+    report = {"meta": _metadata(), "benchmarks": results}
+    if args.out:
+        paths = [args.out]
+    else:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        stamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+        paths = [os.path.join(RESULTS_DIR, f"{stamp}.json"), os.path.join(RESULTS_DIR, "latest.json")]
+    for path in paths:
+        with open(path, "w") as f:
+            json.dump(report, f, indent=2)
+    logger.info(f"Saved {len(results)} results to {', '.join(paths)}")
+
+
+if __name__ == "__main__":
+    main()
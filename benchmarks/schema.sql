@@ -0,0 +1,56 @@
+-- Minimal copy of the production tables used by the benchmarks.
+-- Loaded into a throwaway schema of the database in BENCH_DB_URL.
+
+CREATE TABLE search_terms (
+    id SERIAL PRIMARY KEY,
+    search_term VARCHAR,
+    country VARCHAR,
+    status VARCHAR DEFAULT 'pending',
+    last_processed_at TIMESTAMPTZ,
+    lease_owner VARCHAR,
+    lease_expires_at TIMESTAMPTZ
+);
+
+CREATE TABLE pages (
+    page_id VARCHAR(255) PRIMARY KEY,
+    name VARCHAR,
+    country VARCHAR,
+    total_eu_reach BIGINT DEFAULT 0,
+    active_total_eu_reach BIGINT DEFAULT 0,
+    ads_status VARCHAR DEFAULT 'pending',
+    media_status VARCHAR DEFAULT 'pending',
+    classification_status VARCHAR DEFAULT 'pending',
+    manual_status VARCHAR(20) DEFAULT 'unprocessed',
+    media_retry_count INT DEFAULT 0,
+    category VARCHAR,
+    openai_category_raw VARCHAR,
+    ads_lease_owner VARCHAR,
+    ads_lease_expires_at TIMESTAMPTZ,
+    media_lease_owner VARCHAR,
+    media_lease_expires_at TIMESTAMPTZ
+);
+
+CREATE TABLE ads (
+    ad_id VARCHAR(255) PRIMARY KEY,
+    page_id VARCHAR(255),
+    ad_creation_time VARCHAR,
+    ad_delivery_start_time VARCHAR,
+    ad_delivery_stop_time VARCHAR,
+    ad_snapshot_url TEXT,
+    eu_total_reach BIGINT,
+    is_active BOOLEAN,
+    beneficiary VARCHAR,
+    search_term_id INT,
+    description TEXT
+);
+CREATE INDEX idx_ads_page_id ON ads (page_id);
+
+CREATE TABLE meta_tokens (
+    id SERIAL PRIMARY KEY,
+    token VARCHAR UNIQUE,
+    status VARCHAR DEFAULT 'ACTIVE',
+    cooldown_until TIMESTAMPTZ,
+    last_used_at TIMESTAMPTZ,
+    heartbeat_at TIMESTAMPTZ,
+    updated_at TIMESTAMPTZ
+);
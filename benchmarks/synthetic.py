@@ -0,0 +1,69 @@
+"""Deterministic synthetic data shaped like what the pipeline reads and writes."""
+import random
+
+from tools.fake_meta_server import WORDS
+
+
+def raw_ads(n, page_id="100000000001", seed=1):
+    """Graph API ad records as returned by get_ads_by_page (≈10% stopped, mixed reach shapes)."""
+    rng = random.Random(seed)
+    ads = []
+    for i in range(n):
+        day = 1 + i % 28
+        ad = {
+            "id": str(300000000000000 + i),
+            "page_id": page_id,
+            "page_name": "Benchmark Store",
+            "ad_creation_time": f"2025-0{1 + i % 9}-{day:02d}",
+            "ad_delivery_start_time": f"2025-0{1 + i % 9}-{day:02d}",
+            "ad_snapshot_url": f"https://www.facebook.com/ads/archive/render_ad/?id={300000000000000 + i}",
+            "eu_total_reach": rng.randint(0, 500000) if i % 3 else {"lb": 1000, "ub": rng.randint(1000, 90000)},
+            "is_active_status": True,
+            "beneficiary_payers": [{"beneficiary": "Benchmark Store GmbH", "payer": "Benchmark Store GmbH"}],
+            "ad_creative_bodies": [" ".join(rng.sample(WORDS, 12)), " ".join(rng.sample(WORDS, 8))],
+        }
+        if i % 10 == 0:
+            ad["ad_delivery_stop_time"] = f"2025-0{1 + i % 9}-{day:02d}"
+        ads.append(ad)
+    return ads
+
+
+def page_dicts(n, offset=0):
+    """Rows for upsert_pages."""
+    return [
+        {"page_id": str(100000000000 + offset + i), "name": f"Benchmark Page {i}", "country": "DE",
+         "total_eu_reach": 0}
+        for i in range(n)
+    ]
+
+
+def ad_dicts(n, pages=100, seed=2):
+    """Rows for upsert_ads, spread over `pages` pages (all pages exist in page_dicts(pages))."""
+    rng = random.Random(seed)
+    return [
+        {
+            "ad_id": str(400000000000000 + i),
+            "page_id": str(100000000000 + i % pages),
+            "ad_creation_time": "2025-03-01",
+            "ad_delivery_start_time": "2025-03-01",
+            "ad_delivery_stop_time": None,
+            "ad_snapshot_url": f"https://www.facebook.com/ads/archive/render_ad/?id={400000000000000 + i}",
+            "eu_total_reach": rng.randint(0, 500000),
+            "is_active": True,
+            "beneficiary": "Benchmark Store GmbH",
+            "search_term_id": None,
+            "description": '["' + " ".join(rng.sample(WORDS, 10)) + '"]',
+        }
+        for i in range(n)
+    ]
+
+
+def classifier_outputs(n, seed=3):
+    """Raw model answers for validate_category: exact, noisy, partial and invalid."""
+    from steps.step_5_openai_classification import VALID_CATEGORIES
+    rng = random.Random(seed)
+    outputs = []
+    for i in range(n):
+        c = rng.choice(VALID_CATEGORIES)
+        outputs.append([c, f" {c.lower()}.", f"Category: {c}", "Something else entirely"][i % 4])
+    return outputs
@@ -1,19 +1,7 @@
-from db.postgres_client import get_conn
-import datetime
+import sys
 
-c = get_conn()
-cur = c.cursor()
+from tools.status_monitor import main
 
-# Token status
-cur.execute("SELECT status, COUNT(*), MAX(cooldown_until) FROM meta_tokens GROUP BY status")
-print("== Tokens ==")
-for r in cur.fetchall():
-    print(r)
-
-# Page status
-cur.execute("SELECT ads_status, COUNT(*) FROM pages WHERE active_total_eu_reach >= 200000 GROUP BY ads_status")
-print("\n== Pages (reach >= 200k) ==")
-for r in cur.fetchall():
-    print(r)
-
-c.close()
+# Token pool and stage counts for pages with reach >= 200k, in one query
+if __name__ == "__main__":
+    sys.exit(main(["--once", "--min-reach", "200000"] + sys.argv[1:]))
@@ -0,0 +1,163 @@
+"""
+Single entry point for running and administering the pipeline.
+
+    python cli.py run [--daemon] [pipeline options]     # steps 1-4 (pipeline.py)
+    python cli.py run step5 [step options]              # one step on its own
+    python cli.py status [--once] [--min-reach N]       # tools/status_monitor.py
+    python cli.py reset tokens | ads | media | classification | all
+    python cli.py migrate [name ...] [--list]
+    python cli.py tokens check [--apply] | usage | simulate [simulator options]
+
+Only the subcommand's own modules are imported (inside its handler), so admin
+commands don't pay for Playwright, OpenAI or the Meta client.
+"""
+import argparse
+import sys
+
+STEPS = {
+    "step2": "steps.step_2_pages",
+    "step3": "steps.step_3_ads",
+    "step4": "steps.step_4_media",
+    "step5": "steps.step_5_openai_classification",
+}
+
+# Applied in this order by `migrate` with no names; each function returns True on success
+MIGRATIONS = [
+    ("page_status", "migrate_page_status", "apply_migration"),
+    ("leases", "db_migrate_leases", "migrate"),
+    ("step5", "db_migrate_step5", "migrate"),
+    ("step5_ads", "db_migrate_step5_ads", "migrate"),
+    ("status_counters", "db_migrate_status_counters", "migrate"),
+    ("token_health", "db_migrate_token_health", "migrate"),
+    ("token_usage", "db_migrate_token_usage", "migrate"),
+    ("daemon", "db_migrate_daemon", "migrate"),
+    ("recrawl", "db_migrate_recrawl", "migrate"),
+    ("page_aggregates", "db_migrate_page_aggregates", "migrate"),
+]
+
+
+def cmd_run(args, rest):
+    if not rest or rest[0] not in STEPS:
+        import pipeline
+        return pipeline.main(rest)
+    # A step on its own: its module's __main__ block, with the remaining options as argv
+    import runpy
+    module = STEPS[rest[0]]
+    sys.argv = [module] + rest[1:]
+    runpy.run_module(module, run_name="__main__", alter_sys=True)
+    return 0
+
+
+def cmd_status(args, rest):
+    from tools.status_monitor import main
+    return main(rest)
+
+
+def cmd_reset(args, rest):
+    from db.postgres_client import get_conn, reset_all_data, reactivate_tokens, reset_page_status
+
+    if args.what == "all" and not args.yes:
+        print("This deletes every page, ad and creative and resets all search terms. Re-run with --yes.")
+        return 1
+
+    conn = get_conn()
+    try:
+        if args.what == "all":
+            for table, count in reset_all_data(conn).items():
+                print(f"{table}: {count} row(s) {'reset' if table == 'search_terms' else 'deleted'}")
+        elif args.what == "tokens":
+            print(f"Reset {reactivate_tokens(conn)} token(s) to ACTIVE")
+        else:
+            column = f"{args.what}_status"
+            count = reset_page_status(conn, column, args.from_status, args.to_status,
+                                      min_reach=args.min_reach, limit=args.limit, dry_run=args.dry_run)
+            verb = "Would reset" if args.dry_run else "Reset"
+            print(f"{verb} {count} page(s) {column} {args.from_status} → {args.to_status}")
+    except Exception as e:
+        conn.rollback()
+        print(f"ERROR: {e}")
+        return 1
+    finally:
+        conn.close()
+    return 0
+
+
+def cmd_migrate(args, rest):
+    import importlib
+    import logging
+    logging.basicConfig(level=logging.INFO)
+
+    known = {name: (module, fn) for name, module, fn in MIGRATIONS}
+    if args.list:
+        for name, module, _ in MIGRATIONS:
+            print(f"{name:<16} {module}.py")
+        return 0
+    unknown = [n for n in args.names if n not in known]
+    if unknown:
+        print(f"Unknown migration(s): {', '.join(unknown)}. See --list.")
+        return 1
+    for name in args.names or [n for n, _, _ in MIGRATIONS]:
+        module, fn = known[name]
+        print(f"--- {name} ({module}.py)")
+        if not getattr(importlib.import_module(module), fn)():
+            print(f"Migration {name} failed; not applying the rest.")
+            return 1
+    return 0
+
+
+def cmd_tokens(args, rest):
+    if args.action == "check":
+        from check_tokens import main
+    elif args.action == "usage":
+        from tools.token_usage_report import main
+    else:
+        from tools.capacity_simulator import main
+    return main(rest)
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="cli.py", description="Meta Ads pipeline")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    # [step2|step3|step4|step5] is read from the passed-through options, so that
+    # pipeline options with values (--metrics-port 9100) aren't taken for it
+    run = sub.add_parser("run", help=f"run the pipeline, or one of {', '.join(STEPS)} (options are passed through)",
+                         add_help=False)
+    run.set_defaults(handler=cmd_run, passthrough=True)
+
+    status = sub.add_parser("status", help="pipeline status (options of tools/status_monitor.py)",
+                            add_help=False)
+    status.set_defaults(handler=cmd_status, passthrough=True)
+
+    reset = sub.add_parser("reset", help="reset tokens, page statuses or the whole DB")
+    reset.add_argument("what", choices=["tokens", "ads", "media", "classification", "all"])
+    reset.add_argument("--from", dest="from_status", default="completed", help="pages: current status")
+    reset.add_argument("--to", dest="to_status", default="pending", help="pages: new status")
+    reset.add_argument("--min-reach", type=int, help="pages: only active_total_eu_reach >= N")
+    reset.add_argument("--limit", type=int, help="pages: reset at most N")
+    reset.add_argument("--dry-run", action="store_true", help="pages: only count")
+    reset.add_argument("--yes", action="store_true", help="all: confirm")
+    reset.set_defaults(handler=cmd_reset, passthrough=False)
+
+    migrate = sub.add_parser("migrate", help="apply schema migrations (all, in order, by default)")
+    migrate.add_argument("names", nargs="*")
+    migrate.add_argument("--list", action="store_true")
+    migrate.set_defaults(handler=cmd_migrate, passthrough=False)
+
+    tokens = sub.add_parser("tokens", help="token pool: health check, usage report, capacity simulation",
+                            add_help=False)
+    tokens.add_argument("action", choices=["check", "usage", "simulate"])
+    tokens.set_defaults(handler=cmd_tokens, passthrough=True)
+    return parser
+
+
+def main(argv=None):
+    parser = build_parser()
+    args, rest = parser.parse_known_args(argv)
+    if rest and not args.passthrough:
+        parser.error(f"unrecognized arguments: {' '.join(rest)}")
+    return args.handler(args, rest) or 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
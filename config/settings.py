@@ -7,10 +7,120 @@ SUPABASE_URL = os.getenv("SUPABASE_URL")
 SUPABASE_KEY = os.getenv("SUPABASE_KEY")
 META_ACCESS_TOKEN = os.getenv("META_ACCESS_TOKEN")
 
+# Meta Graph API endpoint (point META_GRAPH_URL at tools/fake_meta_server.py for load tests)
+META_GRAPH_URL = os.getenv("META_GRAPH_URL", "https://graph.facebook.com").rstrip("/")
+META_API_VERSION = os.getenv("META_API_VERSION", "v24.0")
+META_PAGE_DELAY = float(os.getenv("META_PAGE_DELAY", 0.5))  # seconds between paginated requests
+# Step 3 re-crawls of pages with stored ads: light fields for the whole page, full fields only
+# for new ads through ?ids= lookups. Off until those lookups are checked against the live Graph API
+ADS_TWO_TIER_FETCH = os.getenv("ADS_TWO_TIER_FETCH", "False").lower() == "true"
+
 # Concurrency Settings
 TERMS_CONCURRENCY = int(os.getenv("TERMS_CONCURRENCY", 5))
 PAGES_CONCURRENCY = int(os.getenv("PAGES_CONCURRENCY", 20))
 MEDIA_CONCURRENCY = int(os.getenv("MEDIA_CONCURRENCY", 13))
 
+# Concurrency autotuner: when enabled, the values above are only the starting point
+# and each stage's worker count moves within its [MIN, MAX] bounds at runtime.
+AUTOTUNE_CONCURRENCY = os.getenv("AUTOTUNE_CONCURRENCY", "False").lower() == "true"
+AUTOTUNE_INTERVAL = int(os.getenv("AUTOTUNE_INTERVAL", 30))  # seconds between adjustments
+TERMS_CONCURRENCY_MIN = int(os.getenv("TERMS_CONCURRENCY_MIN", 1))
+TERMS_CONCURRENCY_MAX = int(os.getenv("TERMS_CONCURRENCY_MAX", TERMS_CONCURRENCY * 4))
+PAGES_CONCURRENCY_MIN = int(os.getenv("PAGES_CONCURRENCY_MIN", 2))
+PAGES_CONCURRENCY_MAX = int(os.getenv("PAGES_CONCURRENCY_MAX", PAGES_CONCURRENCY * 3))
+MEDIA_CONCURRENCY_MIN = int(os.getenv("MEDIA_CONCURRENCY_MIN", 1))
+MEDIA_CONCURRENCY_MAX = int(os.getenv("MEDIA_CONCURRENCY_MAX", MEDIA_CONCURRENCY * 2))
+
 # Browser Settings
 PLAYWRIGHT_HEADLESS = os.getenv("PLAYWRIGHT_HEADLESS", "True").lower() == "true"
+# Resource types step 4 aborts: nothing it reads needs them. Video bodies ("media") are
+# blocked but <video src> stays in the DOM; images are kept, their rendered size picks the creative
+MEDIA_BLOCKED_RESOURCES = os.getenv("MEDIA_BLOCKED_RESOURCES", "font,media,texttrack,manifest,eventsource,websocket")
+# Step 4 fast path: read the media URL from the snapshot HTML over plain HTTP and only
+# navigate Chromium when it has none (steps/media_fast_path.py)
+MEDIA_FAST_PATH = os.getenv("MEDIA_FAST_PATH", "True").lower() == "true"
+MEDIA_FAST_PATH_TIMEOUT = float(os.getenv("MEDIA_FAST_PATH_TIMEOUT", 15))
+# Step 4 browsers: workers are spread over MEDIA_BROWSERS Chromium instances (0 = one per
+# two CPU cores, at most 4). A browser is replaced after MEDIA_BROWSER_MAX_NAVIGATIONS
+# navigations or once its processes use more than MEDIA_BROWSER_MAX_RSS_MB (0 = no limit)
+MEDIA_BROWSERS = int(os.getenv("MEDIA_BROWSERS", 0)) or max(1, min(4, (os.cpu_count() or 2) // 2))
+MEDIA_BROWSER_MAX_NAVIGATIONS = int(os.getenv("MEDIA_BROWSER_MAX_NAVIGATIONS", 500))
+MEDIA_BROWSER_MAX_RSS_MB = int(os.getenv("MEDIA_BROWSER_MAX_RSS_MB", 2048))
+
+# Shutdown: seconds in-flight items get to finish after SIGTERM before their leases are released
+SHUTDOWN_GRACE_SECONDS = int(os.getenv("SHUTDOWN_GRACE_SECONDS", 120))
+
+# Meta API cassettes: "record" saves every Graph API request/response to META_CASSETTE_PATH,
+# "replay" serves them back offline (latency scaled by META_CASSETTE_LATENCY_SCALE, 0 = no wait)
+META_CASSETTE_MODE = os.getenv("META_CASSETTE_MODE", "").lower()
+META_CASSETTE_PATH = os.getenv("META_CASSETTE_PATH", "cassettes/meta.jsonl.gz")
+META_CASSETTE_LATENCY_SCALE = float(os.getenv("META_CASSETTE_LATENCY_SCALE", 1.0))
+
+# Profiling (see utils/profiling.py): PROFILE_STAGE samples one stage (step2..step5, all) for
+# the whole run; PROFILE_SAMPLE_RATE profiles that fraction of items (always-on mode)
+PROFILE_STAGE = os.getenv("PROFILE_STAGE", "")
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", 0))
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+PROFILE_INTERVAL_MS = int(os.getenv("PROFILE_INTERVAL_MS", 10))
+
+# Tracing (see utils/tracing.py): "file:traces/spans.jsonl" or "otlp:http://localhost:4318"; empty = off
+TRACE_EXPORT = os.getenv("TRACE_EXPORT", "")
+TRACE_SERVICE_NAME = os.getenv("TRACE_SERVICE_NAME", "meta-ads-pipeline")
+TRACE_BATCH_SIZE = int(os.getenv("TRACE_BATCH_SIZE", 512))
+TRACE_FLUSH_INTERVAL = float(os.getenv("TRACE_FLUSH_INTERVAL", 5))
+
+# Prometheus metrics endpoint (see utils/metrics.py); 0 = don't serve
+METRICS_PORT = int(os.getenv("METRICS_PORT", 0))
+
+# Token health checks (see api/token_health.py): how often the pipeline re-checks the pool,
+# how long a result stays fresh, and how close to expiry a token stops being handed out
+TOKEN_HEALTH_INTERVAL = int(os.getenv("TOKEN_HEALTH_INTERVAL", 900))  # seconds, 0 = off
+TOKEN_HEALTH_TTL = int(os.getenv("TOKEN_HEALTH_TTL", 3600))
+TOKEN_HEALTH_CONCURRENCY = int(os.getenv("TOKEN_HEALTH_CONCURRENCY", 50))
+
+# Token usage telemetry (see api/usage_telemetry.py): x-business-use-case-usage samples are
+# folded while unchanged (up to USAGE_SAMPLE_SECONDS) and written in batches
+USAGE_FLUSH_INTERVAL = float(os.getenv("USAGE_FLUSH_INTERVAL", 10))
+USAGE_BATCH_SIZE = int(os.getenv("USAGE_BATCH_SIZE", 500))
+USAGE_SAMPLE_SECONDS = int(os.getenv("USAGE_SAMPLE_SECONDS", 60))
+USAGE_RETENTION_DAYS = int(os.getenv("USAGE_RETENTION_DAYS", 14))
+
+# Token budget (see api/token_budget.py): shares the token pool between Step 2 ("terms")
+# and Step 3 ("pages") by weight, boosted towards the stage with the larger backlog
+TOKEN_BUDGET = os.getenv("TOKEN_BUDGET", "False").lower() == "true"
+TOKEN_BUDGET_WEIGHTS = os.getenv("TOKEN_BUDGET_WEIGHTS", "terms:1,pages:2")
+TOKEN_BUDGET_SLOTS_PER_TOKEN = int(os.getenv("TOKEN_BUDGET_SLOTS_PER_TOKEN", 4))  # concurrent requests per usable token
+TOKEN_BUDGET_BACKLOG_BOOST = float(os.getenv("TOKEN_BUDGET_BACKLOG_BOOST", 1.0))
+TOKEN_BUDGET_REFRESH = float(os.getenv("TOKEN_BUDGET_REFRESH", 15))  # seconds between token counts
+
+# Daemon mode (pipeline.py --daemon): new search_terms wake it through LISTEN/NOTIFY
+# (db_migrate_daemon.py); without the trigger, or as a fallback, it re-polls this often
+DAEMON_POLL_INTERVAL = float(os.getenv("DAEMON_POLL_INTERVAL", 30))
+DAEMON_PAGE_IDS_REFRESH = int(os.getenv("DAEMON_PAGE_IDS_REFRESH", 3600))  # seconds between full page-id reloads
+DAEMON_DB_POOL_SIZE = int(os.getenv("DAEMON_DB_POOL_SIZE", 16))  # used when DB_POOL_SIZE is unset
+# Terms in 'error' are retried after DAEMON_POLL_INTERVAL, then twice as long after each failure, up to this (s)
+DAEMON_ERROR_BACKOFF_MAX = float(os.getenv("DAEMON_ERROR_BACKOFF_MAX", 3600))
+
+# Incremental term refresh: completed terms are searched again every TERM_REFRESH_HOURS
+# (0 = never), asking only for ads delivered since their last crawl; at most
+# TERM_REFRESH_BATCH terms are queued per pipeline run / daemon cycle
+TERM_REFRESH_HOURS = float(os.getenv("TERM_REFRESH_HOURS", 0))
+TERM_REFRESH_BATCH = int(os.getenv("TERM_REFRESH_BATCH", 500))
+
+# Adaptive search depth (Step 2): keep paging a term's results (up to TERM_MAX_PAGES requests)
+# while at least TERM_YIELD_THRESHOLD of the page_ids on the last result page were new
+TERM_MAX_PAGES = int(os.getenv("TERM_MAX_PAGES", 5))
+TERM_YIELD_THRESHOLD = float(os.getenv("TERM_YIELD_THRESHOLD", 0.2))
+
+# Adaptive page re-crawl (Step 3): every crawl schedules the page's next one. The interval
+# (starting at RECRAWL_INITIAL_HOURS) halves when the page's ads or active reach changed by
+# more than RECRAWL_REACH_GROWTH, doubles when nothing moved, and stays within
+# RECRAWL_MIN_HOURS..RECRAWL_MAX_HOURS; saved / tagged pages wait at most
+# RECRAWL_PRIORITY_MAX_HOURS, deleted ones are not re-crawled. Due pages are put back to
+# ads_status 'pending' at RECRAWL_PAGES_PER_HOUR (0 = off; size it with `cli.py tokens usage`)
+RECRAWL_PAGES_PER_HOUR = float(os.getenv("RECRAWL_PAGES_PER_HOUR", 0))
+RECRAWL_INITIAL_HOURS = float(os.getenv("RECRAWL_INITIAL_HOURS", 72))
+RECRAWL_MIN_HOURS = float(os.getenv("RECRAWL_MIN_HOURS", 12))
+RECRAWL_MAX_HOURS = float(os.getenv("RECRAWL_MAX_HOURS", 24 * 14))
+RECRAWL_PRIORITY_MAX_HOURS = float(os.getenv("RECRAWL_PRIORITY_MAX_HOURS", 24))
+RECRAWL_REACH_GROWTH = float(os.getenv("RECRAWL_REACH_GROWTH", 0.1))
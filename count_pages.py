@@ -1,7 +1,7 @@
-from db.postgres_client import get_conn
+import sys
 
-c = get_conn()
-cur = c.cursor()
-cur.execute("SELECT COUNT(*) FROM pages WHERE ads_status='completed' AND active_total_eu_reach >= 200000")
-print('Pages a re-scraping:', cur.fetchone()[0])
-c.close()
+from cli import main
+
+# Pages to re-scrape (ads completed, reach >= 200k), counted without changing anything
+if __name__ == "__main__":
+    sys.exit(main(["reset", "ads", "--min-reach", "200000", "--dry-run"]))
@@ -1,20 +1,196 @@
 import os
+import logging
+import select
+import socket
+import threading
+import time
 import psycopg2
 from psycopg2.extras import execute_values
+from psycopg2.extensions import connection as _pg_connection
 from dotenv import load_dotenv
 
+from utils.tracing import traced_db
+from utils.metrics import STATUS_TRANSITIONS, DB_CONNECTIONS_OPEN, DB_CONNECTIONS, DB_CONNECTIONS_IN_USE
+
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 DB_URL = os.getenv("DB_URL")
 
-def get_conn():
+# Leases: how long a claimed item stays ours without a heartbeat, and who "we" are
+LEASE_SECONDS = int(os.getenv("LEASE_SECONDS", 900))
+WORKER_ID = os.getenv("WORKER_ID") or f"{socket.gethostname()}:{os.getpid()}"
+
+# Tokens whose expires_at (from /debug_token) is closer than this are no longer handed out
+TOKEN_EXPIRY_MARGIN_MINUTES = int(os.getenv("TOKEN_EXPIRY_MARGIN_MINUTES", 60))
+
+# Token rotation: "headroom" (default) hands out the token with the lowest predicted usage
+# (last reported usage decayed over Meta's rolling hour); "lru" the least recently used one.
+# headroom needs db_migrate_token_usage.py and falls back to lru until it has run.
+TOKEN_ROTATION = os.getenv("TOKEN_ROTATION", "headroom").lower()
+
+# Connections kept open for reuse by get_conn(); 0 = open a new connection every time.
+# More connections than this can be in use at once; the extra ones are closed on close().
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", 0))
+# A pooled connection idle for longer is checked with SELECT 1 before it is handed out
+# again (the server or a proxy may have dropped it meanwhile)
+DB_POOL_CHECK_IDLE_SECONDS = int(os.getenv("DB_POOL_CHECK_IDLE_SECONDS", 30))
+
+# NOTIFY channel the search_terms insert trigger (db_migrate_daemon.py) signals on
+NEW_TERMS_CHANNEL = "search_terms_new"
+
+class TrackedConnection(_pg_connection):
+    """psycopg2 connection that keeps the db_connections_open gauge in step."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.in_use = False  # set by get_conn() when handed out unpooled
+        # Own flag: psycopg2 marks a connection the server dropped as closed before close() runs
+        self._counted = True
+        DB_CONNECTIONS.inc()
+        DB_CONNECTIONS_OPEN.inc()
+
+    def close(self):
+        if self._counted:
+            self._counted = False
+            DB_CONNECTIONS_OPEN.dec()
+        if self.in_use:
+            self.in_use = False
+            DB_CONNECTIONS_IN_USE.dec()
+        super().close()
+
+class PooledConnection:
+    """
+    A pooled connection handed out by get_conn(). Behaves like the psycopg2 connection
+    it wraps, except that close() rolls back anything uncommitted and returns it to the pool.
+    """
+
+    def __init__(self, conn):
+        object.__setattr__(self, "_conn", conn)
+        object.__setattr__(self, "_returned", False)
+        DB_CONNECTIONS_IN_USE.inc()
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    def __setattr__(self, name, value):
+        setattr(self._conn, name, value)
+
+    def __enter__(self):
+        self._conn.__enter__()
+        return self
+
+    def __exit__(self, *exc):
+        return self._conn.__exit__(*exc)
+
+    @property
+    def closed(self):
+        return 1 if self._returned else self._conn.closed
+
+    def close(self):
+        if self._returned:
+            return
+        object.__setattr__(self, "_returned", True)
+        DB_CONNECTIONS_IN_USE.dec()
+        _release_conn(self._conn)
+
+
+_pool = []  # (connection, monotonic time it was returned)
+_pool_size = DB_POOL_SIZE
+_pool_lock = threading.Lock()
+
+
+def configure_pool(size):
+    """Keep up to `size` idle connections for reuse (0 disables pooling)."""
+    global _pool_size
+    with _pool_lock:
+        _pool_size = max(0, size)
+        surplus = _pool[_pool_size:]
+        del _pool[_pool_size:]
+    for conn, _ in surplus:
+        conn.close()
+
+
+def _release_conn(conn):
+    if not conn.closed:
+        try:
+            if conn.info.transaction_status != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                conn.rollback()
+            if conn.autocommit:
+                conn.autocommit = False
+        except psycopg2.Error:
+            conn.close()
+    with _pool_lock:
+        if not conn.closed and len(_pool) < _pool_size:
+            _pool.append((conn, time.monotonic()))
+            return
+    conn.close()
+
+
+def _connect():
     if not DB_URL or "postgres" not in DB_URL: # Basic validation
          raise ValueError("Missing or invalid DB_URL in .env")
-    
-    conn = psycopg2.connect(DB_URL)
+    return psycopg2.connect(DB_URL, connection_factory=TrackedConnection)
+
+
+def _alive(conn, idle_since):
+    """False if the connection is closed, or was idle long enough to re-check and fails SELECT 1."""
+    if conn.closed:
+        return False
+    if time.monotonic() - idle_since < DB_POOL_CHECK_IDLE_SECONDS:
+        return True
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SELECT 1")
+        conn.rollback()
+        return True
+    except psycopg2.Error:
+        conn.close()
+        return False
+
+
+def get_conn():
+    if _pool_size:
+        conn = None
+        while conn is None:
+            with _pool_lock:
+                conn, idle_since = _pool.pop() if _pool else (None, None)
+            if conn is None:
+                conn = _connect()
+                conn.autocommit = False
+            elif not _alive(conn, idle_since):
+                conn = None
+        return PooledConnection(conn)
+
+    conn = _connect()
     conn.autocommit = False
+    conn.in_use = True
+    DB_CONNECTIONS_IN_USE.inc()
+    return conn
+
+
+def listen(channel):
+    """Dedicated autocommit connection LISTENing on `channel` (never pooled)."""
+    conn = _connect()
+    conn.autocommit = True
+    with conn.cursor() as cur:
+        cur.execute(f"LISTEN {channel};")
     return conn
 
+
+def wait_for_notifications(conn, timeout):
+    """Block up to `timeout` seconds for NOTIFYs on a listen() connection. Returns how many arrived."""
+    if not conn.notifies:
+        ready, _, _ = select.select([conn], [], [], timeout)
+        if ready:
+            conn.poll()
+    else:
+        conn.poll()
+    count = len(conn.notifies)
+    conn.notifies.clear()
+    return count
+
 UPSERT_PAGE_SQL = """
 INSERT INTO pages (page_id, name, country, total_eu_reach, active_total_eu_reach)
 VALUES %s
@@ -47,6 +223,7 @@ DO UPDATE SET
     description = EXCLUDED.description;
 """
 
+@traced_db("db.upsert_pages")
 def upsert_pages(conn, pages_data):
     if not pages_data:
         return 0
@@ -61,10 +238,12 @@ def upsert_pages(conn, pages_data):
     conn.commit()
     return len(rows)
 
+@traced_db("db.upsert_ads")
 def upsert_ads(conn, ads_data):
+    """Upsert ads given as dicts; see upsert_ad_rows for rows from api.ad_normalizer."""
     if not ads_data:
         return 0
-        
+
     rows = [
         (
             a["ad_id"], a["page_id"], a["ad_creation_time"],
@@ -75,12 +254,82 @@ def upsert_ads(conn, ads_data):
         )
         for a in ads_data
     ]
-    
+    return upsert_ad_rows(conn, rows)
+
+@traced_db("db.upsert_ad_rows")
+def upsert_ad_rows(conn, rows):
+    """Upsert ads given as tuples in UPSERT_AD_SQL column order (api.ad_normalizer.AD_ROW_COLUMNS)."""
+    if not rows:
+        return 0
     with conn.cursor() as cur:
         execute_values(cur, UPSERT_AD_SQL, rows)
     conn.commit()
     return len(rows)
 
+@traced_db("db.update_ads_delivery")
+def update_ads_delivery(conn, ad_rows):
+    """
+    Refresh only the delivery fields (reach, stop time, active flag) of ads that are
+    already stored, leaving their creative fields alone. Takes the rows of upsert_ad_rows.
+    """
+    if not ad_rows:
+        return 0
+    rows = [(r[0], r[4], r[6], r[7]) for r in ad_rows]
+    with conn.cursor() as cur:
+        execute_values(cur, """
+            UPDATE ads
+            SET ad_delivery_stop_time = v.stop_time,
+                eu_total_reach = v.reach,
+                is_active = v.is_active
+            FROM (VALUES %s) AS v(ad_id, stop_time, reach, is_active)
+            WHERE ads.ad_id = v.ad_id
+        """, rows, template="(%s, %s, %s::bigint, %s::boolean)", page_size=len(rows))
+        updated = cur.rowcount
+    conn.commit()
+    return updated
+
+@traced_db("db.sync_page_ads_aggregates")
+def sync_page_ads_aggregates(conn, page_id, active_ad_ids, total_reach, with_count=True, deactivate=True):
+    """
+    After a page's ads were fetched and stored: deactivate its stored ads missing from the
+    fetch (stopped or gone), then recompute active_total_eu_reach (and active_ads_count,
+    db_migrate_page_aggregates.py) from the ads table. total_reach covers stopped ads too,
+    which are never stored, so it is the fetch's sum. After a truncated fetch pass
+    deactivate=False and total_reach=None: nothing is deactivated and total_eu_reach is kept.
+    Returns (active_reach, active_count).
+    """
+    count_sql = ", active_ads_count = s.active_count" if with_count else ""
+    deactivated = 0
+    with conn.cursor() as cur:
+        if deactivate:
+            cur.execute("""
+                UPDATE ads SET is_active = FALSE
+                WHERE page_id = %s AND is_active AND NOT (ad_id = ANY(%s))
+            """, (str(page_id), list(active_ad_ids)))
+            deactivated = cur.rowcount
+        cur.execute(f"""
+            UPDATE pages
+            SET total_eu_reach = COALESCE(%s, total_eu_reach),
+                active_total_eu_reach = s.active_reach{count_sql}
+            FROM (
+                SELECT COALESCE(SUM(eu_total_reach), 0) AS active_reach, COUNT(*) AS active_count
+                FROM ads WHERE page_id = %s AND is_active
+            ) AS s
+            WHERE pages.page_id = %s
+            RETURNING s.active_reach, s.active_count
+        """, (total_reach, str(page_id), str(page_id)))
+        row = cur.fetchone()
+    conn.commit()
+    if deactivated:
+        STATUS_TRANSITIONS.inc(deactivated, table='ads', column='is_active', status='false')
+    return (int(row[0]), row[1]) if row else (0, 0)
+
+def get_stored_ad_ids(conn, page_id):
+    """ad_ids of a page already in the ads table."""
+    with conn.cursor() as cur:
+        cur.execute("SELECT ad_id FROM ads WHERE page_id = %s", (str(page_id),))
+        return {row[0] for row in cur.fetchall()}
+
 # Removed old update_term_status and fetch_terms
 
 def get_existing_page_ids(conn):
@@ -92,6 +341,7 @@ def get_existing_page_ids(conn):
 
 # --- Status Management ---
 
+@traced_db("db.mark_term_status")
 def mark_term_status(conn, term_id, status):
     """Update the status of a search term (pending, processing, completed, error)."""
     with conn.cursor() as cur:
@@ -101,6 +351,24 @@ def mark_term_status(conn, term_id, status):
             WHERE id = %s
         """, (status, term_id))
     conn.commit()
+    STATUS_TRANSITIONS.inc(table='search_terms', column='status', status=status)
+
+@traced_db("db.mark_term_pages_visible")
+def mark_term_pages_visible(conn, term_id):
+    """
+    Stamp the first time a term's pages are in the pages table (db_migrate_daemon.py).
+    Returns seconds since the term was inserted, or None if already stamped / unknown.
+    """
+    with conn.cursor() as cur:
+        cur.execute("""
+            UPDATE search_terms
+            SET pages_visible_at = NOW()
+            WHERE id = %s AND pages_visible_at IS NULL
+            RETURNING EXTRACT(EPOCH FROM NOW() - created_at)
+        """, (term_id,))
+        row = cur.fetchone()
+    conn.commit()
+    return float(row[0]) if row and row[0] is not None else None
 
 def fetch_terms(conn, limit=None):
     """Fetch 'pending' and 'error' search terms (so errors are retried)."""
@@ -117,6 +385,26 @@ def fetch_terms(conn, limit=None):
                 search_terms_list.append(dict(zip(columns, row)))
     return search_terms_list
 
+def fetch_terms_due_for_refresh(conn, hours, limit=None):
+    """
+    Completed terms last crawled more than `hours` ago, stalest first (hours <= 0: none).
+    Their last_processed_at is the watermark for an incremental search.
+    """
+    if not hours or hours <= 0:
+        return []
+    with conn.cursor() as cur:
+        sql = """
+            SELECT * FROM search_terms
+            WHERE status = 'completed'
+              AND (last_processed_at IS NULL OR last_processed_at < NOW() - %s * INTERVAL '1 hour')
+            ORDER BY last_processed_at ASC NULLS FIRST
+        """
+        if limit:
+            sql += f" LIMIT {int(limit)}"
+        cur.execute(sql, (hours,))
+        columns = [desc[0] for desc in cur.description]
+        return [dict(zip(columns, row)) for row in cur.fetchall()]
+
 def fetch_ads_pending_pages(conn, limit=None):
     """Fetch pages that need AD processing (ads_status = 'pending')."""
     pages_list = []
@@ -143,6 +431,7 @@ def fetch_media_pending_pages(conn, limit=None):
             pages_list.append(row)
     return pages_list
 
+@traced_db("db.mark_page_status")
 def mark_page_status(conn, page_id, status_column, status_value):
     """Update a status column (ads_status or media_status) for a page."""
     valid_columns = ['ads_status', 'media_status', 'classification_status']
@@ -154,32 +443,152 @@ def mark_page_status(conn, page_id, status_column, status_value):
         sql = f"UPDATE pages SET {status_column} = %s WHERE page_id = %s"
         cur.execute(sql, (status_value, page_id))
     conn.commit()
+    STATUS_TRANSITIONS.inc(table='pages', column=status_column, status=status_value)
 
 def mark_page_media_status(conn, page_id, status):
     """Update media_status of a page (Legacy - use mark_page_status)."""
     mark_page_status(conn, page_id, 'media_status', status)
 
+# --- Re-crawl scheduling (db_migrate_recrawl.py) ---
+
+_priority_condition = None
+
+def page_priority_condition(conn):
+    """
+    SQL condition for pages the UI marked as interesting: saved, or tagged if the pages
+    table has a tag column (it is added by the web backend, not by our migrations).
+    """
+    global _priority_condition
+    if _priority_condition is None:
+        with conn.cursor() as cur:
+            cur.execute("""
+                SELECT column_name FROM information_schema.columns
+                WHERE table_schema = current_schema() AND table_name = 'pages'
+                  AND column_name IN ('tag_id', 'tag')
+                ORDER BY column_name DESC
+            """)
+            row = cur.fetchone()
+        _priority_condition = "manual_status = 'saved'"
+        if row:
+            _priority_condition += f" OR {row[0]} IS NOT NULL"
+    return _priority_condition
+
+@traced_db("db.schedule_ads_recrawl")
+def schedule_ads_recrawl(conn, page_id, active_reach, ads_changed, initial_hours,
+                         min_hours, max_hours, priority_max_hours, reach_growth, keep_interval=False):
+    """
+    Record an ads crawl of a page and schedule its next one. Call before active_total_eu_reach
+    is updated: a change of more than `reach_growth` against the stored value, or
+    `ads_changed`, halves the page's interval, otherwise it doubles (first crawl:
+    initial_hours), within min_hours..max_hours. keep_interval (a crawl cut short, whose
+    reach proves nothing) reuses the current interval instead, min_hours on a first crawl.
+    Saved / tagged pages are due again after at most priority_max_hours, deleted pages
+    never. Returns the new interval in hours.
+    """
+    priority = page_priority_condition(conn)
+    with conn.cursor() as cur:
+        cur.execute(f"""
+            UPDATE pages
+            SET ads_crawled_at = NOW(),
+                ads_crawl_interval_hours = s.hours,
+                next_ads_crawl_at = CASE
+                    WHEN pages.manual_status = 'deleted' THEN NULL
+                    WHEN {priority} THEN NOW() + LEAST(s.hours, %(priority_max)s) * INTERVAL '1 hour'
+                    ELSE NOW() + s.hours * INTERVAL '1 hour'
+                END
+            FROM (
+                SELECT page_id, LEAST(%(max)s, GREATEST(%(min)s, CASE
+                    WHEN %(keep)s THEN COALESCE(ads_crawl_interval_hours, %(min)s)
+                    WHEN ads_crawl_interval_hours IS NULL THEN %(initial)s
+                    WHEN %(changed)s OR ABS(%(reach)s - COALESCE(active_total_eu_reach, 0))
+                         > %(growth)s * GREATEST(COALESCE(active_total_eu_reach, 0), 1)
+                        THEN ads_crawl_interval_hours / 2
+                    ELSE ads_crawl_interval_hours * 2
+                END)) AS hours
+                FROM pages WHERE page_id = %(page_id)s
+            ) AS s
+            WHERE pages.page_id = s.page_id
+            RETURNING s.hours
+        """, {
+            "page_id": page_id, "reach": active_reach, "changed": bool(ads_changed),
+            "initial": initial_hours, "min": min_hours, "max": max_hours,
+            "priority_max": priority_max_hours, "growth": reach_growth, "keep": bool(keep_interval),
+        })
+        row = cur.fetchone()
+    conn.commit()
+    return row[0] if row else None
+
+@traced_db("db.queue_due_recrawls")
+def queue_due_recrawls(conn, limit):
+    """Put up to `limit` completed / not_found pages whose re-crawl is due back to ads_status 'pending', most overdue first."""
+    with conn.cursor() as cur:
+        cur.execute("""
+            UPDATE pages SET ads_status = 'pending'
+            WHERE page_id IN (
+                SELECT page_id FROM pages
+                WHERE ads_status IN ('completed', 'not_found')
+                  AND next_ads_crawl_at <= NOW()
+                ORDER BY next_ads_crawl_at
+                LIMIT %s
+                FOR UPDATE SKIP LOCKED
+            )
+        """, (int(limit),))
+        queued = cur.rowcount
+    conn.commit()
+    if queued:
+        STATUS_TRANSITIONS.inc(queued, table='pages', column='ads_status', status='pending')
+    return queued
+
 # --- Token Management ---
 
+PREDICTED_USAGE_SQL = (
+    "COALESCE(last_usage_pct * GREATEST(0, 1 - EXTRACT(EPOCH FROM NOW() - last_usage_at) / 3600), 0)"
+)
+
+TOKEN_ROTATION_ORDER = {
+    "lru": "last_used_at ASC NULLS FIRST",
+    # 5-point buckets: tokens with about the same headroom still rotate LRU instead of
+    # one token being handed out repeatedly until its next usage sample is flushed
+    "headroom": f"FLOOR({PREDICTED_USAGE_SQL} / 5) ASC, last_used_at ASC NULLS FIRST",
+}
+# Rotation in effect: TOKEN_ROTATION until meta_tokens turns out to lack the usage columns
+_token_rotation = TOKEN_ROTATION if TOKEN_ROTATION in TOKEN_ROTATION_ORDER else "lru"
+
+@traced_db("db.get_active_token")
 def get_active_token(conn):
     """
     Get next usable token.
     - ACTIVE with no cooldown or expired cooldown, OR
     - COOLDOWN with expired cooldown (auto-recovered to ACTIVE on selection)
-    - Rotates by last_used_at
+    - Rotates by predicted usage (TOKEN_ROTATION=headroom, the default) or by last_used_at
     - HeartBeat: skips tokens used in the last 10 minutes by another thread.
+    - Skips tokens expiring within TOKEN_EXPIRY_MARGIN_MINUTES (expires_at from token health checks).
     """
+    global _token_rotation
+    try:
+        return _get_active_token(conn, _token_rotation)
+    except psycopg2.errors.UndefinedColumn:
+        if _token_rotation == "lru":
+            raise
+        conn.rollback()
+        _token_rotation = "lru"
+        logger.info("meta_tokens.last_usage_pct missing (run db_migrate_token_usage.py); rotating tokens LRU.")
+        return _get_active_token(conn, _token_rotation)
+
+def _get_active_token(conn, rotation):
     with conn.cursor() as cur:
         cur.execute("""
             SELECT id, token
             FROM meta_tokens
-            WHERE (status = 'ACTIVE' AND (cooldown_until IS NULL OR cooldown_until < NOW()))
+            WHERE ((status = 'ACTIVE' AND (cooldown_until IS NULL OR cooldown_until < NOW()))
                OR (status = 'COOLDOWN' AND cooldown_until < NOW())
-            AND (heartbeat_at IS NULL OR heartbeat_at < NOW() - INTERVAL '10 minutes')
-            ORDER BY last_used_at ASC NULLS FIRST
+            AND (heartbeat_at IS NULL OR heartbeat_at < NOW() - INTERVAL '10 minutes'))
+              AND (expires_at IS NULL OR expires_at > NOW() + (%s || ' minutes')::interval)
+            ORDER BY {order}
             FOR UPDATE SKIP LOCKED
             LIMIT 1
-        """)
+        """.format(order=TOKEN_ROTATION_ORDER[rotation]),
+            (TOKEN_EXPIRY_MARGIN_MINUTES,))
         row = cur.fetchone()
 
         if row:
@@ -197,6 +606,98 @@ def get_active_token(conn):
 
     return None
 
+def count_available_tokens(conn):
+    """Count tokens that get_active_token could hand out right now (ignoring heartbeats)."""
+    with conn.cursor() as cur:
+        cur.execute("""
+            SELECT COUNT(*)
+            FROM meta_tokens
+            WHERE ((status = 'ACTIVE' AND (cooldown_until IS NULL OR cooldown_until < NOW()))
+               OR (status = 'COOLDOWN' AND cooldown_until < NOW()))
+              AND (expires_at IS NULL OR expires_at > NOW() + (%s || ' minutes')::interval)
+        """, (TOKEN_EXPIRY_MARGIN_MINUTES,))
+        return cur.fetchone()[0]
+
+# --- Status snapshot ---
+# One round trip for everything the status monitor shows. By default it reads the
+# trigger-maintained status_counters table (db_migrate_status_counters.py); exact=True
+# (or min_reach) counts the tables themselves in a single combined statement.
+
+TOKEN_POOL_SQL = """
+    SELECT 'meta_tokens', 'available', '*', COUNT(*)
+    FROM meta_tokens
+    WHERE ((status = 'ACTIVE' AND (cooldown_until IS NULL OR cooldown_until < NOW()))
+       OR (status = 'COOLDOWN' AND cooldown_until < NOW()))
+      AND (expires_at IS NULL OR expires_at > NOW())
+    UNION ALL
+    SELECT 'meta_tokens', 'expiring_24h', '*', COUNT(*)
+    FROM meta_tokens
+    WHERE status <> 'INVALID' AND expires_at BETWEEN NOW() AND NOW() + INTERVAL '24 hours'
+    UNION ALL
+    SELECT 'meta_tokens', 'next_recovery_s', '*',
+           COALESCE(EXTRACT(EPOCH FROM MIN(cooldown_until) - NOW())::bigint, -1)
+    FROM meta_tokens
+    WHERE status = 'COOLDOWN' AND cooldown_until >= NOW()
+"""
+
+EXACT_STATUS_SQL = """
+    WITH p AS (
+        SELECT ads_status, media_status, classification_status
+        FROM pages {pages_filter}
+    )
+    SELECT 'search_terms', 'status', COALESCE(status, '(null)'), COUNT(*) FROM search_terms GROUP BY status
+    UNION ALL
+    SELECT 'search_terms', '*', '*', COUNT(*) FROM search_terms
+    UNION ALL
+    SELECT 'pages',
+           CASE WHEN GROUPING(ads_status) = 0 THEN 'ads_status'
+                WHEN GROUPING(media_status) = 0 THEN 'media_status'
+                WHEN GROUPING(classification_status) = 0 THEN 'classification_status'
+                ELSE '*' END,
+           CASE WHEN GROUPING(ads_status) = 0 THEN COALESCE(ads_status, '(null)')
+                WHEN GROUPING(media_status) = 0 THEN COALESCE(media_status, '(null)')
+                WHEN GROUPING(classification_status) = 0 THEN COALESCE(classification_status, '(null)')
+                ELSE '*' END,
+           COUNT(*)
+    FROM p
+    GROUP BY GROUPING SETS ((ads_status), (media_status), (classification_status), ())
+    UNION ALL
+    SELECT 'ads', '*', '*', COUNT(*) FROM ads
+    UNION ALL
+    SELECT 'page_top_creatives', '*', '*', COUNT(*) FROM page_top_creatives
+    UNION ALL
+    SELECT 'meta_tokens', 'status', COALESCE(status, '(null)'), COUNT(*) FROM meta_tokens GROUP BY status
+    UNION ALL
+    SELECT 'meta_tokens', '*', '*', COUNT(*) FROM meta_tokens
+    UNION ALL
+"""
+
+def fetch_status_snapshot(conn, exact=False, min_reach=None):
+    """
+    Returns {"<table>.<column>": {status: count}} for terms, pages, ads, creatives and
+    tokens, plus "meta_tokens.available" and "meta_tokens.next_recovery_s" (-1 = none).
+    Falls back to exact counting if the status_counters table is missing.
+    """
+    with conn.cursor() as cur:
+        if not exact and min_reach is None:
+            cur.execute("SELECT to_regclass('status_counters') IS NOT NULL")
+            exact = not cur.fetchone()[0]
+        if exact or min_reach is not None:
+            pages_filter = "WHERE active_total_eu_reach >= %s" if min_reach is not None else ""
+            cur.execute(EXACT_STATUS_SQL.format(pages_filter=pages_filter) + TOKEN_POOL_SQL,
+                        (min_reach,) if min_reach is not None else None)
+        else:
+            cur.execute("SELECT table_name, column_name, status, count FROM status_counters UNION ALL"
+                        + TOKEN_POOL_SQL)
+        rows = cur.fetchall()
+    conn.commit()
+
+    snapshot = {}
+    for table, column, status, count in rows:
+        snapshot.setdefault(f"{table}.{column}", {})[status] = count
+    return snapshot
+
+@traced_db("db.update_token_heartbeat")
 def update_token_heartbeat(conn, token):
     """Update the heartbeat_at timestamp for a token to signal it's still in use."""
     with conn.cursor() as cur:
@@ -231,15 +732,13 @@ def report_token_success(conn, token):
 
 def reset_stuck_pages(conn):
     """
-    Reset pages with media_status = 'processing' back to 'pending'.
+    Reclaim pages stuck in media_status = 'processing' whose lease has expired.
     Only touches media_status — ads_status is Step 3's responsibility.
+    Safe to run while other workers are active: live leases are left alone.
     """
-    with conn.cursor() as cur:
-        cur.execute("UPDATE pages SET media_status = 'pending' WHERE media_status = 'processing'")
-        media_count = cur.rowcount
-    conn.commit()
-    return media_count
+    return reclaim_expired_leases(conn, 'media_status')
 
+@traced_db("db.increment_media_retry")
 def increment_media_retry(conn, page_id, max_retries=3):
     """
     Increment media_retry_count for a page after an error.
@@ -267,24 +766,119 @@ def increment_media_retry(conn, page_id, max_retries=3):
             (new_status, page_id)
         )
     conn.commit()
+    STATUS_TRANSITIONS.inc(table='pages', column='media_status', status=new_status)
     return new_status
 
 def reset_stuck_terms(conn):
     """
-    Reset search terms that are stuck in 'processing' or 'error' back to 'pending'.
+    Reset search terms in 'error' back to 'pending', and reclaim terms stuck in
+    'processing' whose lease has expired (abandoned by a crashed worker).
     This ensures the pipeline can always resume after a crash or error.
     """
     with conn.cursor() as cur:
-        cur.execute("""
-            UPDATE search_terms 
-            SET status = 'pending' 
-            WHERE status IN ('processing', 'error')
+        cur.execute("UPDATE search_terms SET status = 'pending' WHERE status = 'error'")
+        count = cur.rowcount
+    conn.commit()
+    return count + reclaim_expired_leases(conn, 'term_status')
+
+# --- Leases ---
+# Every status column that can be 'processing' has an (owner, expires_at) pair.
+# A worker claims an item by taking the lease; it keeps it alive with
+# renew_leases() and only items whose lease expired are ever reclaimed.
+
+LEASES = {
+    # kind: (table, key column, status column, owner column, expiry column)
+    'term_status': ('search_terms', 'id', 'status', 'lease_owner', 'lease_expires_at'),
+    'ads_status': ('pages', 'page_id', 'ads_status', 'ads_lease_owner', 'ads_lease_expires_at'),
+    'media_status': ('pages', 'page_id', 'media_status', 'media_lease_owner', 'media_lease_expires_at'),
+}
+
+@traced_db("db.claim_item")
+def claim_item(conn, kind, item_id, owner=WORKER_ID, seconds=LEASE_SECONDS):
+    """
+    Atomically mark an item as 'processing' under a lease held by `owner`.
+    Returns False if another worker holds a live lease on it.
+    """
+    table, key, status, owner_col, expires_col = LEASES[kind]
+    extra = ", last_processed_at = NOW()" if table == 'search_terms' else ""
+    with conn.cursor() as cur:
+        cur.execute(f"""
+            UPDATE {table}
+            SET {status} = 'processing',
+                {owner_col} = %s,
+                {expires_col} = NOW() + (%s || ' seconds')::interval{extra}
+            WHERE {key} = %s
+              AND ({status} IS DISTINCT FROM 'processing'
+                   OR {expires_col} IS NULL
+                   OR {expires_col} < NOW()
+                   OR {owner_col} = %s)
+        """, (owner, seconds, item_id, owner))
+        claimed = cur.rowcount > 0
+    conn.commit()
+    if claimed:
+        STATUS_TRANSITIONS.inc(table=table, column=status, status='processing')
+    return claimed
+
+def release_item(conn, kind, item_id, owner=WORKER_ID, status_value='pending'):
+    """Give an in-flight item back (e.g. on shutdown) so another worker can take it."""
+    table, key, status, owner_col, expires_col = LEASES[kind]
+    with conn.cursor() as cur:
+        cur.execute(f"""
+            UPDATE {table}
+            SET {status} = %s, {owner_col} = NULL, {expires_col} = NULL
+            WHERE {key} = %s AND {status} = 'processing' AND {owner_col} = %s
+        """, (status_value, item_id, owner))
+        released = cur.rowcount > 0
+    conn.commit()
+    return released
+
+def renew_leases(conn, owner=WORKER_ID, seconds=LEASE_SECONDS):
+    """Extend every lease currently held by `owner`. Returns the number of items renewed."""
+    renewed = 0
+    with conn.cursor() as cur:
+        for table, key, status, owner_col, expires_col in LEASES.values():
+            cur.execute(f"""
+                UPDATE {table}
+                SET {expires_col} = NOW() + (%s || ' seconds')::interval
+                WHERE {status} = 'processing' AND {owner_col} = %s
+            """, (seconds, owner))
+            renewed += cur.rowcount
+    conn.commit()
+    return renewed
+
+def release_all_leases(conn, owner=WORKER_ID):
+    """Put every item still held by `owner` back to 'pending'. Returns counts per kind."""
+    counts = {}
+    with conn.cursor() as cur:
+        for kind, (table, key, status, owner_col, expires_col) in LEASES.items():
+            cur.execute(f"""
+                UPDATE {table}
+                SET {status} = 'pending', {owner_col} = NULL, {expires_col} = NULL
+                WHERE {status} = 'processing' AND {owner_col} = %s
+            """, (owner,))
+            counts[kind] = cur.rowcount
+    conn.commit()
+    return counts
+
+def reclaim_expired_leases(conn, kind):
+    """
+    Put abandoned items (status 'processing' with an expired or missing lease)
+    back to 'pending'. Items with a live lease are never touched.
+    """
+    table, key, status, owner_col, expires_col = LEASES[kind]
+    with conn.cursor() as cur:
+        cur.execute(f"""
+            UPDATE {table}
+            SET {status} = 'pending', {owner_col} = NULL, {expires_col} = NULL
+            WHERE {status} = 'processing'
+              AND ({expires_col} IS NULL OR {expires_col} < NOW())
         """)
         count = cur.rowcount
     conn.commit()
     return count
 
 
+@traced_db("db.mark_token_cooldown")
 def mark_token_cooldown(conn, token: str, minutes: int):
     with conn.cursor() as cur:
         cur.execute("""
@@ -296,8 +890,120 @@ def mark_token_cooldown(conn, token: str, minutes: int):
             WHERE token = %s
         """, (minutes, token))
     conn.commit()
+    STATUS_TRANSITIONS.inc(table='meta_tokens', column='status', status='COOLDOWN')
+
+
+def fetch_tokens_for_health_check(conn, ttl_seconds=None):
+    """
+    Tokens (id, token, status) to re-check: not INVALID and last checked more than
+    `ttl_seconds` ago (or never). ttl_seconds=None returns every token.
+    """
+    with conn.cursor() as cur:
+        if ttl_seconds is None:
+            cur.execute("SELECT id, token, status FROM meta_tokens ORDER BY id")
+        else:
+            cur.execute("""
+                SELECT id, token, status
+                FROM meta_tokens
+                WHERE status <> 'INVALID'
+                  AND (health_checked_at IS NULL OR health_checked_at < NOW() - (%s || ' seconds')::interval)
+                ORDER BY id
+            """, (ttl_seconds,))
+        return cur.fetchall()
+
+def apply_token_health(conn, rows):
+    """
+    Bulk-write health check results. rows: (token, is_valid, expires_at, error).
+    Invalid tokens become INVALID; every row gets expires_at and health_checked_at.
+    """
+    if not rows:
+        return 0
+    with conn.cursor() as cur:
+        execute_values(cur, """
+            UPDATE meta_tokens t
+            SET expires_at = v.expires_at,
+                health_checked_at = NOW(),
+                health_error = v.error,
+                status = CASE WHEN v.is_valid THEN t.status ELSE 'INVALID' END,
+                updated_at = CASE WHEN v.is_valid THEN t.updated_at ELSE NOW() END
+            FROM (VALUES %s) AS v(token, is_valid, expires_at, error)
+            WHERE t.token = v.token
+        """, rows, template="(%s, %s, %s::timestamptz, %s)", page_size=len(rows))
+        count = cur.rowcount
+    conn.commit()
+    invalidated = sum(1 for r in rows if not r[1])
+    if invalidated:
+        STATUS_TRANSITIONS.inc(invalidated, table='meta_tokens', column='status', status='INVALID')
+    return count
+
+def insert_token_usage_samples(conn, samples):
+    """
+    Bulk-insert usage samples (token, sampled_at, call_count, total_cputime, total_time,
+    regain_minutes, calls) and store each token's latest usage on meta_tokens.
+    """
+    if not samples:
+        return 0
+    with conn.cursor() as cur:
+        execute_values(cur, """
+            INSERT INTO token_usage_samples
+                (token_id, sampled_at, call_count, total_cputime, total_time, regain_minutes, calls)
+            SELECT t.id, v.sampled_at, v.call_count, v.total_cputime, v.total_time, v.regain_minutes, v.calls
+            FROM (VALUES %s) AS v(token, sampled_at, call_count, total_cputime, total_time, regain_minutes, calls)
+            JOIN meta_tokens t ON t.token = v.token
+        """, samples, template="(%s, %s::timestamptz, %s::smallint, %s::smallint, %s::smallint, %s::int, %s::int)",
+            page_size=len(samples))
+        written = cur.rowcount
+
+        latest = {}
+        for token, sampled_at, call_count, cputime, total_time, _, _ in samples:
+            if token not in latest or sampled_at > latest[token][2]:
+                latest[token] = (token, max(call_count, cputime, total_time), sampled_at)
+        execute_values(cur, """
+            UPDATE meta_tokens t
+            SET last_usage_pct = v.pct, last_usage_at = v.sampled_at
+            FROM (VALUES %s) AS v(token, pct, sampled_at)
+            WHERE t.token = v.token AND (t.last_usage_at IS NULL OR t.last_usage_at <= v.sampled_at)
+        """, list(latest.values()), template="(%s, %s::smallint, %s::timestamptz)", page_size=len(latest))
+    conn.commit()
+    return written
 
+def prune_token_usage_samples(conn, days):
+    with conn.cursor() as cur:
+        cur.execute("DELETE FROM token_usage_samples WHERE sampled_at < NOW() - (%s || ' days')::interval", (days,))
+        count = cur.rowcount
+    conn.commit()
+    return count
+
+def fetch_token_usage_report(conn, hours=24):
+    """
+    Per token over the last `hours`: (id, token, status, samples, calls, peak_pct,
+    predicted_pct, calls_per_pct). calls_per_pct is the median of (our calls in the
+    trailing hour / reported usage %), i.e. how many calls one percent of budget buys.
+    """
+    with conn.cursor() as cur:
+        cur.execute(f"""
+            WITH s AS (
+                SELECT token_id, sampled_at, calls,
+                       GREATEST(call_count, total_cputime, total_time) AS pct,
+                       SUM(calls) OVER (
+                           PARTITION BY token_id ORDER BY sampled_at
+                           RANGE BETWEEN INTERVAL '1 hour' PRECEDING AND CURRENT ROW
+                       ) AS calls_1h
+                FROM token_usage_samples
+                WHERE sampled_at > NOW() - (%s || ' hours')::interval - INTERVAL '1 hour'
+            )
+            SELECT t.id, t.token, t.status,
+                   COUNT(s.token_id), COALESCE(SUM(s.calls), 0), MAX(s.pct),
+                   ROUND({PREDICTED_USAGE_SQL}::numeric, 1),
+                   PERCENTILE_CONT(0.5) WITHIN GROUP (ORDER BY s.calls_1h::float / s.pct) FILTER (WHERE s.pct >= 5)
+            FROM meta_tokens t
+            LEFT JOIN s ON s.token_id = t.id AND s.sampled_at > NOW() - (%s || ' hours')::interval
+            GROUP BY t.id
+            ORDER BY t.id
+        """, (hours, hours))
+        return cur.fetchall()
 
+@traced_db("db.mark_token_invalid")
 def mark_token_invalid(conn, token: str):
     with conn.cursor() as cur:
         cur.execute("""
@@ -308,6 +1014,7 @@ def mark_token_invalid(conn, token: str):
             WHERE token = %s
         """, (token,))
     conn.commit()
+    STATUS_TRANSITIONS.inc(table='meta_tokens', column='status', status='INVALID')
 
 # --- Classification (Step 5) ---
 
@@ -329,6 +1036,7 @@ def fetch_classification_pending_pages(conn, limit=1000):
             pages_list.append(row)
     return pages_list
 
+@traced_db("db.fetch_page_ads_bodies")
 def fetch_page_ads_bodies(conn, page_id):
     """Fetch ad bodies from ads table for a specific page."""
     bodies = []
@@ -363,12 +1071,19 @@ def get_pending_openai_batches(conn):
             batches.append(row[0])
     return batches
 
+def count_openai_batches(conn):
+    """Number of openai_batches rows per status."""
+    with conn.cursor() as cur:
+        cur.execute("SELECT status, COUNT(*) FROM openai_batches GROUP BY status")
+        return dict(cur.fetchall())
+
 def update_openai_batch_status(conn, batch_id, status):
     """Update status of a batch."""
     with conn.cursor() as cur:
         cur.execute("UPDATE openai_batches SET status = %s WHERE batch_id = %s", (status, batch_id))
     conn.commit()
 
+@traced_db("db.mark_page_classification")
 def mark_page_classification(conn, page_id, category, raw_category, status='completed'):
     """Update page with final classification result."""
     with conn.cursor() as cur:
@@ -380,3 +1095,60 @@ def mark_page_classification(conn, page_id, category, raw_category, status='comp
             WHERE page_id = %s
         """, (category, raw_category, status, page_id))
     conn.commit()
+    STATUS_TRANSITIONS.inc(table='pages', column='classification_status', status=status)
+
+# --- Admin resets (cli.py reset) ---
+
+PAGE_STATUS_COLUMNS = ('ads_status', 'media_status', 'classification_status')
+
+def reset_all_data(conn):
+    """Delete all pages, ads and creatives and put every search term back to 'pending'."""
+    counts = {}
+    with conn.cursor() as cur:
+        for table in ('page_top_creatives', 'ads', 'pages'):
+            cur.execute(f"DELETE FROM {table}")
+            counts[table] = cur.rowcount
+        cur.execute("UPDATE search_terms SET status = 'pending', last_processed_at = NULL")
+        counts['search_terms'] = cur.rowcount
+    conn.commit()
+    return counts
+
+def reactivate_tokens(conn):
+    """Clear cooldowns: every token that isn't INVALID becomes ACTIVE."""
+    with conn.cursor() as cur:
+        cur.execute("""
+            UPDATE meta_tokens SET status = 'ACTIVE', cooldown_until = NULL, heartbeat_at = NULL
+            WHERE status != 'INVALID'
+        """)
+        count = cur.rowcount
+    conn.commit()
+    return count
+
+def reset_page_status(conn, column, from_status='completed', to_status='pending',
+                      min_reach=None, limit=None, dry_run=False):
+    """
+    Move pages from one status to another in `column` (e.g. to re-scrape or re-classify).
+    Media and classification resets only touch pages whose ads are completed.
+    Returns how many pages were (or, with dry_run, would be) reset.
+    """
+    if column not in PAGE_STATUS_COLUMNS:
+        raise ValueError(f"Unknown page status column: {column}")
+    where, params = [f"{column} = %s"], [from_status]
+    if column != 'ads_status':
+        where.append("ads_status = 'completed'")
+    if min_reach is not None:
+        where.append("active_total_eu_reach >= %s")
+        params.append(min_reach)
+    selected = f"SELECT page_id FROM pages WHERE {' AND '.join(where)}"
+    if limit:
+        selected += f" LIMIT {int(limit)}"
+
+    with conn.cursor() as cur:
+        if dry_run:
+            cur.execute(f"SELECT COUNT(*) FROM ({selected}) s", params)
+            return cur.fetchone()[0]
+        cur.execute(f"UPDATE pages SET {column} = %s WHERE page_id IN ({selected})", [to_status] + params)
+        count = cur.rowcount
+    conn.commit()
+    STATUS_TRANSITIONS.inc(count, table='pages', column=column, status=to_status)
+    return count
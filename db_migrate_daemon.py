@@ -0,0 +1,48 @@
+from db.postgres_client import get_conn, NEW_TERMS_CHANNEL
+import logging
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# One NOTIFY per INSERT statement (payload-free: the daemon re-reads pending terms anyway)
+NOTIFY_FUNCTION = f"""
+CREATE OR REPLACE FUNCTION search_terms_notify() RETURNS trigger
+LANGUAGE plpgsql AS $fn$
+BEGIN
+    PERFORM pg_notify('{NEW_TERMS_CHANNEL}', '');
+    RETURN NULL;
+END
+$fn$;
+"""
+
+def migrate():
+    conn = get_conn()
+    try:
+        with conn.cursor() as cur:
+            # Insert → pages visible latency. Existing rows keep created_at NULL (unknown)
+            logger.info("Adding created_at / pages_visible_at to search_terms table...")
+            cur.execute("ALTER TABLE search_terms ADD COLUMN IF NOT EXISTS created_at TIMESTAMPTZ;")
+            cur.execute("ALTER TABLE search_terms ALTER COLUMN created_at SET DEFAULT NOW();")
+            cur.execute("ALTER TABLE search_terms ADD COLUMN IF NOT EXISTS pages_visible_at TIMESTAMPTZ;")
+
+            logger.info(f"Installing search_terms insert trigger (NOTIFY {NEW_TERMS_CHANNEL})...")
+            cur.execute(NOTIFY_FUNCTION)
+            cur.execute("DROP TRIGGER IF EXISTS search_terms_notify ON search_terms;")
+            cur.execute("""
+                CREATE TRIGGER search_terms_notify
+                AFTER INSERT ON search_terms
+                FOR EACH STATEMENT EXECUTE PROCEDURE search_terms_notify();
+            """)
+
+        conn.commit()
+        logger.info("Migration successful!")
+        return True
+    except Exception as e:
+        conn.rollback()
+        logger.error(f"Migration failed: {e}")
+        return False
+    finally:
+        conn.close()
+
+if __name__ == "__main__":
+    raise SystemExit(0 if migrate() else 1)
@@ -0,0 +1,48 @@
+from db.postgres_client import get_conn
+import logging
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+def migrate():
+    conn = get_conn()
+    try:
+        with conn.cursor() as cur:
+            # Lease columns: an item in 'processing' is only reclaimable once its lease expires
+            logger.info("Adding lease columns to search_terms table...")
+            cur.execute("ALTER TABLE search_terms ADD COLUMN IF NOT EXISTS lease_owner VARCHAR;")
+            cur.execute("ALTER TABLE search_terms ADD COLUMN IF NOT EXISTS lease_expires_at TIMESTAMPTZ;")
+
+            logger.info("Adding ads/media lease columns to pages table...")
+            cur.execute("ALTER TABLE pages ADD COLUMN IF NOT EXISTS ads_lease_owner VARCHAR;")
+            cur.execute("ALTER TABLE pages ADD COLUMN IF NOT EXISTS ads_lease_expires_at TIMESTAMPTZ;")
+            cur.execute("ALTER TABLE pages ADD COLUMN IF NOT EXISTS media_lease_owner VARCHAR;")
+            cur.execute("ALTER TABLE pages ADD COLUMN IF NOT EXISTS media_lease_expires_at TIMESTAMPTZ;")
+
+            # Partial indexes keep the reclaim/renew scans cheap (only in-flight rows)
+            logger.info("Creating lease indexes...")
+            cur.execute("""
+                CREATE INDEX IF NOT EXISTS idx_search_terms_lease
+                ON search_terms (lease_owner, lease_expires_at) WHERE status = 'processing';
+            """)
+            cur.execute("""
+                CREATE INDEX IF NOT EXISTS idx_pages_ads_lease
+                ON pages (ads_lease_owner, ads_lease_expires_at) WHERE ads_status = 'processing';
+            """)
+            cur.execute("""
+                CREATE INDEX IF NOT EXISTS idx_pages_media_lease
+                ON pages (media_lease_owner, media_lease_expires_at) WHERE media_status = 'processing';
+            """)
+
+        conn.commit()
+        logger.info("Migration successful!")
+        return True
+    except Exception as e:
+        conn.rollback()
+        logger.error(f"Migration failed: {e}")
+        return False
+    finally:
+        conn.close()
+
+if __name__ == "__main__":
+    raise SystemExit(0 if migrate() else 1)
@@ -0,0 +1,53 @@
+from db.postgres_client import get_conn
+import logging
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+def migrate():
+    conn = get_conn()
+    try:
+        with conn.cursor() as cur:
+            logger.info("Adding active_ads_count to pages table...")
+            cur.execute("ALTER TABLE pages ADD COLUMN IF NOT EXISTS active_ads_count INTEGER DEFAULT 0;")
+
+            # Step 3 recomputes a page's aggregates from its active ads after every fetch
+            logger.info("Creating index on active ads per page...")
+            cur.execute("""
+                CREATE INDEX IF NOT EXISTS idx_ads_page_active
+                ON ads (page_id) INCLUDE (eu_total_reach)
+                WHERE is_active;
+            """)
+
+            # Step 5 candidates (classification pending, active_total_eu_reach >= 200000)
+            logger.info("Creating index for the classification filter...")
+            cur.execute("""
+                CREATE INDEX IF NOT EXISTS idx_pages_classification_reach
+                ON pages (active_total_eu_reach)
+                WHERE classification_status = 'pending' AND ads_status = 'completed';
+            """)
+
+            logger.info("Backfilling active_ads_count...")
+            cur.execute("""
+                UPDATE pages SET active_ads_count = s.active_count
+                FROM (
+                    SELECT page_id, COUNT(*) AS active_count
+                    FROM ads WHERE is_active
+                    GROUP BY page_id
+                ) AS s
+                WHERE pages.page_id = s.page_id
+            """)
+            logger.info(f"Backfilled {cur.rowcount} page(s).")
+
+        conn.commit()
+        logger.info("Migration successful!")
+        return True
+    except Exception as e:
+        conn.rollback()
+        logger.error(f"Migration failed: {e}")
+        return False
+    finally:
+        conn.close()
+
+if __name__ == "__main__":
+    raise SystemExit(0 if migrate() else 1)
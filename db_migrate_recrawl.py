@@ -0,0 +1,47 @@
+from db.postgres_client import get_conn
+from config.settings import RECRAWL_INITIAL_HOURS
+import logging
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+def migrate():
+    conn = get_conn()
+    try:
+        with conn.cursor() as cur:
+            logger.info("Adding re-crawl schedule columns to pages table...")
+            cur.execute("ALTER TABLE pages ADD COLUMN IF NOT EXISTS ads_crawled_at TIMESTAMPTZ;")
+            cur.execute("ALTER TABLE pages ADD COLUMN IF NOT EXISTS ads_crawl_interval_hours REAL;")
+            cur.execute("ALTER TABLE pages ADD COLUMN IF NOT EXISTS next_ads_crawl_at TIMESTAMPTZ;")
+
+            # Pages crawled before the scheduler existed: spread their first re-crawl over
+            # the initial interval instead of making them all due at once
+            logger.info("Scheduling already crawled pages...")
+            cur.execute("""
+                UPDATE pages
+                SET next_ads_crawl_at = NOW() + random() * %s * INTERVAL '1 hour'
+                WHERE ads_status IN ('completed', 'not_found')
+                  AND next_ads_crawl_at IS NULL
+                  AND manual_status IS DISTINCT FROM 'deleted'
+            """, (RECRAWL_INITIAL_HOURS,))
+            logger.info(f"Scheduled {cur.rowcount} page(s).")
+
+            logger.info("Creating index on next_ads_crawl_at...")
+            cur.execute("""
+                CREATE INDEX IF NOT EXISTS idx_pages_next_ads_crawl
+                ON pages (next_ads_crawl_at)
+                WHERE next_ads_crawl_at IS NOT NULL;
+            """)
+
+        conn.commit()
+        logger.info("Migration successful!")
+        return True
+    except Exception as e:
+        conn.rollback()
+        logger.error(f"Migration failed: {e}")
+        return False
+    finally:
+        conn.close()
+
+if __name__ == "__main__":
+    raise SystemExit(0 if migrate() else 1)
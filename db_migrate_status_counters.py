@@ -0,0 +1,128 @@
+from db.postgres_client import get_conn
+import logging
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# table → status columns kept in status_counters ('*' = total row count)
+COUNTED = {
+    'search_terms': ['*', 'status'],
+    'pages': ['*', 'ads_status', 'media_status', 'classification_status'],
+    'ads': ['*'],
+    'page_top_creatives': ['*'],
+    'meta_tokens': ['*', 'status'],
+}
+
+# Statement-level trigger: one aggregate over the transition tables per statement,
+# so a 10k-row execute_values upsert touches each counter row once, not 10k times.
+APPLY_FUNCTION = """
+CREATE OR REPLACE FUNCTION status_counters_apply() RETURNS trigger
+LANGUAGE plpgsql AS $fn$
+DECLARE
+    col text;
+    expr text;
+    parts text[];
+BEGIN
+    FOREACH col IN ARRAY TG_ARGV LOOP
+        IF col = '*' THEN
+            expr := quote_literal('*');
+        ELSE
+            expr := format('COALESCE(%I::text, %L)', col, '(null)');
+        END IF;
+        parts := ARRAY[]::text[];
+        IF TG_OP IN ('INSERT', 'UPDATE') THEN
+            parts := parts || format('SELECT %s AS status, count(*) AS n FROM new_rows GROUP BY 1', expr);
+        END IF;
+        IF TG_OP IN ('UPDATE', 'DELETE') THEN
+            parts := parts || format('SELECT %s AS status, -count(*) AS n FROM old_rows GROUP BY 1', expr);
+        END IF;
+        EXECUTE format($q$
+            INSERT INTO status_counters (table_name, column_name, status, count)
+            SELECT %L, %L, status, SUM(n) FROM (%s) d
+            GROUP BY status HAVING SUM(n) <> 0
+            ORDER BY status
+            ON CONFLICT (table_name, column_name, status)
+            DO UPDATE SET count = status_counters.count + EXCLUDED.count, updated_at = NOW()
+        $q$, TG_TABLE_NAME, col, array_to_string(parts, ' UNION ALL '));
+    END LOOP;
+    RETURN NULL;
+END
+$fn$;
+"""
+
+TRUNCATE_FUNCTION = """
+CREATE OR REPLACE FUNCTION status_counters_truncate() RETURNS trigger
+LANGUAGE plpgsql AS $fn$
+BEGIN
+    DELETE FROM status_counters WHERE table_name = TG_TABLE_NAME;
+    RETURN NULL;
+END
+$fn$;
+"""
+
+def migrate():
+    conn = get_conn()
+    try:
+        with conn.cursor() as cur:
+            logger.info("Creating status_counters table...")
+            cur.execute("""
+                CREATE TABLE IF NOT EXISTS status_counters (
+                    table_name VARCHAR NOT NULL,
+                    column_name VARCHAR NOT NULL,
+                    status VARCHAR NOT NULL,
+                    count BIGINT NOT NULL DEFAULT 0,
+                    updated_at TIMESTAMPTZ DEFAULT NOW(),
+                    PRIMARY KEY (table_name, column_name, status)
+                );
+            """)
+            cur.execute(APPLY_FUNCTION)
+            cur.execute(TRUNCATE_FUNCTION)
+
+            # Triggers and the backfill run in one transaction: CREATE TRIGGER locks out
+            # writers until commit, so the counts can't drift between the two.
+            for table, columns in COUNTED.items():
+                logger.info(f"Installing status counter triggers on {table} ({', '.join(columns)})...")
+                args = ", ".join(f"'{c}'" for c in columns)
+                for op, referencing in (
+                    ('INSERT', 'NEW TABLE AS new_rows'),
+                    ('UPDATE', 'OLD TABLE AS old_rows NEW TABLE AS new_rows'),
+                    ('DELETE', 'OLD TABLE AS old_rows'),
+                ):
+                    trigger = f"status_counters_{op.lower()}"
+                    cur.execute(f"DROP TRIGGER IF EXISTS {trigger} ON {table};")
+                    if op == 'UPDATE' and columns == ['*']:
+                        continue  # updates never change a row count
+                    cur.execute(f"""
+                        CREATE TRIGGER {trigger}
+                        AFTER {op} ON {table}
+                        REFERENCING {referencing}
+                        FOR EACH STATEMENT EXECUTE PROCEDURE status_counters_apply({args});
+                    """)
+                cur.execute(f"DROP TRIGGER IF EXISTS status_counters_truncate ON {table};")
+                cur.execute(f"""
+                    CREATE TRIGGER status_counters_truncate
+                    AFTER TRUNCATE ON {table}
+                    FOR EACH STATEMENT EXECUTE PROCEDURE status_counters_truncate();
+                """)
+
+                logger.info(f"Backfilling counters for {table}...")
+                cur.execute("DELETE FROM status_counters WHERE table_name = %s", (table,))
+                for col in columns:
+                    expr = "'*'" if col == '*' else f"COALESCE({col}::text, '(null)')"
+                    cur.execute(f"""
+                        INSERT INTO status_counters (table_name, column_name, status, count)
+                        SELECT %s, %s, {expr}, COUNT(*) FROM {table} GROUP BY 3
+                    """, (table, col))
+
+        conn.commit()
+        logger.info("Migration successful!")
+        return True
+    except Exception as e:
+        conn.rollback()
+        logger.error(f"Migration failed: {e}")
+        return False
+    finally:
+        conn.close()
+
+if __name__ == "__main__":
+    raise SystemExit(0 if migrate() else 1)
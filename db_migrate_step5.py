@@ -33,11 +33,13 @@ def migrate():
             
         conn.commit()
         logger.info("Migration successful!")
+        return True
     except Exception as e:
         conn.rollback()
         logger.error(f"Migration failed: {e}")
+        return False
     finally:
         conn.close()
 
 if __name__ == "__main__":
-    migrate()
+    raise SystemExit(0 if migrate() else 1)
@@ -12,11 +12,13 @@ def migrate():
             cur.execute("ALTER TABLE ads ADD COLUMN IF NOT EXISTS ad_creative_bodies TEXT;")
         conn.commit()
         logger.info("Migration successful!")
+        return True
     except Exception as e:
         conn.rollback()
         logger.error(f"Migration failed: {e}")
+        return False
     finally:
         conn.close()
 
 if __name__ == "__main__":
-    migrate()
+    raise SystemExit(0 if migrate() else 1)
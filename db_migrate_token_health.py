@@ -0,0 +1,28 @@
+from db.postgres_client import get_conn
+import logging
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+def migrate():
+    conn = get_conn()
+    try:
+        with conn.cursor() as cur:
+            # Results of /debug_token checks (api/token_health.py)
+            logger.info("Adding health check columns to meta_tokens table...")
+            cur.execute("ALTER TABLE meta_tokens ADD COLUMN IF NOT EXISTS expires_at TIMESTAMPTZ;")
+            cur.execute("ALTER TABLE meta_tokens ADD COLUMN IF NOT EXISTS health_checked_at TIMESTAMPTZ;")
+            cur.execute("ALTER TABLE meta_tokens ADD COLUMN IF NOT EXISTS health_error VARCHAR;")
+
+        conn.commit()
+        logger.info("Migration successful!")
+        return True
+    except Exception as e:
+        conn.rollback()
+        logger.error(f"Migration failed: {e}")
+        return False
+    finally:
+        conn.close()
+
+if __name__ == "__main__":
+    raise SystemExit(0 if migrate() else 1)
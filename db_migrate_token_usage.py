@@ -0,0 +1,45 @@
+from db.postgres_client import get_conn
+import logging
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+def migrate():
+    conn = get_conn()
+    try:
+        with conn.cursor() as cur:
+            # Usage time series from x-business-use-case-usage (api/usage_telemetry.py)
+            logger.info("Creating token_usage_samples table...")
+            cur.execute("""
+                CREATE TABLE IF NOT EXISTS token_usage_samples (
+                    token_id INT NOT NULL REFERENCES meta_tokens(id) ON DELETE CASCADE,
+                    sampled_at TIMESTAMPTZ NOT NULL,
+                    call_count SMALLINT,
+                    total_cputime SMALLINT,
+                    total_time SMALLINT,
+                    regain_minutes INT,
+                    calls INT NOT NULL DEFAULT 1
+                );
+            """)
+            cur.execute("""
+                CREATE INDEX IF NOT EXISTS idx_token_usage_samples_token_time
+                ON token_usage_samples (token_id, sampled_at);
+            """)
+
+            # Latest usage per token, read by get_active_token (headroom rotation, the default)
+            logger.info("Adding usage columns to meta_tokens table...")
+            cur.execute("ALTER TABLE meta_tokens ADD COLUMN IF NOT EXISTS last_usage_pct SMALLINT;")
+            cur.execute("ALTER TABLE meta_tokens ADD COLUMN IF NOT EXISTS last_usage_at TIMESTAMPTZ;")
+
+        conn.commit()
+        logger.info("Migration successful!")
+        return True
+    except Exception as e:
+        conn.rollback()
+        logger.error(f"Migration failed: {e}")
+        return False
+    finally:
+        conn.close()
+
+if __name__ == "__main__":
+    raise SystemExit(0 if migrate() else 1)
@@ -8,7 +8,7 @@ DB_URL = os.getenv("DB_URL")
 def apply_migration():
     if not DB_URL:
         print("Missing DB_URL in .env")
-        return
+        return False
 
     try:
         conn = psycopg2.connect(DB_URL)
@@ -32,8 +32,10 @@ def apply_migration():
         
         cur.close()
         conn.close()
+        return True
     except Exception as e:
         print(f"Error applying migration: {e}")
+        return False
 
 if __name__ == "__main__":
-    apply_migration()
+    raise SystemExit(0 if apply_migration() else 1)
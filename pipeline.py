@@ -1,4 +1,5 @@
 
+import argparse
 import logging
 import threading
 import asyncio
@@ -6,33 +7,71 @@ import time
 import sys
 import os
 
-from db.postgres_client import fetch_terms, get_conn, fetch_ads_pending_pages
+from db.postgres_client import (
+    get_conn, fetch_ads_pending_pages, configure_pool, listen, wait_for_notifications,
+    NEW_TERMS_CHANNEL, DB_POOL_SIZE,
+)
+from utils.lifecycle import shutdown_requested, install_signal_handlers, start_lease_heartbeat, wait_for_threads, drain
+from utils.profiling import add_profiling_args, start_from_args
+from utils.metrics import start_metrics_server, QUEUE_DEPTH, OPENAI_BATCHES, OPENAI_BATCH_STATUSES
+from config.settings import (
+    SHUTDOWN_GRACE_SECONDS, DAEMON_POLL_INTERVAL, DAEMON_PAGE_IDS_REFRESH, DAEMON_DB_POOL_SIZE,
+    DAEMON_ERROR_BACKOFF_MAX,
+)
 
 logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
 logger = logging.getLogger(__name__)
 
-from steps.step_2_pages import process_all_terms
-from steps.step_3_ads import process_all_pages
-from steps.step_4_media import main_async as step_4_main
+# Step modules (Meta client, Playwright, ...) are imported inside the functions that
+# run them, so importing pipeline (e.g. from cli.py) stays cheap.
 
 POLL_INTERVAL = 5  # seconds between polling for new pending work
 
+track_openai_batches = True  # False once openai_batches turns out to be missing (db_migrate_step5.py)
+
+
+def update_openai_batch_gauge(conn):
+    """
+    Step 5 runs as its own short-lived process without a metrics endpoint, so the
+    pipeline publishes the batch states from the openai_batches table.
+    """
+    global track_openai_batches
+    if not track_openai_batches:
+        return
+    import psycopg2
+    from db.postgres_client import count_openai_batches
+    try:
+        counts = count_openai_batches(conn)
+    except psycopg2.errors.UndefinedTable:
+        conn.rollback()
+        track_openai_batches = False
+        logger.info("openai_batches missing (run db_migrate_step5.py); not reporting OpenAI batches.")
+        return
+    for status in set(OPENAI_BATCH_STATUSES) | set(counts):
+        OPENAI_BATCHES.set(counts.get(status, 0), status=status)
+
 
 # ─── Step 3 polling loop ────────────────────────────────────────────────────
 
 def step_3_polling_loop(step2_done_event: threading.Event):
     """
     Polls for ads-pending pages and processes them in batches.
-    Stops when: no more pending pages AND step2_done_event is set.
+    Stops when: no more pending pages AND step2_done_event is set, or on shutdown.
     """
-    from db.postgres_client import fetch_ads_pending_pages
+    from db.postgres_client import fetch_ads_pending_pages, reclaim_expired_leases
+    from steps.step_3_ads import process_all_pages, queue_recrawls
+    from api.meta_client import MetaClient
     meta_client_ref = [None]  # lazy init
 
     logger.info("[Step 3] Polling loop started.")
-    while True:
+    while not shutdown_requested.is_set():
         conn = get_conn()
         try:
+            reclaim_expired_leases(conn, 'ads_status')
+            queue_recrawls(conn)
             pages = fetch_ads_pending_pages(conn)
+            QUEUE_DEPTH.set(len(pages), stage="step3_pending")
+            update_openai_batch_gauge(conn)
         except Exception as e:
             logger.error(f"[Step 3] Error fetching pending pages: {e}")
             pages = []
@@ -41,7 +80,9 @@ def step_3_polling_loop(step2_done_event: threading.Event):
 
         if pages:
             logger.info(f"[Step 3] Found {len(pages)} pending pages — processing...")
-            process_all_pages(pages)
+            if meta_client_ref[0] is None:
+                meta_client_ref[0] = MetaClient(stage="pages")
+            process_all_pages(pages, meta_client_ref[0])
         else:
             # No work right now
             if step2_done_event.is_set():
@@ -50,7 +91,7 @@ def step_3_polling_loop(step2_done_event: threading.Event):
                 break
             else:
                 logger.info(f"[Step 3] No pending pages yet. Waiting {POLL_INTERVAL}s...")
-                time.sleep(POLL_INTERVAL)
+                shutdown_requested.wait(POLL_INTERVAL)
 
 
 # ─── Step 4 polling loop ────────────────────────────────────────────────────
@@ -58,25 +99,29 @@ def step_3_polling_loop(step2_done_event: threading.Event):
 async def step_4_polling_loop(step3_done_event: threading.Event):
     """
     Polls for media-pending pages and processes them in batches.
-    Stops when: no more pending pages AND step3_done_event is set.
+    Stops when: no more pending pages AND step3_done_event is set, or on shutdown.
     """
     from playwright.async_api import async_playwright
-    from steps.step_4_media import process_page_media
+    from steps.step_4_media import worker, BrowserPool, media_hit_rates
+    from steps.media_fast_path import close_client
     from db.postgres_client import get_conn, fetch_media_pending_pages, reset_stuck_pages
-    from config.settings import MEDIA_CONCURRENCY, PLAYWRIGHT_HEADLESS
+    from utils.autotuner import get_tuner
+    from utils.profiling import register_loop
 
     logger.info("[Step 4] Polling loop started.")
+    register_loop(asyncio.get_running_loop(), "step4")
 
     async with async_playwright() as p:
-        browser = await p.chromium.launch(headless=PLAYWRIGHT_HEADLESS)
-        context = await browser.new_context()
+        # Browsers and their pages outlive a batch: the next batch's workers reuse them
+        browsers = await BrowserPool(p).start()
 
         try:
-            while True:
+            while not shutdown_requested.is_set():
                 conn = get_conn()
                 try:
                     reset_stuck_pages(conn)
                     pages = fetch_media_pending_pages(conn)
+                    QUEUE_DEPTH.set(len(pages), stage="step4_pending")
                 except Exception as e:
                     logger.error(f"[Step 4] Error fetching pending pages: {e}")
                     pages = []
@@ -91,23 +136,17 @@ async def step_4_polling_loop(step3_done_event: threading.Event):
                     for page in pages:
                         await queue.put(page)
 
-                    async def worker(q):
-                        while True:
-                            item = await q.get()
-                            if item is None:
-                                q.task_done()
-                                break
-                            await process_page_media(context, item)
-                            q.task_done()
-
                     workers = [
-                        asyncio.create_task(worker(queue))
-                        for _ in range(min(MEDIA_CONCURRENCY, len(pages)))
+                        asyncio.create_task(worker(queue, browsers, i))
+                        for i in range(min(get_tuner("media").max_workers, len(pages)))
                     ]
                     await queue.join()
-                    for _ in workers:
-                        await queue.put(None)
-                    await asyncio.gather(*workers)
+
+                    # Every page is done; idle workers may be parked by the tuner, so cancel rather than send sentinels
+                    for w in workers:
+                        w.cancel()
+                    await asyncio.gather(*workers, return_exceptions=True)
+                    logger.info(f"[Step 4] Batch done. Media found by: {media_hit_rates()}.")
 
                 else:
                     # No work right now
@@ -119,30 +158,148 @@ async def step_4_polling_loop(step3_done_event: threading.Event):
                         await asyncio.sleep(POLL_INTERVAL)
 
         finally:
-            await browser.close()
+            await browsers.close()
+            await close_client()
+
+
+# ─── Step 2 daemon loop ─────────────────────────────────────────────────────
+
+def terms_due(terms, backoff, now):
+    """
+    Drop 'error' terms that are still backing off. A term found in 'error' again has
+    failed again, so each retry doubles its delay (DAEMON_POLL_INTERVAL up to
+    DAEMON_ERROR_BACKOFF_MAX). backoff maps term id -> (retries, retry_at) and only
+    keeps terms still in 'error'.
+    """
+    due = []
+    failing = set()
+    for term in terms:
+        term_id = term.get("id")
+        if term.get("status") != 'error':
+            due.append(term)
+            continue
+        failing.add(term_id)
+        retries, retry_at = backoff.get(term_id, (0, 0))
+        if now < retry_at:
+            continue
+        backoff[term_id] = (retries + 1, now + min(DAEMON_ERROR_BACKOFF_MAX, DAEMON_POLL_INTERVAL * 2 ** retries))
+        due.append(term)
+    for term_id in set(backoff) - failing:
+        del backoff[term_id]
+    return due
+
+def step_2_daemon_loop():
+    """
+    Daemon mode Step 2: process pending terms as they arrive until shutdown.
+    Wakes on NOTIFY from the search_terms insert trigger and re-polls every
+    DAEMON_POLL_INTERVAL seconds regardless (error retries, missing trigger).
+    MetaClient and the existing page-id set stay warm between batches.
+    """
+    from steps.step_2_pages import process_all_terms, load_existing_page_ids, fetch_terms_to_process
+    from api.meta_client import MetaClient
+
+    listener = None
+    try:
+        listener = listen(NEW_TERMS_CHANNEL)
+        logger.info(f"[Step 2] Listening for new terms on '{NEW_TERMS_CHANNEL}'.")
+    except Exception as e:
+        logger.warning(f"[Step 2] LISTEN failed ({e}); polling every {DAEMON_POLL_INTERVAL:g}s.")
+
+    meta_client = MetaClient(stage="terms")
+    existing_page_ids = load_existing_page_ids()
+    loaded_at = time.monotonic()
+    backoff = {}
+
+    try:
+        while not shutdown_requested.is_set():
+            conn = get_conn()
+            try:
+                fetched = fetch_terms_to_process(conn)
+            except Exception as e:
+                logger.error(f"[Step 2] Error fetching terms: {e}")
+                fetched = []
+            finally:
+                conn.close()
+            terms = terms_due(fetched, backoff, time.monotonic())
+            if len(terms) < len(fetched):
+                logger.info(f"[Step 2] {len(fetched) - len(terms)} failing term(s) backing off.")
+
+            if terms:
+                if time.monotonic() - loaded_at > DAEMON_PAGE_IDS_REFRESH:
+                    # Pick up pages other workers stored meanwhile
+                    existing_page_ids = load_existing_page_ids()
+                    loaded_at = time.monotonic()
+                logger.info(f"[Step 2] {len(terms)} pending term(s) — processing...")
+                process_all_terms(terms, meta_client, existing_page_ids)
+
+            # Notifications that arrived while we were busy are returned immediately
+            deadline = time.monotonic() + DAEMON_POLL_INTERVAL
+            while not shutdown_requested.is_set() and time.monotonic() < deadline:
+                if listener is None:
+                    shutdown_requested.wait(min(1, deadline - time.monotonic()))
+                    continue
+                try:
+                    if wait_for_notifications(listener, min(1, deadline - time.monotonic())):
+                        logger.info("[Step 2] New search terms notified.")
+                        break
+                except Exception as e:
+                    logger.warning(f"[Step 2] Lost LISTEN connection ({e}); falling back to polling.")
+                    listener.close()
+                    listener = None
+    finally:
+        if listener is not None:
+            listener.close()
 
 
 # ─── Main ───────────────────────────────────────────────────────────────────
 
-def main():
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Facebook Ads Data Pipeline (steps 1-4)")
+    add_profiling_args(parser)
+    parser.add_argument("--metrics-port", type=int, default=None,
+                        help="serve Prometheus metrics on this port (default: METRICS_PORT)")
+    parser.add_argument("--daemon", action="store_true",
+                        help="keep running and process new search terms as they are added")
+    parser.add_argument("--db-pool", type=int, default=None,
+                        help="Postgres connections kept for reuse (default: DB_POOL_SIZE; "
+                             f"{DAEMON_DB_POOL_SIZE} in daemon mode if unset)")
+    args = parser.parse_args(argv)
+    start_from_args(args)
+    start_metrics_server(args.metrics_port)
+    pool_size = args.db_pool if args.db_pool is not None else (
+        DB_POOL_SIZE or (DAEMON_DB_POOL_SIZE if args.daemon else 0))
+    if pool_size:
+        configure_pool(pool_size)
+
+    from steps.step_2_pages import process_all_terms, fetch_terms_to_process
+    from api.token_health import start_health_checker
+
     start_time = time.time()
     logger.info("=== Starting Facebook Ads Data Pipeline (STREAMING v3) ===")
 
+    # SIGTERM → stop claiming, finish in-flight items, release the rest, flush
+    install_signal_handlers()
+    heartbeat_stop = start_lease_heartbeat()
+    # Re-check the token pool through /debug_token every TOKEN_HEALTH_INTERVAL seconds
+    health_stop = start_health_checker()
+
     # Events to signal step completion
     step2_done = threading.Event()
     step3_done = threading.Event()
 
-    # --- Step 1: Fetch Terms ---
-    logger.info("\n--- Step 1: Fetching Search Terms ---")
-    t1 = time.time()
-    conn = get_conn()
-    try:
-        terms = fetch_terms(conn)
-    finally:
-        conn.close()
-    logger.info(f"Step 1 finished in {time.time() - t1:.2f}s. Found {len(terms)} term(s).")
+    # --- Step 1: Fetch Terms (the daemon's Step 2 loop fetches its own) ---
+    terms = []
+    if not args.daemon:
+        logger.info("\n--- Step 1: Fetching Search Terms ---")
+        t1 = time.time()
+        conn = get_conn()
+        try:
+            terms = fetch_terms_to_process(conn)
+        finally:
+            conn.close()
+        logger.info(f"Step 1 finished in {time.time() - t1:.2f}s. Found {len(terms)} term(s).")
 
-    if not terms:
+    if not terms and not args.daemon:
         logger.info("No unprocessed terms. Running Steps 3 & 4 on existing pending work only.")
         step2_done.set()  # Signal immediately — no Step 2 work
 
@@ -171,7 +328,13 @@ def main():
     t4.start()
 
     # --- Step 2: Process terms (blocks until done, then signals) ---
-    if terms:
+    if args.daemon:
+        logger.info("\n--- Step 2: Daemon mode — waiting for search terms (Ctrl+C / SIGTERM to stop) ---")
+        try:
+            step_2_daemon_loop()
+        except Exception as e:
+            logger.error(f"[Step 2] Fatal error: {e}")
+    elif terms and not shutdown_requested.is_set():
         logger.info(f"\n--- Step 2: Searching Pages for {len(terms)} Term(s) ---")
         t2 = time.time()
         try:
@@ -183,12 +346,14 @@ def main():
     step2_done.set()  # Allow Step 3 to drain and exit
     logger.info("Step 2 done — signaled Step 3.")
 
-    # Wait for Steps 3 and 4 to finish
-    t3.join()
-    logger.info("Step 3 finished.")
-    # step3_done is set inside run_step3's finally block
-    t4.join()
-    logger.info("Step 4 finished.")
+    # Wait for Steps 3 and 4 to finish (step3_done is set inside run_step3's finally block).
+    # On SIGTERM they get SHUTDOWN_GRACE_SECONDS to finish in-flight items.
+    wait_for_threads([t3, t4], SHUTDOWN_GRACE_SECONDS)
+    logger.info("Steps 3 and 4 finished.")
+
+    heartbeat_stop.set()
+    health_stop.set()
+    drain()
 
     elapsed = time.time() - start_time
     logger.info(f"\n=== Pipeline Completed in {elapsed:.2f} seconds ===")
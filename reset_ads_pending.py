@@ -1,8 +1,7 @@
-from db.postgres_client import get_conn
+import sys
 
-c = get_conn()
-cur = c.cursor()
-cur.execute("UPDATE pages SET ads_status='pending' WHERE ads_status='completed' AND active_total_eu_reach >= 200000")
-c.commit()
-print(f'Reset {cur.rowcount} pages ads_status to pending')
-c.close()
+from cli import main
+
+# Re-scrape ads of completed pages with reach >= 200k: python cli.py reset ads --min-reach 200000
+if __name__ == "__main__":
+    sys.exit(main(["reset", "ads", "--min-reach", "200000"]))
@@ -0,0 +1,100 @@
+"""
+HTTP-only media extraction for ad snapshot pages (Step 4).
+
+The snapshot page (ad_snapshot_url) is server-rendered with the ad's creatives in
+embedded JSON ("video_hd_url", "original_image_url", ...), so for most ads the media
+URL can be read from the HTML without a browser. fetch_media() does that over a
+pooled httpx client; step_4_media.extract_media() falls back to a Chromium
+navigation when it finds nothing.
+
+Candidate order follows the browser path: a video first, then the main image.
+"""
+import html
+import json
+import logging
+import re
+
+import httpx
+
+from config.settings import MEDIA_FAST_PATH_TIMEOUT, MEDIA_CONCURRENCY_MAX
+from utils.tracing import span, redact_tokens
+
+logger = logging.getLogger(__name__)
+# httpx logs every request URL at INFO, and snapshot URLs carry the access token
+logging.getLogger("httpx").setLevel(logging.WARNING)
+
+# Embedded JSON keys, best first. Values are JSON strings ("https:\/\/video...")
+VIDEO_KEYS = ("video_hd_url", "video_sd_url")
+IMAGE_KEYS = ("original_image_url", "resized_image_url")
+
+_JSON_URL = r'"{key}"\s*:\s*"((?:[^"\\]|\\.)+)"'
+VIDEO_PATTERNS = [re.compile(_JSON_URL.format(key=key)) for key in VIDEO_KEYS]
+IMAGE_PATTERNS = [re.compile(_JSON_URL.format(key=key)) for key in IMAGE_KEYS]
+VIDEO_TAG = re.compile(r'<video\b[^>]*?\bsrc="([^"]+)"', re.IGNORECASE)
+
+# Sent like a browser, so the fast path is served the page Chromium would get
+HEADERS = {
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 "
+                  "(KHTML, like Gecko) Chrome/124.0 Safari/537.36",
+    "Accept": "text/html,application/xhtml+xml",
+    "Accept-Language": "en-US,en;q=0.9",
+}
+
+_client = None
+
+
+def get_client():
+    """Shared client for the running event loop (Step 4 runs in one loop)."""
+    global _client
+    if _client is None or _client.is_closed:
+        limits = httpx.Limits(max_connections=MEDIA_CONCURRENCY_MAX, max_keepalive_connections=MEDIA_CONCURRENCY_MAX)
+        _client = httpx.AsyncClient(headers=HEADERS, timeout=MEDIA_FAST_PATH_TIMEOUT, limits=limits,
+                                    follow_redirects=True)
+    return _client
+
+
+async def close_client():
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+
+def _json_string(raw):
+    try:
+        return json.loads(f'"{raw}"')
+    except ValueError:
+        return None
+
+
+def parse_media(page_html):
+    """(media_type, media_url) from snapshot HTML, or (None, None)."""
+    for pattern in VIDEO_PATTERNS:
+        for match in pattern.finditer(page_html):
+            url = _json_string(match.group(1))
+            if url:
+                return 'VIDEO', url
+    match = VIDEO_TAG.search(page_html)
+    if match:
+        return 'VIDEO', html.unescape(match.group(1))
+    for pattern in IMAGE_PATTERNS:
+        for match in pattern.finditer(page_html):
+            url = _json_string(match.group(1))
+            if url:
+                return 'IMAGE', url
+    return None, None
+
+
+async def fetch_media(url):
+    """Fast path only: (media_type, media_url) or (None, None) when the HTML has no candidate or the fetch fails."""
+    with span("http.snapshot", **{"url.full": redact_tokens(url)}) as s:
+        try:
+            response = await get_client().get(url)
+            response.raise_for_status()
+        except httpx.HTTPError as e:
+            # httpx errors quote the URL
+            s.set("error", redact_tokens(str(e)))
+            logger.debug(redact_tokens(f"Fast path fetch failed for {url}: {e}"))
+            return None, None
+        s.set("http.response.body.size", len(response.content))
+        return parse_media(response.text)
@@ -4,14 +4,48 @@ import logging
 import concurrent.futures
 import threading
 from api.meta_client import MetaClient
-from db.postgres_client import get_conn, get_existing_page_ids, upsert_pages, mark_term_status, fetch_terms
-from config.settings import TERMS_CONCURRENCY
+import psycopg2
+from db.postgres_client import (
+    get_conn, get_existing_page_ids, upsert_pages, mark_term_status, fetch_terms, claim_item,
+    mark_term_pages_visible, fetch_terms_due_for_refresh,
+)
+from config.settings import TERM_REFRESH_HOURS, TERM_REFRESH_BATCH, TERM_MAX_PAGES, TERM_YIELD_THRESHOLD
+from utils.lifecycle import shutdown_requested
+from utils.autotuner import get_tuner
+from utils.profiling import profiled_item
+from utils.tracing import traced_item, current_span, emit_span, trace_id_for, link_to
+from utils.metrics import QUEUE_DEPTH, TERM_VISIBLE_SECONDS
+from api.token_budget import token_budget
 
 logger = logging.getLogger(__name__)
 
 # Shared lock for existing_page_ids set
 page_ids_lock = threading.Lock()
 
+# Cleared if search_terms has no pages_visible_at column (db_migrate_daemon.py not applied)
+track_visibility = True
+
+def discovery_yield_check(existing_page_ids, threshold=TERM_YIELD_THRESHOLD):
+    """
+    should_continue callback for search_ads: page further only while the share of page_ids
+    on the last result page that are neither stored nor seen earlier for this term stays
+    at or above `threshold`. The returned function's .pages / .last_yield describe the run.
+    """
+    seen = set()
+
+    def should_continue(rows):
+        ids = {str(ad["page_id"]) for ad in rows if ad.get("page_id")}
+        with page_ids_lock:
+            unseen = ids - existing_page_ids - seen
+        seen.update(ids)
+        should_continue.pages += 1
+        should_continue.last_yield = len(unseen) / len(ids) if ids else 0.0
+        return should_continue.last_yield >= threshold
+
+    should_continue.pages = 0
+    should_continue.last_yield = None
+    return should_continue
+
 def get_row_value(row, *keys):
     """Start with the keys provided and return the first one found."""
     for key in keys:
@@ -21,10 +55,12 @@ def get_row_value(row, *keys):
             return row[key.lower()]
     return None
 
+@profiled_item("step2")
+@traced_item("term", "step2.search_pages", lambda term_record, *args: get_row_value(term_record, "id"))
 def process_term_pages(term_record, meta_client, existing_page_ids):
     """
     Process a single search term to FIND PAGES only.
-    1. Mark term as processing.
+    1. Claim the term (mark as processing under a lease).
     2. Search for ads to find pages.
     3. Upsert pages with ads_status='pending'.
     4. Mark term as completed.
@@ -32,28 +68,50 @@ def process_term_pages(term_record, meta_client, existing_page_ids):
     term_id = get_row_value(term_record, "id")
     term = get_row_value(term_record, "Search_term", "search_term")
     country = get_row_value(term_record, "Country", "country")
+    # A completed term is a refresh: only ads delivered since its last crawl (read before claim_item moves it)
+    watermark = None
+    if get_row_value(term_record, "status") == 'completed':
+        watermark = get_row_value(term_record, "last_processed_at")
     
     if not term or not country:
         logger.warning(f"Skipping invalid term record: {term_record}")
         return
 
-    # Mark term as processing
+    # Draining: leave the term pending for the next worker
+    if shutdown_requested.is_set():
+        return
+
+    # Claim the term (skip it if another worker holds a live lease)
     conn = get_conn()
     try:
-        if term_id:
-            mark_term_status(conn, term_id, 'processing')
+        if term_id and not claim_item(conn, 'term_status', term_id):
+            logger.info(f"Term {term_id} is leased by another worker. Skipping.")
+            return
     except Exception as e:
-        logger.error(f"Error marking term {term_id} as processing: {e}")
+        # Without a lease another worker may take the same term: leave it for a later run
+        logger.error(f"Error claiming term {term_id}: {e}. Skipping.")
+        return False
     finally:
         conn.close()
 
-    logger.info(f"Searching Pages for term: '{term}' in '{country}' (ID: {term_id})")
+    since = f", ads delivered since {watermark:%Y-%m-%d}" if watermark else ""
+    logger.info(f"Searching Pages for term: '{term}' in '{country}' (ID: {term_id}{since})")
+    if watermark:
+        current_span().set("term.refresh_since", watermark.date().isoformat())
 
     try:
         # 1. Search for Pages via Ads
         try:
              # Note: Client handles token rotation
-            ads_results = meta_client.search_ads(term, [country])
+            check = discovery_yield_check(existing_page_ids)
+            ads_results = meta_client.search_ads(
+                term, [country], delivery_date_min=watermark.date() if watermark else None,
+                max_pages=TERM_MAX_PAGES, should_continue=check,
+            )
+            current_span().set("term.result_pages", check.pages)
+            if check.pages > 1:
+                logger.info(f"Term '{term}': paged {check.pages} result pages "
+                            f"(last page {check.last_yield:.0%} new pages).")
         except Exception as e:
             logger.error(f"Error searching ads for term '{term}': {e}")
             raise  # Re-raise so the outer handler marks term as 'error'
@@ -78,6 +136,8 @@ def process_term_pages(term_record, meta_client, existing_page_ids):
                     })
         
         logger.info(f"Term '{term}': Found {len(unique_pages)} pages. New: {len(new_pages)}")
+        current_span().set("pages.found", len(unique_pages))
+        current_span().set("pages.new", len(new_pages))
 
         # 3. Upsert Pages
         if new_pages:
@@ -87,6 +147,10 @@ def process_term_pages(term_record, meta_client, existing_page_ids):
                 with page_ids_lock:
                     for p in new_pages:
                         existing_page_ids.add(str(p['page_id']))
+                # Start each new page's trace with a link back to the term that found it
+                for p in new_pages:
+                    emit_span("page.discovered", trace_id_for("page", p['page_id']),
+                              links=[link_to("term", term_id)], **{"term.id": str(term_id), "term": term})
             except Exception as e:
                 logger.error(f"Error upserting pages for term {term}: {e}")
             finally:
@@ -98,6 +162,7 @@ def process_term_pages(term_record, meta_client, existing_page_ids):
             try:
                 logger.info(f"Marking term ID {term_id} as completed.")
                 mark_term_status(conn, term_id, 'completed')
+                record_pages_visible(conn, term_id)
             finally:
                 conn.close()
                 
@@ -109,47 +174,95 @@ def process_term_pages(term_record, meta_client, existing_page_ids):
                  mark_term_status(conn, term_id, 'error')
             finally:
                 conn.close()
+        return False
 
-def process_all_terms(terms):
-    print(f"Starting process_all_terms (Step 2) with {len(terms)} terms.")
-    if not terms:
-        logger.info("No terms to process.")
+def record_pages_visible(conn, term_id):
+    """Insert → pages visible latency of a completed term (metric + log)."""
+    global track_visibility
+    if not track_visibility:
+        return
+    try:
+        seconds = mark_term_pages_visible(conn, term_id)
+    except psycopg2.errors.UndefinedColumn:
+        conn.rollback()
+        track_visibility = False
+        logger.info("search_terms.pages_visible_at missing (run db_migrate_daemon.py); not tracking latency.")
         return
+    if seconds is not None:
+        TERM_VISIBLE_SECONDS.observe(seconds)
+        current_span().set("term.visible_after_s", round(seconds, 1))
+        logger.info(f"Term ID {term_id}: pages visible {seconds:.1f}s after it was added.")
 
+def _term_done(_future):
+    QUEUE_DEPTH.dec(stage="step2")
+    token_budget.add_backlog("terms", -1)
 
+def fetch_terms_to_process(conn):
+    """Pending/error terms, then completed terms due for an incremental refresh (TERM_REFRESH_HOURS)."""
+    terms = fetch_terms(conn)
+    refresh = fetch_terms_due_for_refresh(conn, TERM_REFRESH_HOURS, TERM_REFRESH_BATCH)
+    if refresh:
+        logger.info(f"{len(refresh)} completed term(s) due for refresh (every {TERM_REFRESH_HOURS:g}h).")
+    return terms + refresh
+
+def load_existing_page_ids():
     conn = get_conn()
-    existing_page_ids = set()
-    
     try:
-        # Load existing pages once
-        try:
-            existing_page_ids = get_existing_page_ids(conn)
-            logger.info(f"Loaded {len(existing_page_ids)} existing pages from DB.")
-        except Exception as e:
-            logger.error(f"Failed to load existing pages: {e}")
-            existing_page_ids = set()
+        existing_page_ids = get_existing_page_ids(conn)
+        logger.info(f"Loaded {len(existing_page_ids)} existing pages from DB.")
+        return existing_page_ids
+    except Exception as e:
+        logger.error(f"Failed to load existing pages: {e}")
+        return set()
     finally:
         conn.close()
 
-    meta_client = MetaClient()
+def process_all_terms(terms, meta_client=None, existing_page_ids=None):
+    """
+    Process terms in parallel. A long-running caller (pipeline --daemon) passes its own
+    meta_client and existing_page_ids so they stay warm between batches.
+    """
+    print(f"Starting process_all_terms (Step 2) with {len(terms)} terms.")
+    if not terms:
+        logger.info("No terms to process.")
+        return
+
+    if existing_page_ids is None:
+        # Load existing pages once
+        existing_page_ids = load_existing_page_ids()
+
+    meta_client = meta_client or MetaClient(stage="terms")
+    tuner = get_tuner("terms")
     
-    # Process terms in Parallel
-    with concurrent.futures.ThreadPoolExecutor(max_workers=TERMS_CONCURRENCY) as executor:
+    # Process terms in Parallel (pool sized for the upper bound, the tuner gates actual concurrency)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=tuner.max_workers, thread_name_prefix="Step2-Worker") as executor:
         futures = []
+        QUEUE_DEPTH.inc(len(terms), stage="step2")
+        token_budget.add_backlog("terms", len(terms))
         for term in terms:
            # print(f"Submitting term: {term}")
-            futures.append(
-                executor.submit(process_term_pages, term, meta_client, existing_page_ids)
-            )
+            future = executor.submit(tuner.run, process_term_pages, term, meta_client, existing_page_ids)
+            future.add_done_callback(_term_done)
+            futures.append(future)
         
         concurrent.futures.wait(futures)
 
 if __name__ == "__main__":
+    import argparse
+    from utils.lifecycle import install_signal_handlers, start_lease_heartbeat, drain
+    from utils.profiling import add_profiling_args, start_from_args
+    parser = argparse.ArgumentParser(description="Step 2: search pages for pending terms")
+    add_profiling_args(parser)
+    args = parser.parse_args()
     logging.basicConfig(level=logging.INFO)
+    start_from_args(args)
+    install_signal_handlers()
+    start_lease_heartbeat()
     conn = get_conn()
     try:
-        terms = fetch_terms(conn)
+        terms = fetch_terms_to_process(conn)
         print(f"Terms to process: {len(terms)}")
         process_all_terms(terms)
     finally:
         conn.close()
+        drain()
@@ -4,16 +4,41 @@ import sys
 
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from datetime import datetime
 import logging
 import concurrent.futures
 import threading
-from api.meta_client import MetaClient
-from db.postgres_client import get_conn, upsert_ads, mark_page_status, fetch_ads_pending_pages
-from config.settings import PAGES_CONCURRENCY
+import time
+import psycopg2
+from api.meta_client import MetaClient, LIGHT_AD_FIELDS, AdsLookupError
+from api.ad_normalizer import normalize_ads, ROW_AD_ID
+from db.postgres_client import (
+    get_conn, upsert_ad_rows, mark_page_status, fetch_ads_pending_pages, claim_item,
+    get_stored_ad_ids, update_ads_delivery, schedule_ads_recrawl, queue_due_recrawls,
+    sync_page_ads_aggregates,
+)
+from config.settings import (
+    RECRAWL_PAGES_PER_HOUR, RECRAWL_INITIAL_HOURS, RECRAWL_MIN_HOURS, RECRAWL_MAX_HOURS,
+    RECRAWL_PRIORITY_MAX_HOURS, RECRAWL_REACH_GROWTH, ADS_TWO_TIER_FETCH,
+)
+from utils.lifecycle import shutdown_requested
+from utils.autotuner import get_tuner
+from utils.profiling import profiled_item
+from utils.tracing import traced_item, current_span
+from utils.metrics import QUEUE_DEPTH
+from api.token_budget import token_budget
 
 logger = logging.getLogger(__name__)
 
+# Cleared if pages has no re-crawl columns (db_migrate_recrawl.py not applied)
+track_recrawl = True
+# Cleared if pages has no active_ads_count column (db_migrate_page_aggregates.py not applied)
+track_ads_count = True
+
+# Re-crawl feed: credit accrues at RECRAWL_PAGES_PER_HOUR, at most 5 minutes' worth is spent at once
+_recrawl_lock = threading.Lock()
+_recrawl_credit = RECRAWL_PAGES_PER_HOUR / 12
+_recrawl_at = time.monotonic()
+
 # Shared lock? Maybe not needed as pages are partitioned by fetch? 
 # but fetch_ads_pending_pages returns a list, and we process them.
 
@@ -26,24 +51,35 @@ def get_row_value(row, *keys):
             return row[key.lower()]
     return None
 
+@profiled_item("step3")
+@traced_item("page", "step3.fetch_ads", lambda page_record, *args: page_record[0])
 def process_page_ads(page_record, meta_client, min_date):
     """
     Process a single page to FETCH ADS.
-    1. Mark page ads_status='processing'.
-    2. Fetch ads from API.
+    1. Claim the page (ads_status='processing' under a lease).
+    2. Fetch ads from API. With ADS_TWO_TIER_FETCH, pages we already hold ads for get a
+       light pass (delivery fields only) and full fields just for the ads that are new.
     3. Filter ads (active, date).
-    4. Upsert ads.
-    5. Update page stats (active reach).
+    4. Upsert new ads, refresh delivery fields of stored ones.
+    5. Update page stats in SQL (reach, active ad count; stored ads no longer returned are deactivated).
     6. Mark page ads_status='completed', media_status='pending'.
     """
     page_id = page_record[0]
     page_name = page_record[1]
     
+    # Draining: leave the page pending for the next worker
+    if shutdown_requested.is_set():
+        return
+
     conn = get_conn()
     try:
-        mark_page_status(conn, page_id, 'ads_status', 'processing')
-    except Exception:
-        pass
+        if not claim_item(conn, 'ads_status', page_id):
+            logger.info(f"Page {page_id} is leased by another worker. Skipping.")
+            return
+    except Exception as e:
+        # Without a lease another worker may take the same page: leave it for a later run
+        logger.error(f"Error claiming page {page_id}: {e}. Skipping.")
+        return False
     finally:
         conn.close()
 
@@ -56,104 +92,79 @@ def process_page_ads(page_record, meta_client, min_date):
             # User wants to fetch by the specific country registered for the page.
             # We updated fetch_ads_pending_pages to return (page_id, name, country).
             country = page_record[2] if len(page_record) > 2 and page_record[2] else 'DE' # Fallback to DE if null 
-            
-            page_ads = meta_client.get_ads_by_page(page_id, [country], limit=100)
+
+            lookup_complete = True
+            stored_ids = get_stored_ad_ids(conn, page_id)
+            if ADS_TWO_TIER_FETCH and stored_ids:
+                # Re-crawl: most ads are known, only their reach / delivery can have changed
+                page_ads, complete = meta_client.get_ads_by_page(page_id, [country], limit=500, fields=LIGHT_AD_FIELDS,
+                                                                 report_complete=True)
+                ads_kept, total_eu_reach_sum, active_total_eu_reach_sum = normalize_ads(page_id, page_ads, min_date)
+                # Full fields only for ads that pass the filters and aren't stored yet
+                new_ids = [row[ROW_AD_ID] for row in ads_kept if row[ROW_AD_ID] not in stored_ids]
+                try:
+                    new_ads, lookup_complete = meta_client.get_ads_by_ids(new_ids, report_complete=True) \
+                        if new_ids else ([], True)
+                except AdsLookupError as e:
+                    # An ad went away since the light pass: one full page fetch instead
+                    logger.info(f"Page {page_id}: ads lookup refused ({e}), fetching the page's ads in full.")
+                    wanted = set(new_ids)
+                    full_ads, lookup_complete = meta_client.get_ads_by_page(page_id, [country], limit=100,
+                                                                            report_complete=True)
+                    new_ads = [ad for ad in full_ads if ad.get("id") in wanted]
+                ads_to_upsert, _, _ = normalize_ads(page_id, new_ads, min_date)
+                ads_to_refresh = [row for row in ads_kept if row[ROW_AD_ID] in stored_ids]
+            else:
+                page_ads, complete = meta_client.get_ads_by_page(page_id, [country], limit=100, report_complete=True)
+                new_ads = page_ads
+                ads_kept, total_eu_reach_sum, active_total_eu_reach_sum = normalize_ads(page_id, page_ads, min_date)
+                ads_to_upsert, ads_to_refresh = ads_kept, []
         except Exception as e:
             logger.error(f"Error fetching ads for page {page_id}: {e}")
             mark_page_status(conn, page_id, 'ads_status', 'error')
-            return
-        
-        total_eu_reach_sum = 0
-        active_total_eu_reach_sum = 0
-        ads_to_upsert = []
-        
-        for ad in page_ads:
-            # --- FILTER BY DATE ---
-            creation_time_str = ad.get("ad_creation_time")
-            if min_date and creation_time_str:
-                try:
-                    creation_dt = datetime.fromisoformat(creation_time_str).date()
-                    if creation_dt < min_date:
-                        continue # Skip old ads
-                except ValueError:
-                    pass 
-
-            # Calculate EU Reach
-            reach = ad.get("eu_total_reach", 0)
-            reach_val = 0
-            if isinstance(reach, (int, float)):
-                reach_val = int(reach)
-            elif isinstance(reach, dict):
-                    if 'ub' in reach:
-                        reach_val = int(reach['ub'])
-            
-            total_eu_reach_sum += reach_val
-            
-            # Calculate is_active
-            is_active = "ad_delivery_stop_time" not in ad
-            
-            if is_active:
-                active_total_eu_reach_sum += reach_val
-            
-            # --- FILTER: ONLY SAVE ACTIVE ADS ---
-            if not is_active:
-                continue
-
-            # Extract beneficiary
-            beneficiary = None
-            if "beneficiary_payers" in ad and isinstance(ad["beneficiary_payers"], list):
-                for bp in ad["beneficiary_payers"]:
-                    if "beneficiary" in bp:
-                        beneficiary = bp["beneficiary"]
-                        break
-                        
-            # Extract ad description (ad_creative_bodies from API) and convert to JSON string
-            import json
-            description_val = None
-            if ad.get("ad_creative_bodies"):
-                try:
-                    description_val = json.dumps(ad.get("ad_creative_bodies"))
-                except Exception:
-                    pass
-
-            # Collect Ad Data
-            ads_to_upsert.append({
-                "ad_id": ad.get("id"),
-                "page_id": page_id,
-                "ad_creation_time": ad.get("ad_creation_time"),
-                "ad_delivery_start_time": ad.get("ad_delivery_start_time"),
-                "ad_delivery_stop_time": ad.get("ad_delivery_stop_time"),
-                "ad_snapshot_url": ad.get("ad_snapshot_url"),
-                "eu_total_reach": reach_val,
-                "is_active": is_active,
-                "beneficiary": beneficiary,
-                "search_term_id": None,
-                "description": description_val
-            })
-
-        # Insert Ads
-        if ads_to_upsert:
-            try:
-                upsert_ads(conn, ads_to_upsert)
-            except Exception as e:
-                logger.error(f"Failed to upsert ads for page {page_id}: {e}")
-                conn.rollback()
+            return False
+
+        if not complete:
+            logger.warning(f"Page {page_id}: ads fetch was cut short after {len(page_ads)} ad(s); "
+                           f"stored ads stay active.")
+        current_span().set("ads.complete", complete)
+        current_span().set("ads.fetched", len(page_ads))
+        current_span().set("ads.kept", len(ads_kept))
+        current_span().set("ads.full_fetched", len(new_ads))
+
+        # Insert new Ads, refresh delivery of stored ones
+        try:
+            if ads_to_upsert:
+                upsert_ad_rows(conn, ads_to_upsert)
+            if ads_to_refresh:
+                update_ads_delivery(conn, ads_to_refresh)
+        except Exception as e:
+            logger.error(f"Failed to save ads for page {page_id}: {e}")
+            conn.rollback()
         
         # Update Page Stats & Status
         try:
-             # Update reach metrics (Only Active)
-             with conn.cursor() as cur:
-                 cur.execute("""
-                     UPDATE pages 
-                     SET active_total_eu_reach = %s
-                     WHERE page_id = %s
-                 """, (active_total_eu_reach_sum, page_id))
+             # Compares against the stored reach, so before it is overwritten. A partial sum would read
+             # as a change: a cut-short fetch keeps the page's interval but is still re-crawled
+             ads_added = any(row[ROW_AD_ID] not in stored_ids for row in ads_to_upsert)
+             record_crawl_schedule(conn, page_id, active_total_eu_reach_sum, ads_added,
+                                   keep_interval=not complete)
+
+             # Update reach metrics (Only Active) from the stored ads
+             active_reach, active_count = update_page_aggregates(conn, page_id, ads_kept, total_eu_reach_sum, complete)
              
              # Mark COMPLETED and trigger MEDIA PENDING if ads found
-             if ads_to_upsert:
+             if not complete and not ads_kept:
+                 mark_page_status(conn, page_id, 'ads_status', 'error')
+                 logger.info(f"Page {page_id}: Ads fetch failed before any ad came back. Marked as error.")
+             elif not lookup_complete:
+                 # Its new ads were listed but not stored: completed would hide them until the next re-crawl
+                 mark_page_status(conn, page_id, 'ads_status', 'error')
+                 logger.warning(f"Page {page_id}: Full fields for its new ads could not be fetched. Marked as error.")
+             elif ads_kept:
                  mark_page_status(conn, page_id, 'ads_status', 'completed')
                  # mark_page_status(conn, page_id, 'media_status', 'pending')  # TEMP: disabled to avoid re-triggering Step 4
-                 logger.info(f"Page {page_id}: Ads processed. Active Reach: {active_total_eu_reach_sum}. Media Pending.")
+                 logger.info(f"Page {page_id}: Ads processed. Active ads: {active_count}, Active Reach: {active_reach}. Media Pending.")
              else:
                  mark_page_status(conn, page_id, 'ads_status', 'not_found')
                  # Do NOT trigger media pending
@@ -166,35 +177,119 @@ def process_page_ads(page_record, meta_client, min_date):
     finally:
         conn.close()
 
-def process_all_pages(pages):
+def record_crawl_schedule(conn, page_id, active_reach, ads_changed, keep_interval=False):
+    """Schedule the page's next ads crawl from what changed in this one (keep_interval: nothing to judge by)."""
+    global track_recrawl
+    if not track_recrawl:
+        return
+    try:
+        hours = schedule_ads_recrawl(
+            conn, page_id, active_reach, ads_changed,
+            initial_hours=RECRAWL_INITIAL_HOURS, min_hours=RECRAWL_MIN_HOURS, max_hours=RECRAWL_MAX_HOURS,
+            priority_max_hours=RECRAWL_PRIORITY_MAX_HOURS, reach_growth=RECRAWL_REACH_GROWTH,
+            keep_interval=keep_interval,
+        )
+    except psycopg2.errors.UndefinedColumn:
+        conn.rollback()
+        track_recrawl = False
+        logger.info("pages.next_ads_crawl_at missing (run db_migrate_recrawl.py); not scheduling re-crawls.")
+        return
+    if hours is not None:
+        current_span().set("page.recrawl_hours", round(hours, 1))
+
+def update_page_aggregates(conn, page_id, ad_rows, total_reach, complete=True):
+    """
+    Recompute the page's reach / active ad count in SQL. Stored ads missing from the fetch
+    are deactivated only when it was complete: a truncated one says nothing about them.
+    """
+    global track_ads_count
+    active_ids = [row[ROW_AD_ID] for row in ad_rows]
+    if not complete:
+        total_reach = None
+    try:
+        return sync_page_ads_aggregates(conn, page_id, active_ids, total_reach, with_count=track_ads_count,
+                                         deactivate=complete)
+    except psycopg2.errors.UndefinedColumn:
+        conn.rollback()
+        track_ads_count = False
+        logger.info("pages.active_ads_count missing (run db_migrate_page_aggregates.py); not storing it.")
+        return sync_page_ads_aggregates(conn, page_id, active_ids, total_reach, with_count=False,
+                                         deactivate=complete)
+
+def queue_recrawls(conn):
+    """Put due pages back to ads_status 'pending' at RECRAWL_PAGES_PER_HOUR. Returns how many."""
+    global track_recrawl, _recrawl_credit, _recrawl_at
+    if RECRAWL_PAGES_PER_HOUR <= 0 or not track_recrawl:
+        return 0
+    with _recrawl_lock:
+        now = time.monotonic()
+        burst = max(1.0, RECRAWL_PAGES_PER_HOUR / 12)
+        _recrawl_credit = min(burst, _recrawl_credit + (now - _recrawl_at) / 3600 * RECRAWL_PAGES_PER_HOUR)
+        _recrawl_at = now
+        if _recrawl_credit < 1:
+            return 0
+        try:
+            queued = queue_due_recrawls(conn, int(_recrawl_credit))
+        except psycopg2.errors.UndefinedColumn:
+            conn.rollback()
+            track_recrawl = False
+            logger.info("pages.next_ads_crawl_at missing (run db_migrate_recrawl.py); not queueing re-crawls.")
+            return 0
+        _recrawl_credit -= queued
+    if queued:
+        logger.info(f"Queued {queued} page(s) due for an ads re-crawl.")
+    return queued
+
+def _page_done(_future):
+    QUEUE_DEPTH.dec(stage="step3")
+    token_budget.add_backlog("pages", -1)
+
+def process_all_pages(pages, meta_client=None):
     print(f"Starting process_all_pages (Step 3) with {len(pages)} pages.")
     if not pages:
         logger.info("No pages to process.")
         return
 
-    meta_client = MetaClient()
+    meta_client = meta_client or MetaClient(stage="pages")
     min_date = None # Can be passed via args or config
+    tuner = get_tuner("pages")
 
-    # Process pages in Parallel
-    with concurrent.futures.ThreadPoolExecutor(max_workers=PAGES_CONCURRENCY) as executor:
+    # Process pages in Parallel (pool sized for the upper bound, the tuner gates actual concurrency)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=tuner.max_workers, thread_name_prefix="Step3-Worker") as executor:
         futures = []
+        QUEUE_DEPTH.inc(len(pages), stage="step3")
+        token_budget.add_backlog("pages", len(pages))
         for page in pages:
-            futures.append(
-                executor.submit(process_page_ads, page, meta_client, min_date)
-            )
+            future = executor.submit(tuner.run, process_page_ads, page, meta_client, min_date)
+            future.add_done_callback(_page_done)
+            futures.append(future)
         
         concurrent.futures.wait(futures)
 
 if __name__ == "__main__":
+    import argparse
+    from utils.lifecycle import install_signal_handlers, start_lease_heartbeat, drain
+    from utils.profiling import add_profiling_args, start_from_args
+    parser = argparse.ArgumentParser(description="Step 3: fetch ads for pending pages")
+    add_profiling_args(parser)
+    args = parser.parse_args()
     logging.basicConfig(level=logging.INFO)
+    start_from_args(args)
+    install_signal_handlers()
+    start_lease_heartbeat()
     conn = get_conn()
     try:
         # We need to implement fetch_ads_pending_pages in postgres_client first!
         # or use a raw query here for now? Better to add to postgres_client.
         # I will assume it exists or add it in next step.
-        from db.postgres_client import fetch_ads_pending_pages
+        from db.postgres_client import fetch_ads_pending_pages, reclaim_expired_leases
+        reclaimed = reclaim_expired_leases(conn, 'ads_status')
+        if reclaimed:
+            print(f"Reclaimed {reclaimed} abandoned pages.")
+        queue_recrawls(conn)
         pages = fetch_ads_pending_pages(conn)
         print(f"Pages to process: {len(pages)}")
         process_all_pages(pages)
     finally:
         conn.close()
+        drain()
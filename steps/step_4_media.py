@@ -4,14 +4,26 @@ import sys
 import logging
 import time
 import asyncio
+import threading
 from datetime import datetime
 from playwright.async_api import async_playwright, TimeoutError as PlaywrightTimeoutError
 
 # Ensure correct path for imports
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from db.postgres_client import get_conn, fetch_media_pending_pages, mark_page_status, reset_stuck_pages, increment_media_retry
-from config.settings import MEDIA_CONCURRENCY, PLAYWRIGHT_HEADLESS
+from db.postgres_client import get_conn, fetch_media_pending_pages, mark_page_status, reset_stuck_pages, increment_media_retry, claim_item
+from config.settings import (
+    PLAYWRIGHT_HEADLESS, MEDIA_BLOCKED_RESOURCES, MEDIA_FAST_PATH,
+    MEDIA_BROWSERS, MEDIA_BROWSER_MAX_NAVIGATIONS, MEDIA_BROWSER_MAX_RSS_MB,
+)
+from steps.media_fast_path import fetch_media, close_client
+from utils.lifecycle import shutdown_requested
+from utils.autotuner import get_tuner
+from utils.profiling import profiled_item, register_loop, unregister_loop
+from utils.tracing import traced_item, span, redact_tokens
+from utils.metrics import (
+    QUEUE_DEPTH, BROWSER_PAGES_OPEN, BROWSER_BYTES, BROWSER_REQUESTS_BLOCKED, BROWSER_RESTARTS, MEDIA_EXTRACTIONS,
+)
 
 # Logging setup
 logging.basicConfig(
@@ -23,6 +35,246 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# A page that crashed or was closed with its browser gets another try on a healthy browser
+MAX_CRASH_REQUEUES = 2
+# Memory of a browser's processes is read every this many navigations
+RSS_CHECK_EVERY = 25
+# Seconds to wait before relaunching a browser whose last launch failed (doubles per failure)
+RELAUNCH_BACKOFF_MAX = 60
+
+# Pages whose renderer crashed (Playwright leaves them open but unusable)
+crashed_pages = set()
+# page_id -> times it was put back on the queue after a browser crash
+_crash_requeues = {}
+
+
+class BrowserCrashedError(Exception):
+    """The browser or page died under a navigation; the item should be retried elsewhere."""
+
+
+class PagePool:
+    """
+    Reusable Playwright pages of one browser context. Each worker keeps a page for as
+    long as it runs instead of opening one per Facebook page; a closed (crashed) page
+    is dropped and replaced on the next acquire(). Requests of MEDIA_BLOCKED_RESOURCES
+    types are aborted for the whole context, and the bytes each page transferred are
+    counted from Chromium's network events.
+    """
+
+    def __init__(self, context, blocked=MEDIA_BLOCKED_RESOURCES):
+        self.context = context
+        self.blocked = frozenset(t.strip() for t in blocked.split(",") if t.strip())
+        self._idle = []
+        self._routed = False
+        self._bytes = {}
+        self.navigations = 0
+
+    async def _route(self, route):
+        resource_type = route.request.resource_type
+        if resource_type in self.blocked:
+            BROWSER_REQUESTS_BLOCKED.inc(resource_type=resource_type)
+            await route.abort()
+        else:
+            await route.continue_()
+
+    async def _instrument(self, page):
+        self._bytes[page] = 0
+
+        def finished(event):
+            self._bytes[page] = self._bytes.get(page, 0) + int(event.get("encodedDataLength", 0))
+
+        def navigated(frame):
+            if frame.parent_frame is None:
+                self.navigations += 1
+
+        page.on("framenavigated", navigated)
+        page.on("crash", lambda _: crashed_pages.add(page))
+        try:
+            session = await self.context.new_cdp_session(page)
+            session.on("Network.loadingFinished", finished)
+            await session.send("Network.enable")
+        except Exception as e:
+            logger.debug(f"Byte counting unavailable: {e}")
+
+    async def acquire(self):
+        if self.blocked and not self._routed:
+            self._routed = True
+            await self.context.route("**/*", self._route)
+        while self._idle:
+            page = self._idle.pop()
+            if not page.is_closed() and page not in crashed_pages:
+                return page
+            self._drop(page)
+            if not page.is_closed():
+                asyncio.ensure_future(page.close())
+        page = await self.context.new_page()
+        BROWSER_PAGES_OPEN.inc()
+        await self._instrument(page)
+        return page
+
+    def release(self, page):
+        if page.is_closed():
+            self._drop(page)
+        elif page in crashed_pages:
+            self._drop(page)
+            asyncio.ensure_future(page.close())
+        else:
+            self._idle.append(page)
+
+    def _drop(self, page):
+        self._bytes.pop(page, None)
+        crashed_pages.discard(page)
+        BROWSER_PAGES_OPEN.dec()
+
+    def take_bytes(self, page):
+        """Bytes the page transferred since the last call."""
+        transferred = self._bytes.get(page, 0)
+        if page in self._bytes:
+            self._bytes[page] = 0
+        return transferred
+
+    async def close(self):
+        while self._idle:
+            page = self._idle.pop()
+            self._drop(page)
+            try:
+                await page.close()
+            except Exception:
+                pass
+
+
+def _proc_rss(pid):
+    """Resident memory of a process in bytes (Linux /proc), 0 if unknown."""
+    try:
+        with open(f"/proc/{pid}/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return 0
+
+
+class BrowserShard:
+    """One Chromium instance with its context and PagePool."""
+
+    def __init__(self, index, browser, context):
+        self.index = index
+        self.browser = browser
+        self.pool = PagePool(context)
+        self.in_use = 0
+        self.retired = False
+        self.closed = False
+        self._cdp = None
+        self._rss_checked_at = 0
+
+    @property
+    def alive(self):
+        return self.browser.is_connected()
+
+    async def rss_bytes(self):
+        """Memory of the browser and all its child processes (renderers, GPU, ...)."""
+        if self._cdp is None:
+            self._cdp = await self.browser.new_browser_cdp_session()
+        info = await self._cdp.send("SystemInfo.getProcessInfo")
+        return sum(_proc_rss(p["id"]) for p in info.get("processInfo", []))
+
+    async def over_memory(self):
+        if not MEDIA_BROWSER_MAX_RSS_MB or self.pool.navigations - self._rss_checked_at < RSS_CHECK_EVERY:
+            return False
+        self._rss_checked_at = self.pool.navigations
+        try:
+            rss = await self.rss_bytes()
+        except Exception as e:
+            logger.debug(f"[Step 4] Browser {self.index}: could not read memory: {e}")
+            return False
+        return rss > MEDIA_BROWSER_MAX_RSS_MB * 1024 * 1024
+
+    async def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        await self.pool.close()
+        try:
+            await self.browser.close()
+        except Exception:
+            pass
+
+
+class BrowserPool:
+    """
+    MEDIA_BROWSERS Chromium instances for Step 4, each its own process tree so the OS
+    spreads rendering over the cores. Worker i uses browser i % size. A browser is
+    replaced after MEDIA_BROWSER_MAX_NAVIGATIONS navigations, when its processes pass
+    MEDIA_BROWSER_MAX_RSS_MB, or when it crashed. The old one is closed once the workers
+    still using it are done, and a dead one is closed right away (its items are requeued).
+    """
+
+    def __init__(self, playwright, size=MEDIA_BROWSERS, headless=PLAYWRIGHT_HEADLESS):
+        self.playwright = playwright
+        self.size = max(1, size)
+        self.headless = headless
+        self.shards = []
+        self._locks = []
+        self._launch_failures = []
+
+    async def start(self):
+        self._locks = [asyncio.Lock() for _ in range(self.size)]
+        self._launch_failures = [0] * self.size
+        self.shards = [await self._launch(i) for i in range(self.size)]
+        logger.info(f"[Step 4] {self.size} browser(s) started.")
+        return self
+
+    async def _launch(self, index):
+        browser = await self.playwright.chromium.launch(headless=self.headless)
+        context = await browser.new_context()
+        return BrowserShard(index, browser, context)
+
+    async def _replace(self, index, reason):
+        old = self.shards[index]
+        failures = self._launch_failures[index]
+        if failures:
+            # Callers for this browser wait on its lock meanwhile
+            await asyncio.sleep(min(RELAUNCH_BACKOFF_MAX, 2 ** (failures - 1)))
+        logger.info(f"[Step 4] Replacing browser {index} ({reason}, {old.pool.navigations} navigations).")
+        try:
+            new = await self._launch(index)
+        except Exception:
+            self._launch_failures[index] += 1
+            raise
+        self._launch_failures[index] = 0
+        BROWSER_RESTARTS.inc(reason=reason)
+        old.retired = True
+        self.shards[index] = new
+        if old.in_use == 0 or not old.alive:
+            await old.close()
+
+    async def acquire(self, worker_index):
+        """(shard, page) for a worker; hand both back with release()."""
+        index = worker_index % self.size
+        async with self._locks[index]:
+            shard = self.shards[index]
+            if not shard.alive:
+                await self._replace(index, "crash")
+            elif shard.pool.navigations >= MEDIA_BROWSER_MAX_NAVIGATIONS:
+                await self._replace(index, "navigations")
+            elif await shard.over_memory():
+                await self._replace(index, "memory")
+            shard = self.shards[index]
+            shard.in_use += 1
+        try:
+            return shard, await shard.pool.acquire()
+        except Exception:
+            shard.in_use -= 1
+            raise
+
+    def release(self, shard, page):
+        shard.in_use -= 1
+        shard.pool.release(page)
+        if shard.retired and shard.in_use == 0:
+            asyncio.ensure_future(shard.close())
+
+    async def close(self):
+        for shard in self.shards:
+            await shard.close()
+
 
 def create_table_if_not_exists(conn):
     """Create the page_top_creatives table if it doesn't exist."""
@@ -59,50 +311,101 @@ def get_top_ads_for_page(conn, page_id, limit=5):
         cur.execute(query, (page_id, limit))
         return cur.fetchall()
 
+# Every <video> and <img> with its src and rendered size, collected in one round trip
+MEDIA_CANDIDATES_JS = """
+() => {
+    const candidate = (kind, el) => {
+        const r = el.getBoundingClientRect();
+        return {kind, src: el.getAttribute('src'), width: r.width, height: r.height,
+                visible: r.width > 0 && r.height > 0};
+    };
+    return [
+        ...Array.from(document.querySelectorAll('video'), el => candidate('video', el)),
+        ...Array.from(document.querySelectorAll('img'), el => candidate('image', el)),
+    ];
+}
+"""
+
+MIN_IMAGE_AREA = 10000  # px²; smaller images are avatars, icons and thumbnails
+
+def pick_best_media(candidates):
+    """
+    (media_type, media_url) from MEDIA_CANDIDATES_JS output: the first video if it has
+    a src, otherwise the largest rendered image over MIN_IMAGE_AREA. (None, None) if neither.
+    """
+    videos = [c for c in candidates if c["kind"] == "video"]
+    if videos and videos[0]["src"]:
+        return 'VIDEO', videos[0]["src"]
+
+    best_image = None
+    max_area = 0
+    for c in candidates:
+        if c["kind"] == "image" and c["visible"]:
+            area = c["width"] * c["height"]
+            if area > MIN_IMAGE_AREA and area > max_area:
+                max_area = area
+                best_image = c
+
+    if best_image:
+        return 'IMAGE', best_image["src"]
+    return None, None
+
 async def scrape_media_from_url(page_obj, url):
     """
     Uses Playwright to navigate to the ad snapshot URL and extract media.
     Returns (media_type, media_url) or (None, None).
     """
     try:
-        await page_obj.goto(url, timeout=60000, wait_until="domcontentloaded")
-        
+        with span("browser.goto", **{"url.full": redact_tokens(url)}) as nav:
+            start = time.monotonic()
+            await page_obj.goto(url, timeout=60000, wait_until="domcontentloaded")
+            nav.set("browser.navigation_ms", round((time.monotonic() - start) * 1000, 1))
+
         # Wait for video or a significant image to appear (up to 10s), fallback silently
-        try:
-            await page_obj.wait_for_selector('video, img', timeout=10000)
-        except Exception:
-            pass  # Content may still be there, continue scraping
-        
-        # 1. Try to find a VIDEO
-        video_element = await page_obj.query_selector('video')
-        if video_element:
-            src = await video_element.get_attribute('src')
-            if src:
-                return 'VIDEO', src
-        
-        # 2. Try to find the main IMAGE
-        images = await page_obj.query_selector_all('img')
-        best_image = None
-        max_area = 0
-        
-        for img in images:
-            box = await img.bounding_box()
-            if box:
-                area = box['width'] * box['height']
-                if area > 10000 and area > max_area:
-                    max_area = area
-                    best_image = img
+        with span("browser.wait_for_media"):
+            try:
+                await page_obj.wait_for_selector('video, img', timeout=10000)
+            except Exception:
+                pass  # Content may still be there, continue scraping
         
-        if best_image:
-            src = await best_image.get_attribute('src')
-            return 'IMAGE', src
-
-        return None, None
+        # Video first, then the main IMAGE (largest one)
+        with span("browser.extract") as extract:
+            candidates = await page_obj.evaluate(MEDIA_CANDIDATES_JS)
+            extract.set("browser.media_candidates", len(candidates))
+        return pick_best_media(candidates)
 
     except Exception as e:
-        logger.error(f"Error scraping {url}: {e}")
+        browser = page_obj.context.browser
+        if page_obj.is_closed() or page_obj in crashed_pages or (browser and not browser.is_connected()):
+            raise BrowserCrashedError(redact_tokens(f"Browser died while scraping {url}: {e}")) from e
+        logger.error(redact_tokens(f"Error scraping {url}: {e}"))
         return None, None
 
+async def extract_media(page_obj, url):
+    """
+    Media of one snapshot: the HTML fast path first (MEDIA_FAST_PATH), a Chromium
+    navigation with page_obj only if it found nothing. Returns (media_type, media_url) or (None, None).
+    """
+    if MEDIA_FAST_PATH:
+        media_type, media_url = await fetch_media(url)
+        MEDIA_EXTRACTIONS.inc(path="http", result="hit" if media_url else "miss")
+        if media_url:
+            return media_type, media_url
+
+    media_type, media_url = await scrape_media_from_url(page_obj, url)
+    MEDIA_EXTRACTIONS.inc(path="browser", result="hit" if media_url else "miss")
+    return media_type, media_url
+
+def media_hit_rates():
+    """'http 41/50 (82%), browser 6/9 (67%)' for this process."""
+    parts = []
+    for path in ("http", "browser"):
+        hits = MEDIA_EXTRACTIONS.value(path=path, result="hit")
+        total = hits + MEDIA_EXTRACTIONS.value(path=path, result="miss")
+        if total:
+            parts.append(f"{path} {hits}/{total} ({hits / total:.0%})")
+    return ", ".join(parts) or "no snapshots"
+
 def upsert_creative(conn, page_id, ad_id, media_type, media_url, reach):
     """Upsert the found creative into the database."""
     sql = """
@@ -123,10 +426,11 @@ def upsert_creative(conn, page_id, ad_id, media_type, media_url, reach):
         logger.error(f"Error upserting creative: {e}")
         conn.rollback()
 
-async def process_page_media(context, page_row):
+@profiled_item("step4")
+@traced_item("page", "step4.scrape_media", lambda page_obj, page_row: page_row[0])
+async def process_page_media(page_obj, page_row):
     """
-    Process a single page to find media.
-    Acquires semaphore to limit concurrency.
+    Process a single page to find media, navigating the worker's browser page (page_obj).
     """
     page_id, page_name = page_row
     
@@ -134,14 +438,18 @@ async def process_page_media(context, page_row):
     if not conn:
         return
 
-    # Mark as processing
+    # Claim the page (skip it if another worker holds a live lease)
     try:
-        mark_page_status(conn, page_id, 'media_status', 'processing')
-    except Exception:
-        pass
+        if not claim_item(conn, 'media_status', page_id):
+            logger.info(f"Page {page_id} is leased by another worker. Skipping.")
+            conn.close()
+            return
+    except Exception as e:
+        # Without a lease another worker may take the same page: leave it for a later run
+        logger.error(f"Error claiming page {page_id}: {e}. Skipping.")
+        conn.close()
+        return False
 
-    page_obj = await context.new_page()
-    
     try:
         # Check if we already have a top creative
         with conn.cursor() as cur:
@@ -172,7 +480,7 @@ async def process_page_media(context, page_row):
             if not snapshot_url:
                 continue
 
-            media_type, media_url = await scrape_media_from_url(page_obj, snapshot_url)
+            media_type, media_url = await extract_media(page_obj, snapshot_url)
             
             if media_url:
                 logger.info(f"  FOUND {media_type}: {media_url[:50]}...")
@@ -191,23 +499,88 @@ async def process_page_media(context, page_row):
         else:
             mark_page_status(conn, page_id, 'media_status', 'not_found')
 
+    except BrowserCrashedError:
+        # Not the page's fault: the worker requeues it
+        raise
     except Exception as e:
         logger.error(f"Error processing page {page_id}: {e}")
         new_status = increment_media_retry(conn, page_id)
         logger.warning(f"Page {page_id} marked as '{new_status}' after retry increment.")
+        return False
     finally:
-        await page_obj.close()
         conn.close()
 
-async def worker(queue, context):
-    while True:
-        page_row = await queue.get()
-        if page_row is None:
-            queue.task_done()
-            break
+def requeue_or_fail(queue, page_row, reason):
+    """
+    Put a page whose browser failed back on the queue (it keeps its lease), or count a
+    media retry once it was requeued MAX_CRASH_REQUEUES times.
+    """
+    page_id = page_row[0]
+    requeued = _crash_requeues.get(page_id, 0)
+    if requeued < MAX_CRASH_REQUEUES:
+        _crash_requeues[page_id] = requeued + 1
+        logger.warning(f"Page {page_id}: {reason}. Requeuing.")
+        queue.put_nowait(page_row)
+        return
+    _crash_requeues.pop(page_id, None)
+    conn = get_conn()
+    try:
+        new_status = increment_media_retry(conn, page_id)
+        logger.warning(f"Page {page_id}: {reason}. Marked as '{new_status}' after retry increment.")
+    except Exception as e:
+        logger.error(f"Page {page_id}: could not record the retry: {e}")
+    finally:
+        conn.close()
 
-        await process_page_media(context, page_row)
-        queue.task_done()
+
+async def worker(queue, browsers, index=0):
+    tuner = get_tuner("media")
+    processed = transferred = 0
+    try:
+        while True:
+            # Workers above the tuner's current limit sit idle until it grows again
+            await tuner.wait_turn(index)
+            page_row = await queue.get()
+            QUEUE_DEPTH.set(queue.qsize(), stage="step4")
+            if page_row is None:
+                queue.task_done()
+                break
+
+            try:
+                # Draining: don't claim new pages, just empty the queue
+                if shutdown_requested.is_set():
+                    _crash_requeues.pop(page_row[0], None)
+                    continue
+                try:
+                    shard, page_obj = await browsers.acquire(index)
+                except Exception as e:
+                    # Relaunch failed (BrowserPool backs off before the next one)
+                    requeue_or_fail(queue, page_row, f"no browser ({e})")
+                    continue
+                start = time.monotonic()
+                try:
+                    ok = await process_page_media(page_obj, page_row)
+                    _crash_requeues.pop(page_row[0], None)
+                except BrowserCrashedError as e:
+                    requeue_or_fail(queue, page_row, str(e))
+                    ok = False
+                except Exception as e:
+                    logger.error(f"[Step 4] Worker {index}: page {page_row[0]} failed: {e}")
+                    _crash_requeues.pop(page_row[0], None)
+                    ok = False
+                finally:
+                    page_bytes = shard.pool.take_bytes(page_obj)
+                    browsers.release(shard, page_obj)
+                tuner.record(time.monotonic() - start, ok is not False)
+                BROWSER_BYTES.inc(page_bytes, worker=str(index))
+                processed += 1
+                transferred += page_bytes
+            finally:
+                queue.task_done()
+    finally:
+        if processed:
+            logger.info(f"[Step 4] Worker {index}: {processed} page(s), {transferred / 1e6:.1f} MB transferred "
+                        f"({transferred / processed / 1e3:.0f} kB/page)")
 
 async def main_async():
     logger.info("Starting Media Downloader (Step 4) (Async)...")
@@ -220,11 +593,11 @@ async def main_async():
 
     #create_table_if_not_exists(conn)                       --------------- perdida de tiempo ----------------
 
-    # Reset any stuck pages from previous interrupted runs (media_status only)
+    # Reclaim pages abandoned by crashed runs (expired leases, media_status only)
     try:
         media_reset = reset_stuck_pages(conn)
         if media_reset > 0:
-            logger.info(f"Reset {media_reset} media-stuck pages to 'pending'.")
+            logger.info(f"Reclaimed {media_reset} abandoned media pages to 'pending'.")
     except Exception as e:
         logger.error(f"Error resetting stuck pages: {e}")
 
@@ -242,9 +615,9 @@ async def main_async():
     if not pages:
         return
 
+    register_loop(asyncio.get_running_loop(), "step4")
     async with async_playwright() as p:
-        browser = await p.chromium.launch(headless=PLAYWRIGHT_HEADLESS)
-        context = await browser.new_context()
+        browsers = await BrowserPool(p).start()
 
         queue = asyncio.Queue()
 
@@ -252,20 +625,34 @@ async def main_async():
             await queue.put(page)
 
         workers = [
-            asyncio.create_task(worker(queue, context))
-            for _ in range(MEDIA_CONCURRENCY)
+            asyncio.create_task(worker(queue, browsers, i))
+            for i in range(get_tuner("media").max_workers)
         ]
 
         await queue.join()
 
-        for _ in workers:
-            await queue.put(None)
-
-        await asyncio.gather(*workers)
+        # Every page is done; idle workers may be parked by the tuner, so cancel rather than send sentinels
+        for w in workers:
+            w.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
 
-        await browser.close()
+        await browsers.close()
+    await close_client()
+    unregister_loop(asyncio.get_running_loop())
     
-    logger.info("Media Downloader Step Completed.")
+    logger.info(f"Media Downloader Step Completed. Media found by: {media_hit_rates()}.")
 
 if __name__ == "__main__":
-    asyncio.run(main_async())
+    import argparse
+    from utils.lifecycle import install_signal_handlers, start_lease_heartbeat, drain
+    from utils.profiling import add_profiling_args, start_from_args
+    parser = argparse.ArgumentParser(description="Step 4: scrape top creative media for pending pages")
+    add_profiling_args(parser)
+    start_from_args(parser.parse_args())
+    threading.current_thread().name = "Step4-Main"
+    install_signal_handlers()
+    start_lease_heartbeat()
+    try:
+        asyncio.run(main_async())
+    finally:
+        drain()
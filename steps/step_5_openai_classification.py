@@ -21,13 +21,9 @@ from db.postgres_client import (
     mark_page_status
 )
 
-try:
-    from openai import OpenAI
-except ImportError:
-    import subprocess
-    import sys
-    subprocess.check_call([sys.executable, "-m", "pip", "install", "openai"])
-    from openai import OpenAI
+from utils.profiling import profiled_item
+from utils.tracing import span, emit_span, trace_id_for
+from utils.metrics import OPENAI_BATCHES, OPENAI_BATCH_STATUSES
 
 load_dotenv()
 logger = logging.getLogger(__name__)
@@ -42,6 +38,11 @@ VALID_CATEGORIES = [
 ]
 
 def get_openai_client():
+    # Imported here so the rest of the module (validate_category, prompts) works without openai
+    try:
+        from openai import OpenAI
+    except ImportError:
+        raise RuntimeError("The openai package is required for Step 5: pip install openai")
     api_key = os.getenv("OPENAI_API_KEY")
     if not api_key:
         raise ValueError("OPENAI_API_KEY missing from .env file")
@@ -68,6 +69,7 @@ def construct_prompt(page_name, bodies):
     request += "Now classify the page above:"
     return request
 
+@profiled_item("step5")
 def process_upload_batch():
     """Find pending pages, create JSONL file, upload to OpenAI Batch API."""
     conn = get_conn()
@@ -127,18 +129,20 @@ def process_upload_batch():
     client = get_openai_client()
     try:
         logger.info(f"[Step 5] Uploading file {filename} to OpenAI...")
-        with open(filename, "rb") as file_to_upload:
-            batch_input_file = client.files.create(
-                file=file_to_upload,
-                purpose="batch"
-            )
+        with span("openai.files.create", **{"openai.requests": len(batch_requests)}):
+            with open(filename, "rb") as file_to_upload:
+                batch_input_file = client.files.create(
+                    file=file_to_upload,
+                    purpose="batch"
+                )
             
         logger.info("[Step 5] Creating batch job...")
-        batch = client.batches.create(
-            input_file_id=batch_input_file.id,
-            endpoint="/v1/chat/completions",
-            completion_window="24h"
-        )
+        with span("openai.batches.create"):
+            batch = client.batches.create(
+                input_file_id=batch_input_file.id,
+                endpoint="/v1/chat/completions",
+                completion_window="24h"
+            )
         
         batch_id = batch.id
         logger.info(f"[Step 5] Batch created successfully: {batch_id}")
@@ -149,6 +153,7 @@ def process_upload_batch():
             save_openai_batch(conn, batch_id)
             for pid in pages_to_process:
                 mark_page_status(conn, pid, 'classification_status', 'processing')
+                emit_span("step5.batch_submitted", trace_id_for("page", pid), **{"openai.batch_id": batch_id})
         finally:
             conn.close()
             
@@ -180,6 +185,7 @@ def validate_category(result_text):
     logger.warning(f"Invalid category returned: '{result_text}'. Defaulting to 'Others'")
     return "Others"
 
+@profiled_item("step5")
 def process_download_batches():
     """Check pending batches, download results, update DB."""
     conn = get_conn()
@@ -192,10 +198,14 @@ def process_download_batches():
         return
 
     client = get_openai_client()
+    seen = {}
     
     for batch_id in batches:
         try:
-            batch_status = client.batches.retrieve(batch_id)
+            with span("openai.batches.retrieve", **{"openai.batch_id": batch_id}) as s:
+                batch_status = client.batches.retrieve(batch_id)
+                s.set("openai.batch_status", batch_status.status)
+            seen[batch_status.status] = seen.get(batch_status.status, 0) + 1
         except Exception as e:
             logger.error(f"[Step 5] Error retrieving batch {batch_id}: {e}")
             continue
@@ -232,6 +242,8 @@ def process_download_batches():
                         final_category = validate_category(raw_response)
                         
                         mark_page_classification(conn, page_id, final_category, raw_response, 'completed')
+                        emit_span("step5.classified", trace_id_for("page", page_id),
+                                  **{"openai.batch_id": batch_id, "page.category": final_category})
                         updates += 1
                         
                     # Mark batch completed
@@ -254,11 +266,23 @@ def process_download_batches():
             finally:
                 conn.close()
 
+    # Snapshot of this poll; batches finished in earlier polls are no longer listed
+    for status in OPENAI_BATCH_STATUSES:
+        OPENAI_BATCHES.set(seen.get(status, 0), status=status)
+
 def main_sync():
     """Called periodically by pipeline."""
     process_download_batches()
     process_upload_batch()
 
 if __name__ == "__main__":
+    import argparse
+    import threading
+    from utils.profiling import add_profiling_args, start_from_args
+    parser = argparse.ArgumentParser(description="Step 5: classify pages with the OpenAI Batch API")
+    add_profiling_args(parser)
+    args = parser.parse_args()
     logging.basicConfig(level=logging.INFO)
+    threading.current_thread().name = "Step5-Main"
+    start_from_args(args)
     main_sync()
@@ -1,5 +1,6 @@
 import requests
 from db.postgres_client import get_conn
+from config.settings import META_GRAPH_URL, META_API_VERSION
 
 def test_meta_api(page_id):
     conn = get_conn()
@@ -14,7 +15,7 @@ def test_meta_api(page_id):
 
     print(f"✅ Using any token, ending in ...{token[-5:]}")
     
-    url = "https://graph.facebook.com/v24.0/ads_archive"
+    url = f"{META_GRAPH_URL}/{META_API_VERSION}/ads_archive"
     params = {
         "access_token": token,
         "search_page_ids": page_id,
@@ -0,0 +1,364 @@
+"""
+Offline capacity planner: how many tokens does a crawl of N pages per day need?
+
+    python -m tools.capacity_simulator --tokens 10 --hours 24
+    python -m tools.capacity_simulator --tokens 10 --terms 500     # time to drain 500 terms
+    python -m tools.capacity_simulator --cassette cassettes/meta.jsonl.gz --tokens 10
+    python -m tools.capacity_simulator --target-pages-per-day 50000 --max-tokens 200
+
+A discrete-event simulation of Steps 2 and 3 running side by side (as in pipeline.py)
+against a modelled token pool; nothing touches Meta or the database. Each token has a
+rolling one-hour budget of 100 x --calls-per-pct calls (read the real figure from
+tools.token_usage_report's CALLS/1% column). Every call picks a token the way
+get_active_token does (headroom by default, or LRU), and the usage it reports goes
+through the same cooldown_minutes_from_usage / proactive_rotation_from_usage functions
+MetaClient uses, so cooldowns follow production policy.
+
+The workload is synthetic (--terms, --pages-per-term, --ads-per-page, --latency-ms) or
+drawn from a recorded cassette (pages found per term search, requests per page and
+per-call latency are resampled from the recording). By default terms never run out
+and throughput is measured over --hours of steady state; --terms instead simulates
+draining a fixed backlog. Step 4 is not modelled: it uses no Graph API quota.
+"""
+import argparse
+import gzip
+import heapq
+import json
+import math
+import os
+import random
+import sys
+from collections import defaultdict, deque
+from urllib.parse import urlsplit, parse_qsl
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config.settings import TERMS_CONCURRENCY, PAGES_CONCURRENCY, META_PAGE_DELAY
+from api.meta_client import cooldown_minutes_from_usage, proactive_rotation_from_usage
+
+WINDOW = 3600.0  # Meta's usage window, seconds
+RATE_LIMIT_DEFAULT_MINUTES = 15  # MetaClient's fallback when the header has no estimate
+
+
+class Workload:
+    """Samplers for pages found per term, Graph requests per page and call latency."""
+
+    def __init__(self, terms, pages_per_term, requests_per_page, term_latency, page_latency):
+        self.terms = terms
+        self.pages_per_term = pages_per_term
+        self.requests_per_page = requests_per_page
+        self.term_latency = term_latency
+        self.page_latency = page_latency
+
+    @classmethod
+    def synthetic(cls, rng, terms, pages_per_term, ads_per_page, latency_ms, page_limit=100):
+        median = latency_ms / 1000
+
+        def latency():
+            return rng.lognormvariate(math.log(median), 0.5)
+
+        def pages():
+            return int(rng.expovariate(1 / pages_per_term)) if pages_per_term > 0 else 0
+
+        def requests():
+            ads = max(1, int(rng.expovariate(1 / ads_per_page)))
+            return math.ceil(ads / page_limit)
+
+        return cls(terms, pages, requests, latency, latency)
+
+    @classmethod
+    def from_cassette(cls, rng, path, terms=None):
+        term_pages, term_latency, page_latency = [], [], []
+        page_requests = defaultdict(int)
+        seen_pages = set()
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                entry = json.loads(line)
+                query = dict(parse_qsl(urlsplit(entry["key"]).query))
+                elapsed = entry.get("elapsed", 0)
+                if "search_page_ids" in query:
+                    page_requests[query["search_page_ids"]] += 1
+                    page_latency.append(elapsed)
+                elif "search_terms" in query:
+                    term_latency.append(elapsed)
+                    try:
+                        ads = json.loads(entry.get("body") or "{}").get("data", [])
+                    except ValueError:
+                        ads = []
+                    found = {ad.get("page_id") for ad in ads if ad.get("page_id")}
+                    # Step 2 only queues pages it hasn't stored yet
+                    term_pages.append(len(found - seen_pages))
+                    seen_pages |= found
+        if not term_pages:
+            raise SystemExit(f"{path}: no search_terms requests recorded")
+        requests = list(page_requests.values()) or [1]
+        page_latency = page_latency or term_latency
+        return cls(
+            terms,
+            lambda: rng.choice(term_pages),
+            lambda: rng.choice(requests),
+            lambda: rng.choice(term_latency),
+            lambda: rng.choice(page_latency),
+        )
+
+
+class TokenPool:
+    """Tokens with a rolling-hour call budget, cooldowns and get_active_token's rotation."""
+
+    def __init__(self, tokens, calls_per_pct, rotation="headroom"):
+        self.quota = calls_per_pct * 100
+        self.rotation = rotation
+        self.calls = [deque() for _ in range(tokens)]  # completion times in the last hour
+        self.last_used = [-1.0] * tokens
+        self.cooldown_until = [0.0] * tokens
+        self.cooldowns = [[] for _ in range(tokens)]  # [start, until] intervals
+        self.rate_limits = 0
+        self.rotations = 0
+
+    def usage(self, i, now):
+        window = self.calls[i]
+        while window and window[0] <= now - WINDOW:
+            window.popleft()
+        return len(window) / self.quota * 100
+
+    def acquire(self, now):
+        """Index of the token to use, or (None, seconds until one recovers)."""
+        available = [i for i in range(len(self.calls)) if self.cooldown_until[i] <= now]
+        if not available:
+            return None, min(self.cooldown_until) - now
+        if self.rotation == "headroom":
+            token = min(available, key=lambda i: (int(self.usage(i, now) // 5), self.last_used[i]))
+        else:
+            token = min(available, key=lambda i: self.last_used[i])
+        self.last_used[token] = now
+        return token, 0.0
+
+    def _cool(self, i, now, minutes):
+        until = now + minutes * 60
+        if self.cooldown_until[i] > now:
+            self.cooldowns[i][-1][1] = max(self.cooldown_until[i], until)
+        else:
+            self.cooldowns[i].append([now, until])
+        self.cooldown_until[i] = max(self.cooldown_until[i], until)
+
+    def cooldown_seconds(self, end):
+        """Token-seconds spent in cooldown up to `end`."""
+        return sum(
+            max(0.0, min(until, end) - start)
+            for intervals in self.cooldowns for start, until in intervals
+        )
+
+    def complete(self, i, now):
+        """Charge a call to token i. Returns False if Meta would have rate-limited it."""
+        pct = self.usage(i, now)
+        if pct >= 100:
+            # Time until enough calls leave the window to get back under 100%
+            excess = len(self.calls[i]) - self.quota + 1
+            regain = math.ceil((self.calls[i][int(excess) - 1] + WINDOW - now) / 60)
+            usage = {"call_count": pct, "total_time": pct, "total_cputime": pct,
+                     "estimated_time_to_regain_access": regain}
+            self.rate_limits += 1
+            self._cool(i, now, cooldown_minutes_from_usage(usage) or RATE_LIMIT_DEFAULT_MINUTES)
+            return False
+
+        self.calls[i].append(now)
+        pct = self.usage(i, now)
+        rotate, minutes = proactive_rotation_from_usage(
+            {"call_count": pct, "total_time": pct, "total_cputime": pct}
+        )
+        if rotate:
+            self.rotations += 1
+            self._cool(i, now, minutes)
+        return True
+
+
+class Simulation:
+    def __init__(self, workload, pool, terms_concurrency, pages_concurrency, page_delay, horizon=None):
+        self.workload = workload
+        self.pool = pool
+        self.terms_concurrency = terms_concurrency
+        self.pages_concurrency = pages_concurrency
+        self.page_delay = page_delay
+        self.horizon = horizon
+        self.now = 0.0
+        self._events = []
+        self._seq = 0
+        self._idle_page_workers = []
+        self.terms_left = workload.terms if workload.terms is not None else math.inf
+        self.terms_running = 0
+        self.page_queue = 0
+        self.pages_done = 0
+        self.api_calls = 0
+        self.starved_seconds = 0.0
+
+    def _schedule(self, delay, worker):
+        self._seq += 1
+        heapq.heappush(self._events, (self.now + delay, self._seq, worker))
+
+    def _call(self, latency):
+        """One Graph request: wait for a token, spend the latency, retry if rate-limited."""
+        while True:
+            token, wait = self.pool.acquire(self.now)
+            if token is None:
+                self.starved_seconds += wait
+                yield wait
+                continue
+            yield latency()
+            self.api_calls += 1
+            if self.pool.complete(token, self.now):
+                return
+
+    def _term_worker(self):
+        while self.terms_left > 0:
+            self.terms_left -= 1
+            self.terms_running += 1
+            yield from self._call(self.workload.term_latency)
+            self.terms_running -= 1
+            self.page_queue += self.workload.pages_per_term()
+            self._wake_page_workers()
+        self._wake_page_workers()
+
+    def _page_worker(self):
+        while True:
+            if self.page_queue == 0:
+                if self.terms_left == 0 and self.terms_running == 0:
+                    return
+                yield None  # parked until Step 2 queues more pages
+                continue
+            self.page_queue -= 1
+            for n in range(self.workload.requests_per_page()):
+                if n:
+                    yield self.page_delay
+                yield from self._call(self.workload.page_latency)
+            self.pages_done += 1
+
+    def _wake_page_workers(self):
+        while self._idle_page_workers:
+            self._schedule(0, self._idle_page_workers.pop())
+
+    def _step(self, worker):
+        try:
+            delay = next(worker)
+        except StopIteration:
+            return
+        if delay is None:
+            self._idle_page_workers.append(worker)
+        else:
+            self._schedule(delay, worker)
+
+    def run(self):
+        for _ in range(self.terms_concurrency):
+            self._schedule(0, self._term_worker())
+        for _ in range(self.pages_concurrency):
+            self._schedule(0, self._page_worker())
+        while self._events:
+            at, _, worker = heapq.heappop(self._events)
+            if self.horizon is not None and at > self.horizon:
+                self.now = self.horizon
+                break
+            self.now = at
+            self._step(worker)
+        return self.report()
+
+    def report(self):
+        duration = max(self.now, 1e-9)
+        tokens = len(self.pool.calls)
+        return {
+            "tokens": tokens,
+            "duration_s": self.now,
+            "pages": self.pages_done,
+            "pages_per_day": self.pages_done / duration * 86400,
+            "api_calls": self.api_calls,
+            "calls_per_hour": self.api_calls / duration * 3600,
+            "rate_limits": self.pool.rate_limits,
+            "proactive_rotations": self.pool.rotations,
+            "cooldown_share": self.pool.cooldown_seconds(self.now) / (duration * tokens),
+            "starved_s": self.starved_seconds,
+        }
+
+
+def simulate(args, tokens):
+    rng = random.Random(args.seed)
+    if args.cassette:
+        workload = Workload.from_cassette(rng, args.cassette, args.terms)
+    else:
+        workload = Workload.synthetic(rng, args.terms, args.pages_per_term,
+                                      args.ads_per_page, args.latency_ms)
+    pool = TokenPool(tokens, args.calls_per_pct, args.rotation)
+    # Without --terms the crawl never runs dry: measure steady state over --hours
+    horizon = args.hours * 3600 if args.terms is None else None
+    return Simulation(workload, pool, args.terms_concurrency, args.pages_concurrency,
+                      args.page_delay, horizon).run()
+
+
+def _duration(seconds):
+    seconds = int(seconds)
+    if seconds >= 86400:
+        return f"{seconds // 86400}d {seconds % 86400 // 3600}h"
+    if seconds >= 3600:
+        return f"{seconds // 3600}h {seconds % 3600 // 60:02d}m"
+    return f"{seconds // 60}m {seconds % 60:02d}s"
+
+
+def render(r):
+    return "\n".join([
+        f"Tokens:              {r['tokens']}",
+        f"Simulated run:       {_duration(r['duration_s'])} for {r['pages']:,} pages",
+        f"Throughput:          {r['pages_per_day']:,.0f} pages/day, {r['calls_per_hour']:,.0f} Graph calls/hour",
+        f"Graph calls:         {r['api_calls']:,} ({r['rate_limits']:,} rate-limited)",
+        f"Proactive rotations: {r['proactive_rotations']:,}",
+        f"Pool in cooldown:    {r['cooldown_share']:.0%} of token-time",
+        f"Workers starved:     {_duration(r['starved_s'])} waiting for a token (summed over workers)",
+    ])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Simulate token pool capacity for Steps 2-3")
+    parser.add_argument("--tokens", type=int, default=10, help="tokens in the pool")
+    parser.add_argument("--calls-per-pct", type=float, default=2.0,
+                        help="calls one usage %% buys (CALLS/1%% in tools.token_usage_report)")
+    parser.add_argument("--rotation", choices=("lru", "headroom"), default="headroom")
+    parser.add_argument("--terms-concurrency", type=int, default=TERMS_CONCURRENCY)
+    parser.add_argument("--pages-concurrency", type=int, default=PAGES_CONCURRENCY)
+    parser.add_argument("--page-delay", type=float, default=META_PAGE_DELAY,
+                        help="seconds between paginated requests")
+    parser.add_argument("--cassette", help="recorded cassette to draw the workload from")
+    parser.add_argument("--terms", type=int,
+                        help="crawl this many terms and stop (default: endless crawl for --hours)")
+    parser.add_argument("--hours", type=float, default=24, help="simulated hours of an endless crawl")
+    parser.add_argument("--pages-per-term", type=float, default=20, help="synthetic: mean new pages per term")
+    parser.add_argument("--ads-per-page", type=float, default=60, help="synthetic: mean ads per page")
+    parser.add_argument("--latency-ms", type=float, default=800, help="synthetic: median Graph latency")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--target-pages-per-day", type=float,
+                        help="find the smallest pool reaching this throughput")
+    parser.add_argument("--max-tokens", type=int, default=500, help="upper bound for --target-pages-per-day")
+    args = parser.parse_args(argv)
+
+    if args.target_pages_per_day is None:
+        print(render(simulate(args, args.tokens)))
+        return 0
+
+    # Throughput is monotonic in pool size (up to noise): binary search the smallest pool
+    low, high, best = 1, args.max_tokens, None
+    while low <= high:
+        mid = (low + high) // 2
+        result = simulate(args, mid)
+        print(f"  {mid:>4} tokens → {result['pages_per_day']:,.0f} pages/day")
+        if result["pages_per_day"] >= args.target_pages_per_day:
+            best, high = result, mid - 1
+        else:
+            low = mid + 1
+    if best is None:
+        print(f"{args.target_pages_per_day:,.0f} pages/day not reached with {args.max_tokens} tokens "
+              f"(concurrency may be the bottleneck: try --pages-concurrency).")
+        return 1
+    print()
+    print(render(best))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,374 @@
+"""
+Local fake of the Meta Ad Library API for load testing (no network needed).
+
+Serves:
+  GET /<version>/ads_archive   search_terms / search_page_ids filtering, `fields`,
+                               `limit` + cursor pagination through paging.next
+  GET /<version>/?ids=A,B      ad lookup by id ({id: ad} with `fields`), quota as ads_archive
+  GET /debug_token             is_valid / expires_at / scopes for a token
+  GET /__stats                 request and error counters as JSON
+
+Every ads_archive response carries an x-business-use-case-usage header computed
+from a per-token quota (calls per window). Past the quota the token gets a rate
+limit error; errors 1, 1/99, 2, 4, 17, 32, 613 can also be injected at random,
+and tokens starting with "invalid"/"expired" behave like dead tokens (code 190).
+
+Usage:
+    python -m tools.fake_meta_server --port 8765 --pages 5000 --quota 600 \\
+        --latency lognormal:40,0.5 --errors 2:0.01,1/99:0.002
+
+    META_GRAPH_URL=http://127.0.0.1:8765 python pipeline.py
+"""
+import argparse
+import base64
+import json
+import logging
+import math
+import os
+import random
+import socket
+import threading
+import time
+from collections import defaultdict, deque
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs, urlencode
+
+logger = logging.getLogger(__name__)
+
+WORDS = [
+    "dog", "cat", "shirt", "jewelry", "phone", "case", "fitness", "yoga", "kitchen", "home",
+    "decor", "garden", "car", "kids", "toys", "beauty", "makeup", "health", "outdoor", "travel",
+    "book", "coffee", "watch", "shoes", "bag", "lamp", "print", "custom", "gift", "pet",
+]
+
+ERROR_MESSAGES = {
+    1: "An unknown error occurred",
+    2: "An unexpected error has occurred. Please retry your request later.",
+    4: "Application request limit reached",
+    17: "User request limit reached",
+    32: "Page request limit reached",
+    190: "Error validating access token: Session has expired",
+    613: "Calls to this api have exceeded the rate limit.",
+    803: "Some of the aliases you requested do not exist",
+}
+
+
+# ─── Synthetic data ────────────────────────────────────────────────────────
+
+class AdLibrary:
+    """Deterministic synthetic pages and ads, indexed by page id and by name word."""
+
+    def __init__(self, num_pages, ads_per_page, seed):
+        rng = random.Random(seed)
+        self.pages = {}
+        self.ads_by_page = {}
+        self.ads_by_id = {}
+        self.pages_by_word = defaultdict(list)
+        now = datetime.now(timezone.utc)
+        lo, hi = ads_per_page
+
+        for i in range(num_pages):
+            page_id = str(100000000000 + i)
+            name_words = rng.sample(WORDS, 2)
+            name = f"{name_words[0].title()} {name_words[1].title()} Store {i}"
+            self.pages[page_id] = name
+            for w in name_words:
+                self.pages_by_word[w].append(page_id)
+
+            ads = []
+            for j in range(rng.randint(lo, hi)):
+                created = now - timedelta(days=rng.randint(1, 400), minutes=rng.randint(0, 1440))
+                ad = {
+                    "id": str(200000000000000 + i * 1000 + j),
+                    "page_id": page_id,
+                    "page_name": name,
+                    "ad_creation_time": created.strftime("%Y-%m-%d"),
+                    "ad_delivery_start_time": created.strftime("%Y-%m-%d"),
+                    "eu_total_reach": int(rng.lognormvariate(8, 2)),
+                    "is_active_status": True,
+                    "beneficiary_payers": [{"beneficiary": name, "payer": name}],
+                    "ad_creative_bodies": [f"{name}: {' '.join(rng.sample(WORDS, 6))}"],
+                }
+                if rng.random() < 0.1:
+                    stop = created + timedelta(days=rng.randint(1, 30))
+                    ad["ad_delivery_stop_time"] = stop.strftime("%Y-%m-%d")
+                    ad["is_active_status"] = False
+                ads.append(ad)
+                self.ads_by_id[ad["id"]] = ad
+            self.ads_by_page[page_id] = ads
+
+    def search(self, search_terms=None, search_page_ids=None, delivery_date_min=None):
+        if search_page_ids:
+            page_ids = [p for p in search_page_ids if p in self.ads_by_page]
+        elif search_terms:
+            words = [w for w in search_terms.lower().split() if w]
+            matches = set(self.pages_by_word.get(words[0], [])) if words else set()
+            for w in words[1:]:
+                matches &= set(self.pages_by_word.get(w, []))
+            page_ids = sorted(matches)
+        else:
+            page_ids = []
+
+        ads = [ad for pid in page_ids for ad in self.ads_by_page[pid]]
+        if delivery_date_min:
+            ads = [ad for ad in ads if ad["ad_delivery_start_time"] >= delivery_date_min]
+        return ads
+
+
+# ─── Quotas, latency, errors ───────────────────────────────────────────────
+
+class TokenQuota:
+    """Sliding-window call counter per token → usage percentage, as Meta reports it."""
+
+    def __init__(self, calls_per_window, window_seconds):
+        self.calls_per_window = calls_per_window
+        self.window = window_seconds
+        self._calls = defaultdict(deque)
+        self._lock = threading.Lock()
+
+    def hit(self, token):
+        """Register one call; returns (usage_pct, seconds_until_a_slot_frees)."""
+        now = time.monotonic()
+        with self._lock:
+            calls = self._calls[token]
+            while calls and calls[0] <= now - self.window:
+                calls.popleft()
+            calls.append(now)
+            pct = int(len(calls) * 100 / self.calls_per_window)
+            regain = calls[0] + self.window - now if pct >= 100 else 0
+        return pct, regain
+
+
+def parse_latency(spec):
+    """'0', 'fixed:MS', 'uniform:MIN,MAX' or 'lognormal:MEDIAN_MS,SIGMA' → sampler returning seconds."""
+    if not spec or spec == "0":
+        return lambda: 0
+    kind, _, args = spec.partition(":")
+    values = [float(v) for v in args.split(",") if v]
+    if kind == "fixed":
+        return lambda: values[0] / 1000
+    if kind == "uniform":
+        return lambda: random.uniform(values[0], values[1]) / 1000
+    if kind == "lognormal":
+        mu, sigma = math.log(values[0]), values[1]
+        return lambda: random.lognormvariate(mu, sigma) / 1000
+    raise ValueError(f"Unknown latency distribution: {spec}")
+
+
+def parse_errors(spec):
+    """'2:0.01,1/99:0.002' → [((code, subcode), probability), ...]."""
+    errors = []
+    for part in filter(None, (spec or "").split(",")):
+        code_spec, _, prob = part.partition(":")
+        code, _, subcode = code_spec.partition("/")
+        errors.append(((int(code), int(subcode) if subcode else None), float(prob)))
+    return errors
+
+
+# ─── HTTP ──────────────────────────────────────────────────────────────────
+
+class FakeMetaServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024
+
+    def __init__(self, address, library, quota, latency, errors, rate_limit_code, reuse_port=False):
+        self.reuse_port = reuse_port
+        super().__init__(address, FakeMetaHandler)
+        self.library = library
+        self.quota = quota
+        self.latency = latency
+        self.errors = errors
+        self.rate_limit_code = rate_limit_code
+        self.stats = defaultdict(int)
+        self.stats_lock = threading.Lock()
+
+    def server_bind(self):
+        if self.reuse_port:
+            # Several processes accept on the same port; the kernel spreads connections
+            self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        super().server_bind()
+
+    def count(self, key):
+        with self.stats_lock:
+            self.stats[key] += 1
+
+
+class FakeMetaHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive, so clients can reuse connections
+    # Headers and body go out in one segment; otherwise Nagle + delayed ACK cap us at ~25 req/s per connection
+    wbufsize = 1 << 16
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass  # thousands of requests per second — /__stats instead
+
+    def do_GET(self):
+        parts = urlsplit(self.path)
+        query = {k: v[-1] for k, v in parse_qs(parts.query, keep_blank_values=True).items()}
+        if parts.path.endswith("/ads_archive"):
+            self.ads_archive(parts.path, query)
+        elif "ids" in query:
+            self.ads_by_ids(query)
+        elif parts.path.endswith("/debug_token"):
+            self.debug_token(query)
+        elif parts.path == "/__stats":
+            with self.server.stats_lock:
+                self.send_json(200, dict(self.server.stats))
+        else:
+            self.send_json(404, {"error": {"message": "Unknown path", "type": "OAuthException", "code": 803}})
+
+    def send_json(self, status, body, headers=None):
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def send_error_code(self, code, subcode=None, headers=None, message=None):
+        self.server.count(f"error_{code}" + (f"_{subcode}" if subcode else ""))
+        error = {"message": message or ERROR_MESSAGES.get(code, "Error"), "type": "OAuthException", "code": code,
+                 "fbtrace_id": "FAKE"}
+        if subcode:
+            error["error_subcode"] = subcode
+        self.send_json(400, {"error": error}, headers)
+
+    def admit(self, query):
+        """Latency, token check, quota and injected errors. Returns the usage headers, or None if an error was sent."""
+        server = self.server
+        time.sleep(server.latency())
+
+        token = query.get("access_token", "")
+        if not token or token.startswith(("invalid", "expired")):
+            self.send_error_code(190)
+            return None
+
+        pct, regain = server.quota.hit(token)
+        usage = {"type": "ads_archive", "call_count": pct, "total_cputime": pct, "total_time": pct,
+                 "estimated_time_to_regain_access": math.ceil(regain / 60)}
+        headers = {"x-business-use-case-usage": json.dumps({"fake_business": [usage]})}
+
+        if pct >= 100:
+            self.send_error_code(server.rate_limit_code, headers=headers)
+            return None
+
+        r = random.random()
+        for (code, subcode), prob in server.errors:
+            if r < prob:
+                self.send_error_code(code, subcode, headers)
+                return None
+            r -= prob
+        return headers
+
+    def ads_by_ids(self, query):
+        self.server.count("ads_by_ids")
+        headers = self.admit(query)
+        if headers is None:
+            return
+        fields = [f for f in query.get("fields", "id").split(",") if f]
+        ids = [i.strip() for i in query["ids"].split(",")]
+        # Like Graph: one unknown id fails the whole lookup
+        missing = [i for i in ids if i not in self.server.library.ads_by_id]
+        if missing:
+            self.send_error_code(803, headers=headers,
+                                 message=f"(#803) Some of the aliases you requested do not exist: {','.join(missing)}")
+            return
+        body = {}
+        for ad_id in ids:
+            ad = self.server.library.ads_by_id[ad_id]
+            body[ad_id] = {f: ad[f] for f in fields if f in ad}
+        self.server.count("ads_served")
+        self.send_json(200, body, headers)
+
+    def ads_archive(self, path, query):
+        server = self.server
+        server.count("ads_archive")
+        headers = self.admit(query)
+        if headers is None:
+            return
+
+        page_ids = None
+        if query.get("search_page_ids"):
+            page_ids = [p.strip(" []\"'") for p in query["search_page_ids"].split(",")]
+        ads = server.library.search(query.get("search_terms"), page_ids, query.get("ad_delivery_date_min"))
+
+        limit = int(query.get("limit", 25))
+        offset = int(base64.urlsafe_b64decode(query["after"]).decode()) if query.get("after") else 0
+        chunk = ads[offset:offset + limit]
+
+        fields = [f for f in query.get("fields", "id").split(",") if f]
+        body = {"data": [{f: ad[f] for f in fields if f in ad} for ad in chunk]}
+        if offset + limit < len(ads):
+            cursor = base64.urlsafe_b64encode(str(offset + limit).encode()).decode()
+            next_query = dict(query, after=cursor)
+            body["paging"] = {
+                "cursors": {"after": cursor},
+                "next": f"http://{self.headers.get('Host')}{path}?{urlencode(next_query)}",
+            }
+        server.count("ads_served")
+        self.send_json(200, body, headers)
+
+    def debug_token(self, query):
+        self.server.count("debug_token")
+        time.sleep(self.server.latency())
+        token = query.get("input_token", "")
+        if token.startswith("invalid"):
+            return self.send_error_code(190)
+
+        # Deterministic per-token expiry: some never expire, some within days
+        h = sum(token.encode()) % 10
+        expires_at = 0 if h < 5 else int(time.time()) + h * 86400
+        data = {"app_id": "1234567890", "type": "USER", "application": "fake", "is_valid": True,
+                "expires_at": expires_at, "scopes": ["ads_read", "public_profile"]}
+        if token.startswith("expired"):
+            data.update(is_valid=False, expires_at=int(time.time()) - 3600,
+                        error={"code": 190, "message": ERROR_MESSAGES[190], "subcode": 463})
+        self.send_json(200, {"data": data})
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Local fake Meta Ad Library API server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--pages", type=int, default=2000, help="number of synthetic pages")
+    parser.add_argument("--ads-per-page", default="1-40", help="MIN-MAX ads generated per page")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--quota", type=int, default=600, help="calls per token per window before rate limiting")
+    parser.add_argument("--window", type=int, default=3600, help="quota window in seconds")
+    parser.add_argument("--rate-limit-code", type=int, default=613, choices=[4, 17, 32, 613])
+    parser.add_argument("--latency", default="0", help="0 | fixed:MS | uniform:MIN,MAX | lognormal:MEDIAN_MS,SIGMA")
+    parser.add_argument("--errors", default="", help="injected errors, e.g. 2:0.01,1/99:0.002,1:0.005")
+    parser.add_argument("--processes", type=int, default=1,
+                        help="serve from N forked processes on one port (Linux); quotas are then per process")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    lo, _, hi = args.ads_per_page.partition("-")
+    library = AdLibrary(args.pages, (int(lo), int(hi or lo)), args.seed)
+    logger.info(f"Fake Meta API on http://{args.host}:{args.port} — {len(library.pages)} pages, "
+                f"{sum(len(a) for a in library.ads_by_page.values())} ads, {args.processes} process(es). "
+                f"Search terms are words from: {', '.join(WORDS[:8])}, ...")
+
+    # Fork after building the library so every process shares it copy-on-write
+    for _ in range(args.processes - 1):
+        if os.fork() == 0:
+            break
+
+    server = FakeMetaServer(
+        (args.host, args.port), library, TokenQuota(args.quota, args.window),
+        parse_latency(args.latency), parse_errors(args.errors), args.rate_limit_code,
+        reuse_port=args.processes > 1,
+    )
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+"""
+Live pipeline status: per-stage backlog, processing rate, ETA and token pool health.
+
+    python -m tools.status_monitor                 # top-like view, refreshes every 5s
+    python -m tools.status_monitor --once          # print once (db_status.py)
+    python -m tools.status_monitor --once --min-reach 200000   # check_status.py
+
+Each refresh is one query (fetch_status_snapshot). With db_migrate_status_counters.py
+applied it reads a few dozen counter rows maintained by triggers, so refreshing every
+few seconds costs nothing even with millions of ads; --exact counts the tables instead.
+Rates are measured between refreshes over a sliding window, so the first screen has none.
+"""
+import argparse
+import os
+import sys
+import time
+from collections import deque
+from datetime import datetime
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from db.postgres_client import get_conn, fetch_status_snapshot
+
+# (label, snapshot key, pending statuses, in-flight statuses, finished statuses, failed statuses)
+STAGES = [
+    ("Step 2  terms", "search_terms.status", ("pending", "error"), ("processing",), ("completed",), ()),
+    ("Step 3  ads", "pages.ads_status", ("pending",), ("processing",), ("completed", "not_found"), ("error",)),
+    ("Step 4  media", "pages.media_status", ("pending", "error"), ("processing",), ("completed", "not_found"), ("crashed",)),
+    ("Step 5  classify", "pages.classification_status", ("pending",), ("processing",), ("completed",), ()),
+]
+
+
+def _sum(counts, statuses):
+    return sum(counts.get(s, 0) for s in statuses)
+
+
+def _duration(seconds):
+    if seconds is None:
+        return "-"
+    seconds = int(seconds)
+    if seconds >= 86400:
+        return f"{seconds // 86400}d {seconds % 86400 // 3600}h"
+    if seconds >= 3600:
+        return f"{seconds // 3600}h {seconds % 3600 // 60:02d}m"
+    return f"{seconds // 60}m {seconds % 60:02d}s"
+
+
+class RateTracker:
+    """Finished-item counts per stage over a sliding window of refreshes."""
+
+    def __init__(self, window_seconds):
+        self.window = window_seconds
+        self.history = deque()
+
+    def add(self, now, finished):
+        self.history.append((now, finished))
+        while len(self.history) > 2 and now - self.history[1][0] >= self.window:
+            self.history.popleft()
+
+    def per_minute(self, label):
+        if len(self.history) < 2:
+            return None
+        (t0, first), (t1, last) = self.history[0], self.history[-1]
+        if t1 <= t0:
+            return None
+        return max(0, last[label] - first[label]) / (t1 - t0) * 60
+
+
+def render(snapshot, rates, source, interval=None):
+    total = lambda key: snapshot.get(key, {}).get("*", 0)
+    lines = []
+    refresh = f", refresh {interval:g}s" if interval else ""
+    lines.append(f"Meta Ads pipeline — {datetime.now():%Y-%m-%d %H:%M:%S}  ({source}{refresh})")
+    lines.append("")
+    lines.append(f"{'STAGE':<18}{'PENDING':>10}{'ACTIVE':>9}{'DONE':>10}{'FAILED':>9}{'RATE/min':>11}{'ETA':>11}")
+    for label, key, pending, active, done, failed in STAGES:
+        counts = snapshot.get(key, {})
+        backlog = _sum(counts, pending)
+        rate = rates.per_minute(label)
+        eta = backlog / rate * 60 if rate else None
+        lines.append(
+            f"{label:<18}{backlog:>10,}{_sum(counts, active):>9,}{_sum(counts, done):>10,}"
+            f"{_sum(counts, failed):>9,}{(f'{rate:,.1f}' if rate is not None else '-'):>11}"
+            f"{(_duration(eta) if backlog else 'done'):>11}"
+        )
+    lines.append("")
+    lines.append(f"Totals: {total('search_terms.*'):,} terms, {total('pages.*'):,} pages, "
+                 f"{total('ads.*'):,} ads, {total('page_top_creatives.*'):,} creatives")
+
+    tokens = snapshot.get("meta_tokens.status", {})
+    available = snapshot.get("meta_tokens.available", {}).get("*", 0)
+    next_recovery = snapshot.get("meta_tokens.next_recovery_s", {}).get("*", -1)
+    by_status = "  ".join(f"{s} {n}" for s, n in sorted(tokens.items())) or "none"
+    recovery = f" | next recovery in {_duration(next_recovery)}" if next_recovery >= 0 else ""
+    expiring = snapshot.get("meta_tokens.expiring_24h", {}).get("*", 0)
+    recovery += f" | {expiring} expiring within 24h" if expiring else ""
+    health = "" if available else "  << NO TOKEN AVAILABLE"
+    lines.append(f"Tokens: {by_status} | available now {available}{recovery}{health}")
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Live pipeline status monitor")
+    parser.add_argument("--interval", type=float, default=5, help="seconds between refreshes")
+    parser.add_argument("--window", type=float, default=300, help="seconds of history for rates/ETA")
+    parser.add_argument("--once", action="store_true", help="print a single snapshot and exit")
+    parser.add_argument("--exact", action="store_true", help="count the tables instead of reading status_counters")
+    parser.add_argument("--min-reach", type=int, help="only count pages with active_total_eu_reach >= N (implies --exact)")
+    args = parser.parse_args(argv)
+
+    source = "exact counts" if args.exact or args.min_reach is not None else "counters"
+    if args.min_reach is not None:
+        source += f", pages with reach >= {args.min_reach:,}"
+    rates = RateTracker(args.window)
+    conn = get_conn()
+    try:
+        while True:
+            snapshot = fetch_status_snapshot(conn, exact=args.exact, min_reach=args.min_reach)
+            rates.add(time.monotonic(), {
+                label: _sum(snapshot.get(key, {}), done + failed)
+                for label, key, _, _, done, failed in STAGES
+            })
+            if args.once:
+                print(render(snapshot, rates, source))
+                return 0
+            sys.stdout.write("\033[H\033[2J" + render(snapshot, rates, source, args.interval) + "\n")
+            sys.stdout.flush()
+            time.sleep(args.interval)
+    except KeyboardInterrupt:
+        return 0
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,52 @@
+"""
+Sustainable Graph API calls per hour, per token, from the usage time series.
+
+    python -m tools.token_usage_report --hours 24 --ceiling 90
+
+For every sample, our calls in the trailing hour divided by the usage % Meta
+reported gives the calls one percent of the token's budget buys; the median of
+that times --ceiling (the proactive rotation threshold) is the hourly rate a
+token can sustain without being rotated out. Needs db_migrate_token_usage.py
+and a pipeline run that recorded samples.
+"""
+import argparse
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from db.postgres_client import get_conn, fetch_token_usage_report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Per-token usage and sustainable calls per hour")
+    parser.add_argument("--hours", type=int, default=24, help="history to analyse")
+    parser.add_argument("--ceiling", type=float, default=90, help="usage %% a token should stay under")
+    args = parser.parse_args(argv)
+
+    conn = get_conn()
+    try:
+        rows = fetch_token_usage_report(conn, args.hours)
+    finally:
+        conn.close()
+
+    print(f"{'ID':<4} {'TOKEN':<12} {'STATUS':<9} {'SAMPLES':>8} {'CALLS':>8} {'PEAK%':>6} {'NOW%':>6} "
+          f"{'CALLS/1%':>9} {'SUSTAINABLE/h':>14}")
+    print("-" * 84)
+    pool = 0
+    for token_id, token, status, samples, calls, peak, predicted, per_pct in rows:
+        sustainable = per_pct * args.ceiling if per_pct else None
+        if sustainable and status != 'INVALID':
+            pool += sustainable
+        print(f"{token_id:<4} {'...' + token[-8:]:<12} {status:<9} {samples:>8,} {calls:>8,} "
+              f"{(peak if peak is not None else '-'):>6} {predicted:>6} "
+              f"{(f'{per_pct:.1f}' if per_pct else '-'):>9} "
+              f"{(f'{sustainable:,.0f}' if sustainable else '-'):>14}")
+    print("-" * 84)
+    print(f"Pool: ~{pool:,.0f} calls/hour sustainable at {args.ceiling:g}% usage "
+          f"(tokens without enough samples not counted).")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
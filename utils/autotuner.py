@@ -0,0 +1,200 @@
+"""
+Runtime concurrency autotuner for the TERMS / PAGES / MEDIA stages.
+
+Each stage gets one ConcurrencyAutotuner. Its executor is sized for the stage's
+upper bound, and the tuner gates how many items actually run at once. Every
+AUTOTUNE_INTERVAL seconds the limit moves (additive increase, multiplicative
+decrease) based on observed latency, error rate, token availability and host
+load, always inside [min_workers, max_workers]. Every change is logged.
+
+With AUTOTUNE_CONCURRENCY disabled the limit is pinned to the fixed value
+from config.settings, so behaviour matches the old fixed pools.
+"""
+import asyncio
+import logging
+import os
+import statistics
+import threading
+import time
+
+from config.settings import (
+    AUTOTUNE_CONCURRENCY, AUTOTUNE_INTERVAL,
+    TERMS_CONCURRENCY, TERMS_CONCURRENCY_MIN, TERMS_CONCURRENCY_MAX,
+    PAGES_CONCURRENCY, PAGES_CONCURRENCY_MIN, PAGES_CONCURRENCY_MAX,
+    MEDIA_CONCURRENCY, MEDIA_CONCURRENCY_MIN, MEDIA_CONCURRENCY_MAX,
+)
+
+logger = logging.getLogger(__name__)
+
+MIN_SAMPLES = 5          # don't judge a window with fewer completed items
+ERROR_RATE_HIGH = 0.10   # back off hard above this
+ERROR_RATE_LOW = 0.02    # only grow below this
+LATENCY_DEGRADED = 2.0   # p50 this many times the best observed p50 → shrink
+LOAD_HIGH = 1.5          # 1-min load average per CPU
+MEM_AVAILABLE_LOW = 0.10 # fraction of RAM still available
+WORKERS_PER_TOKEN = 4    # API stages never run more workers than this per usable token
+
+
+def host_load():
+    """Returns (load_per_cpu, mem_available_ratio); either may be None if unknown."""
+    load = None
+    try:
+        load = os.getloadavg()[0] / (os.cpu_count() or 1)
+    except (AttributeError, OSError):
+        pass
+
+    mem = None
+    try:
+        info = {}
+        with open("/proc/meminfo") as f:
+            for line in f:
+                key, value = line.split(":", 1)
+                info[key] = int(value.split()[0])
+        mem = info["MemAvailable"] / info["MemTotal"]
+    except (OSError, KeyError, ValueError, ZeroDivisionError):
+        pass
+
+    return load, mem
+
+
+class ConcurrencyAutotuner:
+    def __init__(self, stage, initial, min_workers, max_workers, uses_tokens=False,
+                 enabled=AUTOTUNE_CONCURRENCY, interval=AUTOTUNE_INTERVAL):
+        if not enabled:
+            min_workers = max_workers = initial
+        self.stage = stage
+        self.min_workers = max(1, min_workers)
+        self.max_workers = max(self.min_workers, max_workers)
+        self.limit = min(max(initial, self.min_workers), self.max_workers)
+        self.uses_tokens = uses_tokens
+        self.enabled = enabled
+        self.interval = interval
+
+        self._cond = threading.Condition()
+        self._active = 0
+        self._latencies = []
+        self._errors = 0
+        self._saturated = False  # someone had to wait for a slot during this window
+        self._best_p50 = None
+        self._last_adjust = time.monotonic()
+
+    # --- Gating ---
+
+    def run(self, fn, *args, **kwargs):
+        """Run fn inside a slot (thread pools). A False return or an exception counts as an error."""
+        with self._cond:
+            if self._active >= self.limit:
+                self._saturated = True
+            while self._active >= self.limit:
+                self._cond.wait()
+            self._active += 1
+
+        start = time.monotonic()
+        ok = False
+        try:
+            result = fn(*args, **kwargs)
+            ok = result is not False
+            return result
+        finally:
+            with self._cond:
+                self._active -= 1
+                self._cond.notify()
+            self.record(time.monotonic() - start, ok)
+
+    async def wait_turn(self, index):
+        """Async workers: worker `index` only takes items while it is below the current limit."""
+        while index >= self.limit:
+            self._saturated = True
+            await asyncio.sleep(1)
+
+    # --- Observations ---
+
+    def record(self, latency, ok):
+        with self._cond:
+            self._latencies.append(latency)
+            if not ok:
+                self._errors += 1
+            due = self.enabled and time.monotonic() - self._last_adjust >= self.interval
+        if due:
+            self.adjust()
+
+    def adjust(self):
+        with self._cond:
+            latencies, errors, saturated = self._latencies, self._errors, self._saturated
+            if len(latencies) < MIN_SAMPLES:
+                return
+            self._latencies, self._errors, self._saturated = [], 0, False
+            self._last_adjust = time.monotonic()
+
+        error_rate = errors / len(latencies)
+        p50 = statistics.median(latencies)
+        if self._best_p50 is None or p50 < self._best_p50:
+            self._best_p50 = p50
+        else:
+            # Let the reference drift up slowly so one lucky window doesn't pin us down forever
+            self._best_p50 *= 1.05
+
+        load, mem = host_load()
+        tokens = self._available_tokens() if self.uses_tokens else None
+
+        old = self.limit
+        new, reason = old, None
+        if error_rate > ERROR_RATE_HIGH:
+            new, reason = int(old * 0.7), f"error rate {error_rate:.0%}"
+        elif load is not None and load > LOAD_HIGH:
+            new, reason = int(old * 0.8), f"host load {load:.2f}/cpu"
+        elif mem is not None and mem < MEM_AVAILABLE_LOW:
+            new, reason = int(old * 0.8), f"memory available {mem:.0%}"
+        elif tokens is not None and old > max(1, tokens * WORKERS_PER_TOKEN):
+            new, reason = max(1, tokens * WORKERS_PER_TOKEN), f"{tokens} usable token(s)"
+        elif p50 > self._best_p50 * LATENCY_DEGRADED:
+            new, reason = old - 1, f"latency p50 {p50:.2f}s vs best {self._best_p50:.2f}s"
+        elif saturated and error_rate < ERROR_RATE_LOW and (tokens is None or old < tokens * WORKERS_PER_TOKEN):
+            new, reason = old + 1, "healthy and saturated"
+
+        new = min(max(new, self.min_workers), self.max_workers)
+        if new == old:
+            return
+
+        with self._cond:
+            self.limit = new
+            self._cond.notify_all()
+        logger.info(
+            f"[Autotune] {self.stage}: {old} → {new} workers ({reason}; "
+            f"p50={p50:.2f}s, errors={error_rate:.0%}, load={_fmt(load)}, "
+            f"mem_avail={_fmt(mem)}, tokens={tokens if tokens is not None else '-'})"
+        )
+
+    def _available_tokens(self):
+        from db.postgres_client import get_conn, count_available_tokens
+        try:
+            conn = get_conn()
+            try:
+                return count_available_tokens(conn)
+            finally:
+                conn.close()
+        except Exception as e:
+            logger.warning(f"[Autotune] Could not count tokens: {e}")
+            return None
+
+
+def _fmt(value):
+    return f"{value:.2f}" if value is not None else "-"
+
+
+# One tuner per stage for the whole process, so what it learned survives between batches
+_STAGES = {
+    "terms": (TERMS_CONCURRENCY, TERMS_CONCURRENCY_MIN, TERMS_CONCURRENCY_MAX, True),
+    "pages": (PAGES_CONCURRENCY, PAGES_CONCURRENCY_MIN, PAGES_CONCURRENCY_MAX, True),
+    "media": (MEDIA_CONCURRENCY, MEDIA_CONCURRENCY_MIN, MEDIA_CONCURRENCY_MAX, False),
+}
+_tuners = {}
+_tuners_lock = threading.Lock()
+
+
+def get_tuner(stage):
+    with _tuners_lock:
+        if stage not in _tuners:
+            initial, lo, hi, uses_tokens = _STAGES[stage]
+            _tuners[stage] = ConcurrencyAutotuner(stage, initial, lo, hi, uses_tokens=uses_tokens)
+        return _tuners[stage]
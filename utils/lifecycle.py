@@ -0,0 +1,112 @@
+"""
+Process lifecycle: graceful SIGTERM drain and lease heartbeats.
+
+On SIGTERM/SIGINT the pipeline stops claiming new work (`shutdown_requested`),
+lets in-flight items finish, gives back whatever it still holds and runs the
+registered flush hooks, so a rolling restart never repeats or loses work.
+"""
+import logging
+import signal
+import threading
+import time
+
+from db.postgres_client import get_conn, renew_leases, release_all_leases, LEASE_SECONDS, WORKER_ID
+
+logger = logging.getLogger(__name__)
+
+# Set once a shutdown was requested. Workers check it before claiming an item.
+shutdown_requested = threading.Event()
+
+_flush_hooks = []
+_flush_lock = threading.Lock()
+
+
+def _handle_signal(signum, frame):
+    if shutdown_requested.is_set():
+        logger.warning("Second shutdown signal received — exiting immediately.")
+        raise SystemExit(1)
+    logger.warning(f"Received {signal.Signals(signum).name} — draining: no new work will be claimed.")
+    shutdown_requested.set()
+
+
+def install_signal_handlers():
+    """Route SIGTERM/SIGINT to a graceful drain. Only possible from the main thread."""
+    if threading.current_thread() is not threading.main_thread():
+        return
+    signal.signal(signal.SIGTERM, _handle_signal)
+    signal.signal(signal.SIGINT, _handle_signal)
+
+
+def register_flush_hook(fn):
+    """Register a callable that writes out buffered state. Run once on drain()."""
+    with _flush_lock:
+        if fn not in _flush_hooks:
+            _flush_hooks.append(fn)
+
+
+def run_flush_hooks():
+    with _flush_lock:
+        hooks = list(_flush_hooks)
+    for fn in hooks:
+        try:
+            fn()
+        except Exception as e:
+            logger.error(f"Flush hook {getattr(fn, '__name__', fn)} failed: {e}")
+
+
+def start_lease_heartbeat(interval=None):
+    """
+    Renew all leases held by this process every `interval` seconds (default: a third
+    of LEASE_SECONDS) from a daemon thread. If the process dies the heartbeat stops
+    and its leases expire, which is what lets other workers reclaim the items.
+    Returns an Event that stops the heartbeat when set.
+    """
+    interval = interval or max(5, LEASE_SECONDS // 3)
+    stop = threading.Event()
+
+    def beat():
+        while not stop.wait(interval):
+            try:
+                conn = get_conn()
+                try:
+                    renew_leases(conn)
+                finally:
+                    conn.close()
+            except Exception as e:
+                logger.error(f"Lease heartbeat failed: {e}")
+
+    threading.Thread(target=beat, daemon=True, name="Lease-Heartbeat").start()
+    return stop
+
+
+def wait_for_threads(threads, grace_seconds):
+    """
+    Join `threads`. Once a shutdown is requested they get `grace_seconds` to finish
+    their in-flight items; after that we stop waiting (drain() releases their leases).
+    """
+    deadline = None
+    for t in threads:
+        while t.is_alive():
+            t.join(timeout=1)
+            if shutdown_requested.is_set():
+                if deadline is None:
+                    deadline = time.time() + grace_seconds
+                elif time.time() > deadline:
+                    logger.warning(f"Grace period of {grace_seconds}s expired; {t.name} still running.")
+                    return False
+    return True
+
+
+def drain():
+    """Release every lease this worker still holds and flush pending writes."""
+    try:
+        conn = get_conn()
+        try:
+            released = release_all_leases(conn)
+        finally:
+            conn.close()
+        if any(released.values()):
+            logger.info(f"Released in-flight items held by {WORKER_ID}: {released}")
+    except Exception as e:
+        logger.error(f"Error releasing leases: {e}")
+    run_flush_hooks()
@@ -0,0 +1,219 @@
+"""
+In-process Prometheus metrics for the long-running pipeline.
+
+Counters, gauges and histograms are plain thread-safe objects; `start_metrics_server()`
+serves them in the Prometheus text format on METRICS_PORT (`/metrics`). Nothing is
+served when METRICS_PORT is 0, and updating a metric is a dict lookup under a lock,
+so the instrumentation stays in place either way.
+
+Status counts come from `pipeline_status_transitions_total` (incremented where the
+steps mark terms/pages) instead of COUNT(*) scans; `rate()` over it gives items per
+second per transition.
+"""
+import logging
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from config.settings import METRICS_PORT
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names, values, extra=None):
+    pairs = list(zip(names, values)) + (extra or [])
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}"
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[n]) for n in self.labelnames)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            lines.extend(self._render_value(key, value))
+        return lines
+
+    def _render_value(self, key, value):
+        return [f"{self.name}{_labels(self.labelnames, key)} {value}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        if not self.labelnames:
+            self._values[()] = 0
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        if not self.labelnames:
+            self._values[()] = 0
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * len(self.buckets), 0, 0.0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[0][i] += 1
+            state[1] += 1
+            state[2] += value
+
+    def _render_value(self, key, value):
+        counts, total, total_sum = value
+        lines = [
+            f"{self.name}_bucket{_labels(self.labelnames, key, [('le', bound)])} {n}"
+            for bound, n in zip(self.buckets, counts)
+        ]
+        lines.append(f"{self.name}_bucket{_labels(self.labelnames, key, [('le', '+Inf')])} {total}")
+        lines.append(f"{self.name}_sum{_labels(self.labelnames, key)} {total_sum}")
+        lines.append(f"{self.name}_count{_labels(self.labelnames, key)} {total}")
+        return lines
+
+
+REGISTRY = []
+
+
+def render():
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+# ─── Pipeline metrics ──────────────────────────────────────────────────────
+
+META_REQUESTS = Counter(
+    "meta_requests_total", "Graph API requests by HTTP status, Meta error code and token suffix",
+    ("status", "code", "token"))
+META_REQUEST_SECONDS = Histogram(
+    "meta_request_duration_seconds", "Graph API request latency by Meta error code and token suffix",
+    ("code", "token"))
+QUEUE_DEPTH = Gauge(
+    "pipeline_queue_depth", "Items waiting in each stage's work queue", ("stage",))
+STATUS_TRANSITIONS = Counter(
+    "pipeline_status_transitions_total", "Items moved to a status, by table and status column",
+    ("table", "column", "status"))
+DB_CONNECTIONS_OPEN = Gauge(
+    "db_connections_open", "Postgres connections currently open by this process")
+DB_CONNECTIONS_IN_USE = Gauge(
+    "db_connections_in_use", "Postgres connections handed out by get_conn() and not closed yet (open minus idle in the pool)")
+DB_CONNECTIONS = Counter(
+    "db_connections_opened_total", "Postgres connections opened by this process")
+BROWSER_PAGES_OPEN = Gauge(
+    "chromium_pages_open", "Playwright pages currently open")
+OPENAI_BATCHES = Gauge(
+    "openai_batches", "OpenAI batches by status (openai_batches table; step 5's last poll when run alone)",
+    ("status",))
+OPENAI_BATCH_STATUSES = ('validating', 'in_progress', 'finalizing', 'completed', 'failed', 'expired', 'cancelled')
+BROWSER_BYTES = Counter(
+    "chromium_bytes_total", "Bytes Chromium transferred for step 4 snapshots, by worker", ("worker",))
+BROWSER_REQUESTS_BLOCKED = Counter(
+    "chromium_requests_blocked_total", "Requests aborted by step 4 resource blocking, by resource type",
+    ("resource_type",))
+BROWSER_RESTARTS = Counter(
+    "chromium_restarts_total", "Step 4 browsers replaced, by reason (navigations, memory, crash)", ("reason",))
+MEDIA_EXTRACTIONS = Counter(
+    "step4_media_extractions_total", "Snapshot media lookups by path (http fast path, browser) and result",
+    ("path", "result"))
+TERM_VISIBLE_SECONDS = Histogram(
+    "term_pages_visible_seconds", "Time from a search term's insert to its pages being stored",
+    buckets=(1, 5, 15, 30, 60, 120, 300, 600, 1800, 3600, 7200))
+TOKEN_BUDGET_IN_FLIGHT = Gauge(
+    "token_budget_in_flight", "Graph API requests holding a token budget slot, by stage", ("stage",))
+TOKEN_BUDGET_WAIT_SECONDS = Histogram(
+    "token_budget_wait_seconds", "Time requests waited for a token budget slot, by stage", ("stage",))
+
+
+# ─── Endpoint ──────────────────────────────────────────────────────────────
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] not in ("/metrics", "/"):
+            self.send_error(404)
+            return
+        body = render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # scrapes every few seconds would flood the pipeline log
+
+
+_server = None
+
+
+def start_metrics_server(port=None):
+    """Serve /metrics from a daemon thread. No-op when the port is 0 or already serving."""
+    global _server
+    port = METRICS_PORT if port is None else port
+    if not port or _server is not None:
+        return None
+    _server = ThreadingHTTPServer(("0.0.0.0", port), _MetricsHandler)
+    _server.daemon_threads = True
+    threading.Thread(target=_server.serve_forever, daemon=True, name="Metrics-Server").start()
+    logger.info(f"Metrics available at http://0.0.0.0:{port}/metrics")
+    return _server
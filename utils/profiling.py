@@ -0,0 +1,282 @@
+"""
+Opt-in sampling profiler for pipeline stages.
+
+Two modes, both off by default:
+- whole stage: `--profile step3` (or PROFILE_STAGE=step3) samples every thread
+  of that stage — worker threads and asyncio tasks included — for the whole run.
+- always-on: `--profile-sample-rate 0.01` (or PROFILE_SAMPLE_RATE) profiles a
+  random ~1% of items, only while they are being processed.
+
+Samples are wall-clock (`sys._current_frames()` from a background thread), so
+time spent waiting on Meta, Postgres or Chromium shows up too. On exit each
+profiled stage is written to PROFILE_DIR as collapsed stacks
+(`<stage>-<timestamp>-<pid>.folded`, the input format of flamegraph.pl and
+speedscope) and as a self-contained SVG flamegraph.
+"""
+import asyncio
+import atexit
+import functools
+import html
+import logging
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+
+from config.settings import PROFILE_STAGE, PROFILE_SAMPLE_RATE, PROFILE_DIR, PROFILE_INTERVAL_MS
+
+logger = logging.getLogger(__name__)
+
+STAGES = ("step2", "step3", "step4", "step5", "all")
+
+# Threads are attributed to a stage by name prefix (see thread_name_prefix in the steps)
+STAGE_THREAD_PREFIXES = {
+    "step2": ("Step2",),
+    "step3": ("Step3",),
+    "step4": ("Step4",),
+    "step5": ("Step5",),
+}
+
+
+def _frame_label(frame):
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def _thread_stack(frame):
+    stack = []
+    while frame is not None:
+        stack.append(_frame_label(frame))
+        frame = frame.f_back
+    stack.reverse()
+    return stack
+
+
+def _task_stack(task):
+    """Frames of a suspended task, outermost coroutine first, following cr_await."""
+    stack = []
+    coro = task.get_coro()
+    while coro is not None:
+        frame = getattr(coro, "cr_frame", None) or getattr(coro, "gi_frame", None)
+        if frame is None:
+            break
+        stack.append(_frame_label(frame))
+        coro = getattr(coro, "cr_await", None) or getattr(coro, "gi_yieldfrom", None)
+    return stack
+
+
+class Sampler:
+    def __init__(self, interval_ms=PROFILE_INTERVAL_MS):
+        self.interval = interval_ms / 1000
+        self.stages = set()         # stages profiled for the whole run
+        self.item_threads = {}      # thread id → stage (always-on mode: items being sampled)
+        self.item_tasks = {}        # asyncio task → stage
+        self.loops = {}             # event loop → stage, for task sampling
+        self.counts = {}            # stage → Counter
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def ensure_running(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, daemon=True, name="Profiler")
+                self._thread.start()
+
+    def _run(self):
+        me = threading.get_ident()
+        while True:
+            time.sleep(self.interval)
+            if not self.stages and not self.item_threads and not self.item_tasks:
+                continue
+            try:
+                self._sample(me)
+            except Exception:
+                pass  # never let the profiler take the pipeline down
+
+    def _stage_for_thread(self, name):
+        for stage in self.stages:
+            if stage == "all":
+                return stage
+            if name.startswith(STAGE_THREAD_PREFIXES.get(stage, ())):
+                return stage
+        return None
+
+    def _sample(self, me):
+        names = {t.ident: t.name for t in threading.enumerate()}
+        frames = sys._current_frames()
+        with self._lock:
+            for ident, frame in frames.items():
+                if ident == me:
+                    continue
+                name = names.get(ident, "?")
+                stage = self.item_threads.get(ident) or self._stage_for_thread(name)
+                if stage:
+                    key = ";".join([f"thread:{name.split('_')[0]}"] + _thread_stack(frame))
+                    self.counts.setdefault(stage, Counter())[key] += 1
+
+            for loop, stage in list(self.loops.items()):
+                try:
+                    tasks = list(asyncio.all_tasks(loop))
+                except RuntimeError:
+                    continue  # task set changed while we iterated; next sample
+                for task in tasks:
+                    whole = stage in self.stages or "all" in self.stages
+                    task_stage = self.item_tasks.get(task, stage if whole else None)
+                    if not task_stage or task.done():
+                        continue
+                    stack = _task_stack(task)
+                    if stack:
+                        key = ";".join([f"task:{task.get_name()}"] + stack)
+                        self.counts.setdefault(task_stage, Counter())[key] += 1
+
+    def write(self):
+        with self._lock:
+            counts, self.counts = self.counts, {}
+        if not counts:
+            return []
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        stamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+        written = []
+        for stage, stacks in counts.items():
+            base = os.path.join(PROFILE_DIR, f"{stage}-{stamp}-{os.getpid()}")
+            with open(base + ".folded", "w") as f:
+                for stack, n in stacks.most_common():
+                    f.write(f"{stack} {n}\n")
+            with open(base + ".svg", "w") as f:
+                f.write(render_flamegraph(stacks, f"{stage} — {sum(stacks.values())} samples"))
+            written.append(base)
+        logger.info(f"Profiles written: {', '.join(p + '.folded/.svg' for p in written)}")
+        return written
+
+
+_sampler = Sampler()
+_sample_rate = 0.0
+
+
+def start_profiling(stage=None, sample_rate=None):
+    """Enable whole-stage profiling for `stage` and/or always-on item sampling at `sample_rate`."""
+    global _sample_rate
+    stage = stage if stage is not None else PROFILE_STAGE
+    _sample_rate = sample_rate if sample_rate is not None else PROFILE_SAMPLE_RATE
+    if stage:
+        if stage not in STAGES:
+            raise ValueError(f"Unknown profile stage: {stage} (choose from {', '.join(STAGES)})")
+        _sampler.stages.add(stage)
+        logger.info(f"Profiling stage '{stage}' every {_sampler.interval * 1000:.0f} ms.")
+    if _sample_rate:
+        logger.info(f"Always-on profiling of {_sample_rate:.1%} of items.")
+    if stage or _sample_rate:
+        _sampler.ensure_running()
+        atexit.register(_sampler.write)
+
+
+def register_loop(loop, stage):
+    """Let the sampler walk the asyncio tasks of `loop` (attributed to `stage`)."""
+    with _sampler._lock:
+        _sampler.loops[loop] = stage
+
+
+def unregister_loop(loop):
+    with _sampler._lock:
+        _sampler.loops.pop(loop, None)
+
+
+def profiled_item(stage):
+    """
+    Decorator for per-item entry points (process_page_ads, process_page_media, ...).
+    With always-on sampling, a random PROFILE_SAMPLE_RATE fraction of calls is
+    sampled for as long as the call runs. Costs one random() per call otherwise.
+    """
+    def wrap(fn):
+        if asyncio.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                if not _sample_rate or random.random() >= _sample_rate:
+                    return await fn(*args, **kwargs)
+                task = asyncio.current_task()
+                with _sampler._lock:
+                    _sampler.item_tasks[task] = stage
+                    _sampler.loops.setdefault(asyncio.get_running_loop(), stage)
+                try:
+                    return await fn(*args, **kwargs)
+                finally:
+                    with _sampler._lock:
+                        _sampler.item_tasks.pop(task, None)
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not _sample_rate or random.random() >= _sample_rate:
+                return fn(*args, **kwargs)
+            ident = threading.get_ident()
+            with _sampler._lock:
+                _sampler.item_threads[ident] = stage
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                with _sampler._lock:
+                    _sampler.item_threads.pop(ident, None)
+        return wrapper
+    return wrap
+
+
+def add_profiling_args(parser):
+    parser.add_argument("--profile", choices=STAGES, default=PROFILE_STAGE or None,
+                        help="sample this stage for the whole run and write a flamegraph")
+    parser.add_argument("--profile-sample-rate", type=float, default=PROFILE_SAMPLE_RATE,
+                        help="always-on mode: fraction of items to profile (e.g. 0.01)")
+
+
+def start_from_args(args):
+    start_profiling(args.profile, args.profile_sample_rate)
+
+
+# ─── Flamegraph rendering ──────────────────────────────────────────────────
+
+def render_flamegraph(stacks, title, width=1200, row_height=16):
+    """Minimal SVG flamegraph (root at the bottom) from collapsed-stack counts."""
+    root = {"children": {}, "count": 0}
+    for stack, n in stacks.items():
+        node = root
+        node["count"] += n
+        for frame in stack.split(";"):
+            node = node["children"].setdefault(frame, {"children": {}, "count": 0})
+            node["count"] += n
+
+    def depth(node):
+        return 1 + max((depth(c) for c in node["children"].values()), default=0)
+
+    levels = depth(root) - 1
+    height = (levels + 2) * row_height
+    total = root["count"] or 1
+    rects = []
+
+    def draw(node, x, level):
+        for name, child in sorted(node["children"].items()):
+            w = child["count"] / total * width
+            if w >= 0.5:
+                y = height - (level + 2) * row_height
+                hue = 20 + (hash(name) % 40)
+                label = html.escape(name)
+                pct = child["count"] / total
+                text = html.escape(name[: int(w / 7)]) if w > 30 else ""
+                rects.append(
+                    f'<g><title>{label} ({child["count"]} samples, {pct:.1%})</title>'
+                    f'<rect x="{x:.1f}" y="{y}" width="{w:.1f}" height="{row_height - 1}" '
+                    f'fill="hsl({hue},85%,60%)"/>'
+                    f'<text x="{x + 3:.1f}" y="{y + row_height - 4}">{text}</text></g>'
+                )
+                draw(child, x, level + 1)
+            x += w
+
+    draw(root, 0.0, 0)
+    return (
+        f'<svg xmlns="http://www.w3.org/2000/svg" width="{width}" height="{height}" '
+        f'font-family="monospace" font-size="11">'
+        f'<text x="4" y="{row_height - 4}" font-size="13">{html.escape(title)}</text>'
+        + "".join(rects)
+        + "</svg>\n"
+    )
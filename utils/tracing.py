@@ -0,0 +1,328 @@
+"""
+Per-item tracing (OpenTelemetry-style spans, no SDK dependency).
+
+Every term and page gets a deterministic trace id (hash of "term:<id>" /
+"page:<id>"), so the step 3 fetch, step 4 scrape and step 5 classification of
+one page land in the same trace even when they run in different processes or
+days apart. Step 2 emits a `page.discovered` span in each new page's trace that
+links back to the term's trace.
+
+Spans nest through contextvars (works for threads and asyncio tasks alike) and
+are exported in batches, selected by TRACE_EXPORT:
+- ""                                   tracing off (spans cost one contextvar lookup)
+- "file:traces/spans.jsonl"            one JSON span per line
+- "otlp:http://localhost:4318"         OTLP/HTTP JSON to a collector (Jaeger, Tempo, ...)
+"""
+import asyncio
+import atexit
+import contextvars
+import functools
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+
+from config.settings import TRACE_EXPORT, TRACE_SERVICE_NAME, TRACE_BATCH_SIZE, TRACE_FLUSH_INTERVAL
+
+logger = logging.getLogger(__name__)
+
+_current_span = contextvars.ContextVar("current_span", default=None)
+
+# Snapshot URLs and paging.next links carry the token as a query parameter
+_ACCESS_TOKEN = re.compile(r"(access_token=)[^&\"'\s\\]+")
+
+
+def redact_tokens(text):
+    """text with every access_token=... value replaced, for span attributes, logs and recordings."""
+    return _ACCESS_TOKEN.sub(r"\1REDACTED", text) if text else text
+
+
+def trace_id_for(kind, item_id):
+    """Deterministic 128-bit trace id for a term or page."""
+    return hashlib.sha256(f"{kind}:{item_id}".encode()).hexdigest()[:32]
+
+
+def _new_span_id():
+    return os.urandom(8).hex()
+
+
+class Span:
+    __slots__ = ("name", "trace_id", "span_id", "parent_id", "start_ns", "end_ns",
+                 "attributes", "links", "status", "_token")
+
+    def __init__(self, name, trace_id, parent_id=None, attributes=None, links=None):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = _new_span_id()
+        self.parent_id = parent_id
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+        self.attributes = dict(attributes or {})
+        self.links = links or []
+        self.status = "ok"
+        self._token = None
+
+    def set(self, key, value):
+        self.attributes[key] = value
+
+    def error(self, message):
+        self.status = "error"
+        # Request errors quote their URL, token included
+        self.attributes["error.message"] = redact_tokens(str(message))[:500]
+
+    def end(self):
+        if self.end_ns is not None:
+            return
+        self.end_ns = time.time_ns()
+        if self._token is not None:
+            try:
+                _current_span.reset(self._token)
+            except ValueError:
+                pass  # ended from another context; the span is still recorded
+            self._token = None
+        _exporter.add(self)
+
+    def to_dict(self):
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "start_ns": self.start_ns,
+            "end_ns": self.end_ns,
+            "duration_ms": round((self.end_ns - self.start_ns) / 1e6, 3),
+            "status": self.status,
+            "attributes": self.attributes,
+            "links": self.links,
+        }
+
+
+class _NoopSpan:
+    def set(self, key, value):
+        pass
+
+    def error(self, message):
+        pass
+
+    def end(self):
+        pass
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+def enabled():
+    return _exporter.target is not None
+
+
+def start_span(name, trace_id=None, links=None, **attributes):
+    """
+    Start a span as the child of the current one (or a new root if `trace_id` is
+    given or there is no current span). Becomes current until `end()`.
+    """
+    if not enabled():
+        return NOOP_SPAN
+    parent = _current_span.get()
+    if trace_id is not None or parent is None:
+        span = Span(name, trace_id or os.urandom(16).hex(), None, attributes, links)
+    else:
+        span = Span(name, parent.trace_id, parent.span_id, attributes, links)
+    span._token = _current_span.set(span)
+    return span
+
+
+@contextmanager
+def span(name, trace_id=None, links=None, **attributes):
+    s = start_span(name, trace_id, links, **attributes)
+    try:
+        yield s
+    except BaseException as e:
+        s.error(e)
+        raise
+    finally:
+        s.end()
+
+
+def current_span():
+    """The active span, or a no-op one, for adding attributes from deep inside a step."""
+    return _current_span.get() or NOOP_SPAN
+
+
+def link_to(kind, item_id):
+    """A span link pointing at the root of another item's trace."""
+    return {"trace_id": trace_id_for(kind, item_id), "span_id": None}
+
+
+def emit_span(name, trace_id, links=None, **attributes):
+    """Record an instantaneous span in another item's trace without changing the current span."""
+    if not enabled():
+        return
+    s = Span(name, trace_id, None, attributes, links)
+    s.end_ns = s.start_ns
+    _exporter.add(s)
+
+
+def traced_item(kind, name, id_of):
+    """
+    Decorator for per-item entry points: runs the call as a root span in the item's
+    trace. `id_of(*args)` returns the term/page id. A False return marks the span as failed.
+    """
+    def wrap(fn):
+        if asyncio.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                if not enabled():
+                    return await fn(*args, **kwargs)
+                item_id = id_of(*args)
+                with span(name, trace_id_for(kind, item_id), **{f"{kind}.id": str(item_id)}) as s:
+                    result = await fn(*args, **kwargs)
+                    if result is False:
+                        s.status = "error"
+                    return result
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not enabled():
+                return fn(*args, **kwargs)
+            item_id = id_of(*args)
+            with span(name, trace_id_for(kind, item_id), **{f"{kind}.id": str(item_id)}) as s:
+                result = fn(*args, **kwargs)
+                if result is False:
+                    s.status = "error"
+                return result
+        return wrapper
+    return wrap
+
+
+def traced_db(name):
+    """Decorator for postgres_client helpers: a child span with the rows affected/returned."""
+    def wrap(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if _current_span.get() is None:
+                return fn(*args, **kwargs)
+            with span(name, **{"db.system": "postgresql", "db.operation": fn.__name__}) as s:
+                result = fn(*args, **kwargs)
+                if isinstance(result, bool):
+                    s.set("db.result", result)
+                elif isinstance(result, int):
+                    s.set("db.rows", result)
+                elif isinstance(result, (list, tuple, set)):
+                    s.set("db.rows", len(result))
+                return result
+        return wrapper
+    return wrap
+
+
+# ─── Export ────────────────────────────────────────────────────────────────
+
+def _otlp_value(value):
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def _otlp_payload(spans):
+    otlp_spans = []
+    for s in spans:
+        item = {
+            "traceId": s.trace_id,
+            "spanId": s.span_id,
+            "name": s.name,
+            "kind": 1,
+            "startTimeUnixNano": str(s.start_ns),
+            "endTimeUnixNano": str(s.end_ns),
+            "attributes": [{"key": k, "value": _otlp_value(v)} for k, v in s.attributes.items()],
+            "status": {"code": 2 if s.status == "error" else 1},
+        }
+        if s.parent_id:
+            item["parentSpanId"] = s.parent_id
+        # OTLP links need a span id; item links only know the trace, so those become attributes
+        links = [{"traceId": l["trace_id"], "spanId": l["span_id"]} for l in s.links if l["span_id"]]
+        if links:
+            item["links"] = links
+        for l in s.links:
+            if not l["span_id"]:
+                item["attributes"].append({"key": "link.trace_id", "value": {"stringValue": l["trace_id"]}})
+        otlp_spans.append(item)
+    return {
+        "resourceSpans": [{
+            "resource": {"attributes": [
+                {"key": "service.name", "value": {"stringValue": TRACE_SERVICE_NAME}},
+                {"key": "service.instance.id", "value": {"stringValue": f"{os.uname().nodename}:{os.getpid()}"}},
+            ]},
+            "scopeSpans": [{"scope": {"name": "meta_ads_pipeline"}, "spans": otlp_spans}],
+        }]
+    }
+
+
+class Exporter:
+    """Buffers finished spans and writes them out in batches from a daemon thread."""
+
+    def __init__(self, target):
+        self.target = None
+        self.location = None
+        if target:
+            kind, _, location = target.partition(":")
+            if kind not in ("file", "otlp") or not location:
+                raise ValueError(f"Invalid TRACE_EXPORT '{target}' (use file:<path> or otlp:<url>)")
+            self.target, self.location = kind, location
+        self._buffer = []
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+
+    def add(self, s):
+        with self._lock:
+            self._buffer.append(s)
+            if self._thread is None:
+                self._start()
+            if len(self._buffer) >= TRACE_BATCH_SIZE:
+                self._wake.set()
+
+    def _start(self):
+        from utils.lifecycle import register_flush_hook  # lifecycle imports postgres_client, which imports us
+        register_flush_hook(self.flush)
+        atexit.register(self.flush)
+        self._thread = threading.Thread(target=self._run, daemon=True, name="Trace-Exporter")
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            self._wake.wait(TRACE_FLUSH_INTERVAL)
+            self._wake.clear()
+            self.flush()
+
+    def flush(self):
+        with self._lock:
+            batch, self._buffer = self._buffer, []
+        if not batch:
+            return
+        try:
+            if self.target == "file":
+                lines = "".join(json.dumps(s.to_dict(), default=str) + "\n" for s in batch)
+                directory = os.path.dirname(self.location)
+                if directory:
+                    os.makedirs(directory, exist_ok=True)
+                with open(self.location, "a", encoding="utf-8") as f:
+                    f.write(lines)
+            else:
+                import requests
+                url = self.location.rstrip("/")
+                if not url.endswith("/v1/traces"):
+                    url += "/v1/traces"
+                requests.post(url, json=_otlp_payload(batch), timeout=10).raise_for_status()
+        except Exception as e:
+            logger.warning(f"Dropped {len(batch)} spans: export to {self.target}:{self.location} failed ({e})")
+
+
+_exporter = Exporter(TRACE_EXPORT)